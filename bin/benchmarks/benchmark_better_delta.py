@@ -0,0 +1,56 @@
+#!/bin/env python
+"""
+Times better_delta against the legacy implementation on the sample images, one frame at
+a time and as a stack of frames sharing one cal frame.
+
+usage: benchmark_better_delta.py [stack_size [repeats]]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import cv2
+
+import lib.cluster_utilities as lcu
+import lib.calibration_cache as lcc
+import etc.fishface_config as ff_conf
+
+stack_size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+data = cv2.imread(os.path.join(ff_conf.LIB, 'sample-DATA.jpg'), 0)
+cal = cv2.imread(os.path.join(ff_conf.LIB, 'sample-CAL.jpg'), 0)
+cal_frame = lcc.CalibrationFrame.from_array(cal)
+stack = np.array([data] * stack_size)
+out = np.empty_like(stack)
+work = lcu.delta_work_buffers(stack.shape)
+
+if not np.array_equal(lcu.better_delta(stack, *cal_frame.arrays)[0],
+                      lcu.legacy_better_delta(data, cal)):
+    print 'better_delta output differs from legacy_better_delta!'
+    sys.exit(1)
+
+
+def best_per_frame(func, frames):
+    return min(timeit.repeat(func, number=1, repeat=repeats)) / frames * 1000
+
+
+timings = [
+    ('legacy, per frame',
+     best_per_frame(lambda: [lcu.legacy_better_delta(frame, cal) for frame in stack],
+                    stack_size)),
+    ('better_delta, per frame',
+     best_per_frame(lambda: [lcu.better_delta(frame, *cal_frame.arrays) for frame in stack],
+                    stack_size)),
+    ('better_delta, stack of {}'.format(stack_size),
+     best_per_frame(lambda: lcu.better_delta(stack, *cal_frame.arrays), stack_size)),
+    ('better_delta, stack of {} into preallocated output'.format(stack_size),
+     best_per_frame(lambda: lcu.better_delta(stack, *cal_frame.arrays, out=out), stack_size)),
+    ('better_delta, stack of {}, reusing output and work buffers'.format(stack_size),
+     best_per_frame(lambda: lcu.better_delta(stack, *cal_frame.arrays, out=out, work=work),
+                    stack_size)),
+]
+
+for name, milliseconds in timings:
+    print '{:<60} {:8.3f} ms/frame'.format(name, milliseconds)
@@ -0,0 +1,48 @@
+#!/bin/env python
+"""
+Times brightness_offset at several sampling strides against the scipy mstats.mode
+computation it replaced, on the sample images, and checks that the offsets agree.
+
+usage: benchmark_brightness_offset.py [repeats]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import cv2
+from scipy import stats
+
+import lib.cluster_utilities as lcu
+import etc.fishface_config as ff_conf
+
+repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+data = cv2.imread(os.path.join(ff_conf.LIB, 'sample-DATA.jpg'), 0)
+cal = cv2.imread(os.path.join(ff_conf.LIB, 'sample-CAL.jpg'), 0)
+diff = np.empty(data.shape, dtype=np.int16)
+
+
+def mstats_offset():
+    return int(stats.mstats.mode(data.astype(np.int16) - cal.astype(np.int16),
+                                 axis=None)[0][0])
+
+
+def best_ms(func):
+    return min(timeit.repeat(func, number=1, repeat=repeats)) * 1000
+
+
+expected = mstats_offset()
+
+timings = [('mstats.mode', best_ms(mstats_offset), expected),
+           ('bincount, stride 1, work buffer',
+            best_ms(lambda: lcu.brightness_offset(data, cal, diff=diff)),
+            lcu.brightness_offset(data, cal, diff=diff))]
+for stride in (1, 2, 4, 8):
+    timings.append(('bincount, stride {}'.format(stride),
+                    best_ms(lambda: lcu.brightness_offset(data, cal, stride=stride)),
+                    lcu.brightness_offset(data, cal, stride=stride)))
+
+for name, milliseconds, offset in timings:
+    print '{:<40} {:8.3f} ms/frame   offset {:4d}{}'.format(
+        name, milliseconds, offset, '' if offset == expected else '   DIFFERS')
@@ -0,0 +1,159 @@
+#!/bin/env python
+"""
+Replays capture-rate results.post_image traffic in one process while other processes
+store analyses as fast as they can, and reports the latency of each kind of write and
+how many failed on a locked database.
+
+Nothing touches the configured database.  The benchmark runs against a throwaway test
+database on the configured engine, the way the test runner makes one: a file in a
+temporary directory for SQLite, or test_<NAME> on the PostgreSQL server.  It's destroyed
+afterwards, and the image files go under a temporary MEDIA_ROOT that is removed too.
+
+usage: benchmark_database_concurrency.py [seconds [captures_per_second [analysis_processes]]]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+import numpy as np
+import cv2
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lib.django.django_fishface.settings')
+from django.conf import settings
+import django.db
+import django.core.files.base as dcfb
+import django.utils.timezone as dut
+from south.management.commands import patch_for_test_db_setup
+
+import etc.fishface_config as ff_conf
+
+# nothing here should queue celery tasks
+ff_conf.STREAMING_ANALYSIS = False
+
+import lib.django.djff.models as dm
+import lib.workers.results_tasks as results
+
+seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+capture_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 4
+analysis_processes = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+ANALYSES_PER_CHUNK = ff_conf.ML_STAGE_1_IMAGES_PER_CHUNK
+
+with open(os.path.join(ff_conf.LIB, 'sample-DATA.jpg'), 'rb') as sample_file:
+    IMAGE_DATA = sample_file.read()
+
+CONTOUR = cv2.ellipse2Poly((256, 192), (40, 15), 30, 0, 360, 2).reshape(-1, 1, 2)
+MOMENTS = cv2.moments(CONTOUR)
+HU_MOMENTS = cv2.HuMoments(MOMENTS)
+
+
+def close_connections():
+    for connection in django.db.connections.all():
+        connection.close()
+
+
+def timed(func, *args):
+    started = time.time()
+    try:
+        func(*args)
+    except django.db.OperationalError:
+        return None
+    return time.time() - started
+
+
+def capture(xp, cjr, report):
+    latencies = list()
+    next_capture = time.time()
+    stop = next_capture + seconds
+    while next_capture < stop:
+        time.sleep(max(0, next_capture - time.time()))
+        meta = {'xp_id': xp.id, 'cjr_id': cjr.id, 'is_cal_image': False,
+                'capture_timestamp': time.time(), 'voltage': 0, 'current': 0}
+        latencies.append(timed(results.post_image, IMAGE_DATA, meta))
+        next_capture += 1.0 / capture_rate
+
+    latencies.append(timed(results.write_behind.flush))
+    report.put(('post_image', latencies))
+
+
+def analyze(image_ids, report):
+    latencies = list()
+    stop = time.time() + seconds
+    while time.time() < stop:
+        metas = [{'image_id': image_id, 'timestamp': time.time(),
+                  'largest_contour': CONTOUR, 'moments': MOMENTS, 'hu_moments': HU_MOMENTS}
+                 for image_id in image_ids]
+        latencies.append(timed(results.store_analyses, metas))
+    report.put(('store_analyses', latencies))
+
+
+def summarize(name, latencies):
+    failures = latencies.count(None)
+    done = np.array([latency for latency in latencies if latency is not None]) * 1000
+    if not len(done):
+        print '{:<16} {:>7d} writes, all failed'.format(name, len(latencies))
+        return
+    print '{:<16} {:>7d} writes {:>6d} locked  mean {:8.2f} ms  p95 {:8.2f} ms  max {:8.2f} ms'.format(
+        name, len(latencies), failures, done.mean(), np.percentile(done, 95), done.max())
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='fishface_benchmark_')
+    settings.MEDIA_ROOT = os.path.join(work_dir, 'media')
+
+    # the tables are made straight from the models, as in the tests
+    patch_for_test_db_setup()
+    connection = django.db.connections['default']
+    if connection.vendor == 'sqlite':
+        # the processes need to share it, so it can't be the usual in-memory one
+        connection.settings_dict['TEST_NAME'] = os.path.join(work_dir, 'benchmark.db')
+    real_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        species = dm.Species.objects.create(name='benchmarkus databasii', shortname='BNCH')
+        xp = dm.Experiment.objects.create(name='TEST_DATA database concurrency benchmark',
+                                          xp_start=dut.now(), species=species)
+        cjr = dm.CaptureJobRecord.objects.create(xp=xp, job_start=dut.now())
+
+        # images for the analysis processes to store analyses of
+        image_ids = list()
+        for i in range(ANALYSES_PER_CHUNK):
+            image = dm.Image(xp=xp, cjr=cjr, capture_timestamp=dut.now())
+            image.image_file.save(image.image_file.name, dcfb.ContentFile(IMAGE_DATA))
+            image_ids.append(image.id)
+
+        print 'database: {} {}   {} s at {} captures/s alongside {} analysis processes'.format(
+            connection.vendor, connection.settings_dict['NAME'], seconds, capture_rate,
+            analysis_processes)
+
+        close_connections()
+        report = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=capture, args=(xp, cjr, report))]
+        workers += [multiprocessing.Process(target=analyze, args=(image_ids, report))
+                    for i in range(analysis_processes)]
+        for worker in workers:
+            worker.start()
+
+        latencies = dict()
+        for worker in workers:
+            name, worker_latencies = report.get()
+            latencies.setdefault(name, list()).extend(worker_latencies)
+        for worker in workers:
+            worker.join()
+
+        for name in sorted(latencies):
+            summarize(name, latencies[name])
+        print 'analyses stored per second: {:.1f}'.format(
+            ANALYSES_PER_CHUNK * (len(latencies.get('store_analyses', [])) -
+                                  latencies.get('store_analyses', []).count(None)) / seconds)
+    finally:
+        close_connections()
+        connection.creation.destroy_test_db(real_name, verbosity=0)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/bin/env python
+"""
+Runs a fixed set of delta images through every ellipse search backend and reports the
+latency per image, both searching the images one at a time and as one stack.  The
+image set is the sample data image plus copies of it with the fish turned and shifted,
+all against the sample cal image.
+
+Every exact backend has to find the same ellipses as cv2.matchTemplate does.  The
+pyramid backends trade accuracy for speed, so for them the 'off' column counts the
+images where they didn't land within PYRAMID_ANGLE_TOLERANCE degrees and 2 **
+pyramid_levels pixels of the cv2.matchTemplate ellipse.  Pruning has to find the same
+ellipses as the same search without it, and the 'avoided' column is the mean number of
+coarse template matches it skipped per image.
+
+usage: benchmark_ellipse_search.py [images [repeats]]
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import cv2
+
+import lib.cluster_utilities as lcu
+import lib.ellipse_search as les
+import etc.fishface_config as ff_conf
+
+image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+ENVELOPE = {
+    'major_min': 30, 'major_max': 50,
+    'ratio_min': 2.0, 'ratio_max': 3.0,
+    'color_min': 40, 'color_max': 80,
+}
+
+CONFIGS = [
+    ('cv2', les.SearchConfig(backend='cv2', foreground_roi=False)),
+    ('fft', les.SearchConfig(backend='fft', foreground_roi=False)),
+    ('cv2 + roi', les.SearchConfig(backend='cv2', foreground_roi=True)),
+    ('fft + roi', les.SearchConfig(backend='fft', foreground_roi=True)),
+    ('pyramid x1 + roi', les.SearchConfig(backend='pyramid', pyramid_levels=1,
+                                          foreground_roi=True)),
+    ('pyramid x2 + roi', les.SearchConfig(backend='pyramid', pyramid_levels=2,
+                                          foreground_roi=True)),
+    ('cv2 + roi + prune', les.SearchConfig(backend='cv2', foreground_roi=True, prune=True)),
+    ('fft + prune', les.SearchConfig(backend='fft', foreground_roi=False, prune=True)),
+    ('fft + roi + prune', les.SearchConfig(backend='fft', foreground_roi=True, prune=True)),
+    ('pyramid x1 + roi + prune', les.SearchConfig(backend='pyramid', pyramid_levels=1,
+                                                  foreground_roi=True, prune=True)),
+]
+
+data = cv2.imread(os.path.join(ff_conf.LIB, 'sample-DATA.jpg'), 0)
+cal = cv2.imread(os.path.join(ff_conf.LIB, 'sample-CAL.jpg'), 0)
+delta = lcu.better_delta(data, cal)
+
+# the fish turns and moves a little from one image to the next
+deltas = np.array([np.roll(cv2.warpAffine(delta, cv2.getRotationMatrix2D((170, 126), 13 * i, 1),
+                                          tuple(reversed(delta.shape))), 5 * i, axis=1)
+                   for i in range(image_count)])
+
+PYRAMID_ANGLE_TOLERANCE = les.COARSE_ANGLES[1] - les.COARSE_ANGLES[0]
+
+# draw the templates up front so that no backend pays for them
+les.template_bank(ENVELOPE)
+les.template_bank(ENVELOPE, scale=2)
+les.template_bank(ENVELOPE, scale=4)
+
+
+def ms_per_image(func):
+    return min(timeit.repeat(func, number=1, repeat=repeats)) / image_count * 1000
+
+
+def images_off(name, config, result, reference):
+    """How many images the pyramid backends missed the reference ellipse on.  The exact
+    backends have to agree with it everywhere."""
+    angle_error = np.abs((result['angle'] - reference['angle'] + 90) % 180 - 90)
+    center_error = np.abs(result['center'] - reference['center']).max(axis=1)
+
+    if config.backend == 'pyramid':
+        return int(np.sum((angle_error > PYRAMID_ANGLE_TOLERANCE) |
+                          (center_error > 2 ** config.pyramid_levels)))
+
+    assert not angle_error.any(), (name, angle_error)
+    assert not center_error.any(), (name, center_error)
+    for key in ('color', 'major'):
+        assert (result[key] == reference[key]).all(), (name, key)
+    assert np.allclose(result['score'], reference['score'], atol=1e-5), name
+    return 0
+
+
+def unpruned(config):
+    return les.SearchConfig(**dict(config.as_dict(), prune=False))
+
+
+def check_pruning(name, result, unpruned_result):
+    """Pruning only skips matches that couldn't have won, so it can't change a thing."""
+    for key in ('angle', 'center', 'color', 'major', 'box'):
+        assert (result[key] == unpruned_result[key]).all(), (name, key)
+    assert np.allclose(result['score'], unpruned_result['score'], atol=1e-5), name
+
+
+print '{} coarse templates per image'.format(len(les.template_bank(ENVELOPE).coarse_params))
+print '{:<28} {:>12} {:>12} {:>9} {:>7} {:>14} {:>5} {:>8}'.format(
+    'backend', 'one at a time', 'as a stack', 'score', 'angle', 'center', 'off', 'avoided')
+
+reference = None
+for name, config in CONFIGS:
+    single = ms_per_image(lambda: [les.find_best_ellipse(d, ENVELOPE, config=config)
+                                   for d in deltas])
+    stacked = ms_per_image(lambda: les.find_best_ellipses(deltas, ENVELOPE, config=config))
+
+    result = les.find_best_ellipses(deltas, ENVELOPE, config=config)
+    if reference is None:
+        reference = result
+    if config.prune:
+        check_pruning(name, result,
+                      les.find_best_ellipses(deltas, ENVELOPE, config=unpruned(config)))
+
+    print '{:<28} {:>9.1f} ms {:>9.1f} ms {:>9.4f} {:>7d} {:>14} {:>5d} {:>8.1f}'.format(
+        name, single, stacked, result['score'][0], result['angle'][0],
+        tuple(result['center'][0]), images_off(name, config, result, reference),
+        result['matches_avoided'].mean())
@@ -3,13 +3,15 @@ import os
 import sys
 import multiprocessing
 import json
-import math
 
 import cv2
 import numpy as np
 
 import lib.cluster_utilities as lcu
+import lib.ellipse_search as les
+import lib.calibration_cache as lcc
 import etc.cluster_config as cl_conf
+import etc.fishface_config as ff_conf
 
 #SBATCH --job-name=ellipse_search
 #SBATCH --output=/home/wsl/var/log/cluster/ellipse_search_%j.out
@@ -46,133 +48,50 @@ if not ncores:
         ncores = multiprocessing.cpu_count()
 
 
-def find_ellipse_and_return_tag(args):
-    (image_id, remote_data_filename, remote_cal_filename, envelope) = args
-
-    data_filename = lcu.remote_to_local_filename(remote_data_filename)
-    cal_filename = lcu.remote_to_local_filename(remote_cal_filename)
-
-    delta = lcu.better_delta(
-        cv2.imread(data_filename, 0),
-        cv2.imread(cal_filename, 0)
-    )
-
-    colors = lcu.mam_envelope(envelope, 'color')
-    majors = lcu.mam_envelope(envelope, 'major')
-    ratios = lcu.mam_envelope(envelope, 'ratio', ints=False)
-
-    results = list()
-    for color in colors:
-        for angle in range(0, 180, 10):
-            for ratio in ratios:
-                for major in majors:
-                    template = np.zeros([int(envelope['major_max']) + 2] * 2, dtype=np.uint8)
-                    axes = (int(0.5 * major), int(0.5 * major / ratio))
-                    ellipse_params = {
-                        'img': template,
-                        'center': tuple([int(envelope['major_max'] // 2)] * 2),
-                        'axes': axes,
-                        'angle': angle,
-                        'startAngle': 0,
-                        'endAngle': 360,
-                        'color': int(color),
-                        'thickness': -1,
-                    }
-                    cv2.ellipse(**ellipse_params)
-                    non_zeroes = np.where(template != 0)
-                    nz_mins = np.amin(non_zeroes, axis=1)
-                    nz_maxes = np.amax(non_zeroes, axis=1)
-                    template = template[nz_mins[0]:nz_maxes[0] + 1, nz_mins[1]:nz_maxes[1] + 1]
-                    match = cv2.minMaxLoc(cv2.matchTemplate(
-                        delta, template, cv2.TM_SQDIFF_NORMED))
-                    results.append((
-                        match[0], (color, angle, ratio, major),
-                        (match[2][0] + axes[1], match[2][1] + axes[0])
-                    ))
-
-    intermediate_result = min(results)
-    (color, angle_approx, ratio, major) = intermediate_result[1]
-    axes = (int(major / 2), int(0.5 * major / ratio))
-
-    # for the second part of the algorithm, prefer a bit fatter ellipse
-    ratio -= - 0.2
-
-    results = list()
-    for angle in range(angle_approx - 11, angle_approx + 12):
-        template = np.zeros([major + 2] * 2, dtype=np.uint8)
-        ellipse_params = {
-            'img': template,
-            'center': tuple([int(envelope['major_max'] // 2)] * 2),
-            'axes': axes,
-            'angle': angle,
-            'startAngle': 0,
-            'endAngle': 360,
-            'color': color,
-            'thickness': -1,
-        }
-        cv2.ellipse(**ellipse_params)
-        non_zeroes = np.where(template != 0)
-        nz_mins = np.amin(non_zeroes, axis=1)
-        nz_maxes = np.amax(non_zeroes, axis=1)
-        template = template[nz_mins[0]:nz_maxes[0] + 1, nz_mins[1]:nz_maxes[1] + 1]
-        match = cv2.minMaxLoc(cv2.matchTemplate(delta, template, cv2.TM_SQDIFF_NORMED))
-        results.append((
-            match[0],
-            angle,
-            (match[2][0] + axes[1], match[2][1] + axes[0])
-        ))
-
-    result = min(results)
-    score, angle, center = result
-
-    mask = np.ones((15, 15), dtype=np.uint8) * color
-
-    tail_search_radius = 0.75 * major
-
-    tail_center = tuple(map(int,
-                            (center[0] - tail_search_radius * math.cos(math.radians(angle)),
-                             center[1] - tail_search_radius * math.sin(math.radians(angle)))))
-    tail_candidate = delta[tail_center[1] - 7:tail_center[1] + 8,
-                           tail_center[0] - 7:tail_center[0] + 8]
-
-    angle2 = (angle + 180) % 360
-    tail_center2 = tuple(map(int,
-                             (center[0] - tail_search_radius * math.cos(math.radians(angle2)),
-                              center[1] - tail_search_radius * math.sin(math.radians(angle2)))))
-    tail_candidate2 = delta[tail_center2[1] - 7:tail_center2[1] + 8,
-                            tail_center2[0] - 7:tail_center2[0] + 8]
-
-    diff = np.sum(cv2.absdiff(mask, tail_candidate) ** 2)
-    diff2 = np.sum(cv2.absdiff(mask, tail_candidate2) ** 2)
-
-    if diff2 < diff:
-        angle = angle2
-
-    length = major / 2
-
-    sin_a = math.sin(math.radians(angle))
-    cos_a = math.cos(math.radians(angle))
-
-    start = tuple(map(int, (center[0] - length * 0.25 * cos_a,
-                            center[1] - length * 0.25 * sin_a)))
-    end = tuple(map(int, (center[0] - length * cos_a,
-                          center[1] - length * sin_a)))
-
-    tag = {
-        'image_id': image_id,
-        'start': start,
-        'end': end,
-        'score': score
-    }
-
-    return tag
-
-# create pool of worker processess
-p = multiprocessing.Pool(ncores)
+def find_ellipses_and_return_tags(stack):
+    remote_cal_filename, envelope, image_ids, remote_data_filenames = stack
+
+    cal = lcc.calibration_frame(lcu.remote_to_local_filename(remote_cal_filename))
+
+    data = np.array([cv2.imread(lcu.remote_to_local_filename(remote_data_filename), 0)
+                     for remote_data_filename in remote_data_filenames])
+
+    deltas = lcu.better_delta(data, *cal.arrays)
+
+    return les.ellipse_tags(image_ids, deltas, envelope, config=config)
 
 try:
+    # every job in a spec file comes from the same dispatch, so they share search options
+    config = (les.SearchConfig.from_dict(job_list[0][4]) if job_list
+              else les.SearchConfig())
+
+    # a CJR whose experiment has no envelopes yet has nothing to search with
+    searchable_jobs = list()
+    for job in job_list:
+        if job[3]:
+            searchable_jobs.append(job[:4])
+        else:
+            print "Skipping image {}: its CJR has no search envelope.".format(job[0])
+
+    # small enough stacks that every core gets some work
+    frames_per_stack = max(1, min(ff_conf.ELLIPSE_SEARCH_FRAMES_PER_BATCH,
+                                  len(searchable_jobs) // ncores))
+    stacks = les.stacks(searchable_jobs, frames_per_stack)
+
+    # decode the cal images and draw the templates once before forking so every worker
+    # starts with them
+    for (cal_filename, envelope, image_ids, data_filenames) in stacks:
+        lcc.calibration_frame(lcu.remote_to_local_filename(cal_filename))
+        les.template_bank(envelope)
+        if config.coarse_levels:
+            les.template_bank(envelope, scale=2 ** config.coarse_levels)
+
+    # create pool of worker processess
+    p = multiprocessing.Pool(ncores)
+
     # apply work function in parallel
-    tags = p.map(find_ellipse_and_return_tag, job_list)
+    tags = [tag for batch_tags in p.map(find_ellipses_and_return_tags, stacks)
+            for tag in batch_tags]
 
     # write file and make sure it's completely written
     with open(result_partial_filename, 'wt') as result_file:
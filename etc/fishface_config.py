@@ -90,11 +90,88 @@ ML_MINIMUM_TAG_VERIFICATIONS_DURING_STAGE_1 = 2
 ML_RESERVE_DATA_DENOMINATOR = 10
 ML_STAGE_1_IMAGES_PER_CHUNK = 25
 
+# 1 counts every pixel when estimating the brightness offset in delta_image; n counts
+# every nth pixel of every nth row
+BRIGHTNESS_OFFSET_STRIDE = 1
+
+# skip the watershed in get_fish_contour when the thresholded frame is one blob of at
+# least MIN_AREA pixels, plus other blobs adding up to at most MAX_CLUTTER of its area.
+# The fast path traces the thresholded blob rather than the region the watershed grows
+# around it, so its contours and moments differ from the watershed's: on turned copies of
+# the sample frame, centroids moved by up to 6 pixels and areas by up to 12%.  Off
+# unless a CJR's analyses don't need to match the ones stored before.
+CONTOUR_FAST_PATH = False
+CONTOUR_FAST_PATH_MIN_AREA = 100
+CONTOUR_FAST_PATH_MAX_CLUTTER = 0.05
+
+# how far (in pixels) a silhouette may be simplified before it's stored; 0 keeps every
+# point of the contour
+SILHOUETTE_SIMPLIFY_TOLERANCE = 0
+
+# analyze each data image as soon as results.post_image stores it, against a cal image
+# reference kept for each of the last few capture jobs
+STREAMING_ANALYSIS = False
+STREAMING_ANALYSIS_CAL_REFERENCES = 4
+
+# the results worker holds images, job status reports and power supply logs until it has
+# MAX_ROWS of them or the oldest is MAX_AGE seconds old, then writes them all in one
+# transaction; a MAX_ROWS of 1 writes each one as it arrives.  Rows of a kind that fails
+# MAX_ATTEMPTS flushes in a row are dropped.
+WRITE_BEHIND_MAX_ROWS = 64
+WRITE_BEHIND_MAX_AGE = 2.0
+WRITE_BEHIND_MAX_ATTEMPTS = 5
+
+# 'sqlite3' keeps the database in lib/django/sqlite3.db; 'postgresql' uses the server
+# below (with psycopg2 installed, and the password in etc/fishface_db_password).  The
+# Django test runner always gets a local SQLite database.
+DATABASE_ENGINE = 'sqlite3'
+DATABASE_NAME = 'fishface'
+DATABASE_USER = APPLICATION_USERNAME
+DATABASE_HOST = 'localhost'
+DATABASE_PORT = 5432
+# seconds a worker or web process keeps reusing a database connection; 0 closes it after
+# every request or task, and None keeps it for the life of the process
+DATABASE_CONN_MAX_AGE = 600
+# seconds a SQLite connection waits for another process's write lock
+SQLITE_LOCK_TIMEOUT = 20
+# rows in each INSERT ... RETURNING statement that bulk stores send to PostgreSQL
+INSERT_RETURNING_BATCH_SIZE = 1000
+
 CJR_CREATION_TIMEOUT = 30
 CAMERA_QUEUE_PRELOAD = 15
 
 ELLIPSE_JOBS_PER_CHUNK = 256
+ELLIPSE_TEMPLATE_BANKS_PER_PROCESS = 16
+FFT_MATCH_BATCH_SIZE = 16
+# one of lib.ellipse_search.SearchConfig.BACKENDS: 'cv2', 'fft' or 'pyramid'.  'fft'
+# finds the same ellipses as 'cv2' about three times as fast (bin/benchmarks/
+# benchmark_ellipse_search.py: 0.18 against 0.52 s an image on a 16 image stack)
+ELLIPSE_SEARCH_BACKEND = 'fft'
+ELLIPSE_SEARCH_PYRAMID_LEVELS = 1
+ELLIPSE_SEARCH_FOREGROUND_ROI = True
+# the branch and bound coarse sweep finds the same ellipses while skipping ~93% of the
+# template matches, but its bounds cost about as much as the FFT matches they save: on a
+# 16 image stack, 'cv2' + roi went from 0.39 to 0.13 s an image, 'fft' + roi only from
+# 0.128 to 0.120 s, and searched one image at a time it was slower.  Worth it with 'cv2'.
+ELLIPSE_SEARCH_PRUNE = False
+ELLIPSE_SEARCH_FRAMES_PER_BATCH = 16
 ENVELOPE_JOBS_PER_CHUNK = 256
+# end each envelope search once a few widths in a row fit worse than all of the good
+# fits so far.  Larger widths can still fit well after that, and the largest good fit
+# is the one kept, so this trades accuracy for speed: on turned copies of the sample
+# frame it was 18% faster and picked a smaller envelope for 3 tags of 72.
+ENVELOPE_EARLY_STOP = False
+
+# keep only this many lines of each FFImage's log, or None for all of them
+FFIMAGE_LOG_LENGTH = None
+
+# how long (in seconds) a lib.fishface_image.ImageReference keeps its image in redis,
+# and how many resolved images each process keeps
+IMAGE_REFERENCE_TTL = 24 * 60 * 60
+IMAGE_REFERENCES_PER_PROCESS = 8
+
+CAL_CACHE_DIR = '/dev/shm/fishface_cal_cache'
+CAL_CACHE_MAX_FRAMES = 64
 
 try:
     from local_settings import *
@@ -0,0 +1,127 @@
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+import cv2
+
+import etc.fishface_config as ff_conf
+
+ARRAY_NAMES = 'cal cal_plus_one grain_offset'.split(' ')
+
+_frames = dict()
+
+
+class CalibrationFrame(object):
+    """
+    A decoded calibration image plus the parts of better_delta that only depend on it.
+
+    The arrays are read-only memory maps of files in CAL_CACHE_DIR.  That directory lives
+    on tmpfs, so every process on the host that uses the same calibration image shares a
+    single copy of it.
+    """
+
+    def __init__(self, cal, cal_plus_one, grain_offset):
+        self.cal = cal
+        self.cal_plus_one = cal_plus_one
+        self.grain_offset = grain_offset
+
+    @classmethod
+    def from_array(cls, cal):
+        return cls(
+            cal=cal,
+            cal_plus_one=cal.astype(np.uint16) + 1,
+            # 128 - cal, wrapped the same way uint8 subtraction always has been
+            grain_offset=(128 - cal.astype(np.int16)).astype(np.uint8),
+        )
+
+    @property
+    def arrays(self):
+        return [getattr(self, name) for name in ARRAY_NAMES]
+
+
+def cache_key(name, mtime):
+    # media file names come from django as unicode; the same name as UTF-8 bytes gets the
+    # same key
+    if isinstance(name, unicode):
+        name = name.encode('utf-8')
+    return hashlib.sha1('{}@{!r}'.format(name, float(mtime))).hexdigest()
+
+
+def _cache_path(key, array_name):
+    return os.path.join(ff_conf.CAL_CACHE_DIR, '{}.{}.npy'.format(key, array_name))
+
+
+def _load(key):
+    try:
+        # plain ndarray views of the maps, so results of arithmetic on them aren't memmaps
+        return CalibrationFrame(*[np.asarray(np.load(_cache_path(key, name), mmap_mode='r'))
+                                  for name in ARRAY_NAMES])
+    except IOError:
+        return None
+
+
+def _store(key, frame):
+    if not os.path.isdir(ff_conf.CAL_CACHE_DIR):
+        try:
+            os.makedirs(ff_conf.CAL_CACHE_DIR)
+        except OSError:
+            # somebody else got there first
+            pass
+
+    # write each array under a temporary name and rename it into place so that no other
+    # process ever maps a partially written file
+    for name, array in zip(ARRAY_NAMES, frame.arrays):
+        with tempfile.NamedTemporaryFile(dir=ff_conf.CAL_CACHE_DIR, suffix='.tmp',
+                                         delete=False) as temp_file:
+            np.save(temp_file, array)
+        os.rename(temp_file.name, _cache_path(key, name))
+
+    _prune()
+
+
+def _prune():
+    """Removes the oldest cached frames beyond CAL_CACHE_MAX_FRAMES.  Processes that
+    already have them mapped keep their mappings."""
+    cache_files = [os.path.join(ff_conf.CAL_CACHE_DIR, filename)
+                   for filename in os.listdir(ff_conf.CAL_CACHE_DIR)
+                   if filename.endswith('.npy')]
+    cache_files.sort(key=os.path.getmtime, reverse=True)
+
+    for path in cache_files[ff_conf.CAL_CACHE_MAX_FRAMES * len(ARRAY_NAMES):]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _frame(name, mtime, decode):
+    key = cache_key(name, mtime)
+
+    frame = _frames.get(key, None)
+    if frame is None:
+        frame = _load(key)
+
+    if frame is None:
+        _store(key, CalibrationFrame.from_array(decode()))
+        frame = _load(key)
+
+    _frames[key] = frame
+    return frame
+
+
+def calibration_frame(path):
+    """The CalibrationFrame for a calibration image file, keyed by its path and mtime."""
+    return _frame(os.path.abspath(path), os.path.getmtime(path),
+                  lambda: cv2.imread(path, 0))
+
+
+def media_calibration_frame(name, mtime):
+    """The CalibrationFrame for a calibration image in the django host's media, given the
+    file's name and mtime there.  The file is only fetched and decoded if no process on
+    this host has done so yet."""
+    # imported here so that the cluster scripts, which read their cal files directly,
+    # never need what lib.media_cache does
+    import lib.media_cache as lmc
+
+    return _frame(name, mtime, lambda: cv2.imread(lmc.local_media_path(name), 0))
@@ -29,10 +29,94 @@ def mam_envelope(envelope, name, ints=True):
     return min_avg_max(envelope[name + '_min'], envelope[name + '_max'], ints=ints)
 
 
-def better_delta(data, cal):
-    cal_over_data = (256*data / (cal.astype(np.uint16) + 1)).clip(0,255)
+def delta_work_buffers(shape):
+    """A pair of work buffers that better_delta can reuse for data of the given shape."""
+    return np.empty(shape, dtype=np.uint16), np.empty(shape, dtype=np.uint32)
+
+
+def better_delta(data, cal, cal_plus_one=None, grain_offset=None, out=None, work=None):
+    """
+    Divides the cal image into the data image, grain-extracts the cal image from the
+    data image, and color-dodges the first result with the second.  Bright pixels in
+    the result are darker in the data image than in the cal image.
+
+    data can be a single frame or an N x H x W stack of frames that share one cal frame.
+    cal_plus_one and grain_offset can be passed in precomputed (see
+    lib.calibration_cache), and out can be a preallocated uint8 array for the result.
+
+    Everything runs in place on two integer work buffers, so no other full-frame
+    temporaries get allocated.  work can be a pair from delta_work_buffers for callers
+    that delta many batches of the same shape.  The output is identical to
+    legacy_better_delta, including the mod 256 wraparound of the grain extract.
+    """
+    if cal_plus_one is None:
+        cal_plus_one = cal.astype(np.uint16) + 1
+    if grain_offset is None:
+        grain_offset = (128 - cal.astype(np.int16)).astype(np.uint8)
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+
+    if work is None or work[0].shape != data.shape:
+        work = delta_work_buffers(data.shape)
+    denominator, quotient = work
+
+    # cal over data: min(256 * data // (cal + 1), 255), which fits in uint16
+    denominator[...] = data
+    denominator <<= 8
+    denominator //= cal_plus_one
+    np.minimum(denominator, 255, out=denominator)
+
+    # the dodge divides by 256 - (cal over data), which is between 1 and 256
+    np.subtract(256, denominator, out=denominator)
+
+    # grain extract: (data - cal + 128) mod 256
+    quotient[...] = data
+    quotient += grain_offset
+    quotient &= 0xFF
+
+    # dodge: round(256 * grain / denominator) in integers.  The quotient is never
+    # exactly halfway between two integers, so this rounds the same way cv2.divide does.
+    quotient <<= 9
+    quotient += denominator
+    denominator <<= 1
+    quotient //= denominator
+    np.minimum(quotient, 255, out=quotient)
+
+    np.subtract(255, quotient, out=out, casting='unsafe')
+
+    return out
+
+
+def brightness_offset(image, cal, stride=1, diff=None):
+    """
+    The most common difference between the pixels of image and cal, i.e. how much the
+    overall brightness has shifted.  Ties go to the smallest difference, the same as
+    scipy's mstats.mode, which this replaces.
+
+    With stride greater than 1, only every stride-th pixel of every stride-th row is
+    counted.  diff can be an int16 work buffer the shape of the counted pixels.
+    """
+    if stride > 1:
+        image = image[::stride, ::stride]
+        cal = cal[::stride, ::stride]
+    if diff is None or diff.shape != image.shape:
+        diff = np.empty(image.shape, dtype=np.int16)
+
+    # shift the differences from -255..255 to 0..510 so that they can be counted
+    np.subtract(image, cal, out=diff, dtype=np.int16)
+    diff += 255
+
+    return int(np.argmax(np.bincount(diff.ravel(), minlength=511))) - 255
+
+
+def legacy_better_delta(data, cal):
+    """
+    The original better_delta, written out with explicit floor division.  Kept as the
+    reference that better_delta is tested and benchmarked against.
+    """
+    cal_over_data = (256*data // (cal.astype(np.uint16) + 1)).clip(0,255)
     grain_extract_cal_data = (data - cal + 128).clip(0,255)
     dodge_cod_ge = 255 - (cv2.divide((256 * grain_extract_cal_data),
                                      cv2.subtract(255, cal_over_data) + 1)).clip(0,255)
 
-    return dodge_cod_ge.astype(np.uint8)
\ No newline at end of file
+    return dodge_cod_ge.astype(np.uint8)
@@ -0,0 +1,70 @@
+"""
+A compact text encoding for OpenCV contours, used for ImageAnalysis.silhouette.
+
+An encoded contour is PREFIX followed by the base64 of the contour's points as int16
+pairs, the first point as it is and every later point as its offset from the one before
+it.  Stored as JSON, that's a single short string instead of a nested list with an
+entry per point, and decoding it is a base64 decode and a cumulative sum.
+"""
+import base64
+
+import numpy as np
+import cv2
+
+import etc.fishface_config as ff_conf
+
+PREFIX = 'i16d:'
+
+INT16_MIN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+
+
+def is_encoded(silhouette):
+    return isinstance(silhouette, basestring) and silhouette.startswith(PREFIX)
+
+
+def simplify_contour(contour, tolerance=None):
+    """
+    The contour simplified with the Douglas-Peucker algorithm, so that no dropped point
+    was more than tolerance pixels from the outline that's kept.  A tolerance of None
+    uses SILHOUETTE_SIMPLIFY_TOLERANCE, and a tolerance of 0 keeps every point.
+    """
+    if tolerance is None:
+        tolerance = ff_conf.SILHOUETTE_SIMPLIFY_TOLERANCE
+    contour = np.asarray(contour, dtype=np.int32).reshape(-1, 1, 2)
+    if not tolerance or len(contour) < 3:
+        return contour
+    return cv2.approxPolyDP(contour, tolerance, True)
+
+
+def encode_contour(contour, tolerance=None):
+    """
+    The encoded form of an OpenCV contour (anything that reshapes to (n, 1, 2)),
+    simplified first as in simplify_contour.  False (no contour found) is left alone.
+    """
+    if contour is False:
+        return False
+
+    points = simplify_contour(contour, tolerance).reshape(-1, 2)
+
+    offsets = np.concatenate((points[:1], np.diff(points, axis=0)))
+    if offsets.size and (offsets.min() < INT16_MIN or offsets.max() > INT16_MAX):
+        raise ValueError("Contour points don't fit in int16.")
+
+    return PREFIX + base64.b64encode(offsets.astype('<i2').tostring())
+
+
+def decode_contour(silhouette):
+    """
+    The contour in a stored silhouette as an int32 array of shape (n, 1, 2), ready for
+    the OpenCV contour functions.  Silhouettes stored as nested lists before the encoding
+    was introduced come back the same way, and False stays False.
+    """
+    if silhouette is False or silhouette is None:
+        return False
+
+    if not is_encoded(silhouette):
+        return np.asarray(silhouette, dtype=np.int32).reshape(-1, 1, 2)
+
+    deltas = np.fromstring(base64.b64decode(silhouette[len(PREFIX):]), dtype='<i2')
+    return np.cumsum(deltas.reshape(-1, 2), axis=0, dtype=np.int32).reshape(-1, 1, 2)
@@ -10,9 +10,11 @@ https://docs.djangoproject.com/en/1.6/ref/settings/
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import sys
 import logging
 import logging.handlers
 from django.utils.crypto import get_random_string
+from django.core.exceptions import ImproperlyConfigured
 
 import etc.fishface_config as ff_conf
 
@@ -56,13 +58,35 @@ except ImportError:
 DEBUG = False
 TEMPLATE_DEBUG = False
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'sqlite3.db'),
-    },
+SQLITE_DATABASE = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(BASE_DIR, 'sqlite3.db'),
+    'OPTIONS': {'timeout': ff_conf.SQLITE_LOCK_TIMEOUT},
+    'CONN_MAX_AGE': ff_conf.DATABASE_CONN_MAX_AGE,
 }
 
+POSTGRESQL_DATABASE = {
+    'ENGINE': 'django.db.backends.postgresql_psycopg2',
+    'NAME': ff_conf.DATABASE_NAME,
+    'USER': ff_conf.DATABASE_USER,
+    'PASSWORD': DB_PASSWD,
+    'HOST': ff_conf.DATABASE_HOST,
+    'PORT': ff_conf.DATABASE_PORT,
+    'CONN_MAX_AGE': ff_conf.DATABASE_CONN_MAX_AGE,
+}
+
+# the test runner gets the local stand-in whatever the configured database is
+if ff_conf.DATABASE_ENGINE == 'postgresql' and 'test' not in sys.argv:
+    DATABASES = {'default': POSTGRESQL_DATABASE}
+elif ff_conf.DATABASE_ENGINE in ('sqlite3', 'postgresql'):
+    DATABASES = {'default': SQLITE_DATABASE}
+else:
+    raise ImproperlyConfigured('Unknown DATABASE_ENGINE: {}'.format(ff_conf.DATABASE_ENGINE))
+
+# the test database is built straight from the models rather than by running every
+# migration
+SOUTH_TESTS_MIGRATE = False
+
 # Set to wildcard pending fixed IP assignment
 # TODO: After fixed IP assignment, put real value here.
 ALLOWED_HOSTS = ['*']
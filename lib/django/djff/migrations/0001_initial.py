@@ -0,0 +1,471 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'Species'
+        db.create_table(u'djff_species', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(default='genus species', max_length=200, unique=True)),
+            ('common_name', self.gf('django.db.models.fields.CharField')(blank=True, max_length=200, null=True, unique=True)),
+            ('shortname', self.gf('django.db.models.fields.CharField')(default='ABC', max_length=5, unique=True)),
+            ('image', self.gf('django.db.models.fields.files.ImageField')(blank=True, max_length=100, null=True)),
+        ))
+        db.send_create_signal(u'djff', ['Species'])
+
+        # Adding model 'Researcher'
+        db.create_table(u'djff_researcher', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=200)),
+            ('email', self.gf('django.db.models.fields.EmailField')(blank=True, max_length=75, null=True)),
+            ('bad_tags', self.gf('django.db.models.fields.IntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'djff', ['Researcher'])
+
+        # Adding model 'PowerSupplyLog'
+        db.create_table(u'djff_powersupplylog', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('measurement_datetime', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('current_meas', self.gf('django.db.models.fields.FloatField')(null=True)),
+            ('voltage_meas', self.gf('django.db.models.fields.FloatField')(null=True)),
+        ))
+        db.send_create_signal(u'djff', ['PowerSupplyLog'])
+
+        # Adding model 'Experiment'
+        db.create_table(u'djff_experiment', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(default='New Experiment', max_length=250)),
+            ('xp_start', self.gf('django.db.models.fields.DateTimeField')()),
+            ('species', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Species'])),
+            ('comment', self.gf('django.db.models.fields.TextField')(blank=True, null=True)),
+            ('researcher', self.gf('django.db.models.fields.related.ForeignKey')(blank=True, null=True, to=orm['djff.Researcher'])),
+        ))
+        db.send_create_signal(u'djff', ['Experiment'])
+
+        # Adding model 'CaptureJobRecord'
+        db.create_table(u'djff_capturejobrecord', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('xp', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Experiment'])),
+            ('voltage', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('current', self.gf('django.db.models.fields.FloatField')(default=18)),
+            ('researcher', self.gf('django.db.models.fields.related.ForeignKey')(blank=True, null=True, to=orm['djff.Researcher'])),
+            ('job_start', self.gf('django.db.models.fields.DateTimeField')(blank=True, null=True)),
+            ('running', self.gf('django.db.models.fields.NullBooleanField')(blank=True, default=None, null=True)),
+            ('total', self.gf('django.db.models.fields.IntegerField')(blank=True, null=True)),
+            ('remaining', self.gf('django.db.models.fields.IntegerField')(blank=True, null=True)),
+            ('job_stop', self.gf('django.db.models.fields.DateTimeField')(blank=True, null=True)),
+            ('major_min', self.gf('django.db.models.fields.IntegerField')(blank=True, null=True)),
+            ('major_max', self.gf('django.db.models.fields.IntegerField')(blank=True, null=True)),
+            ('color_min', self.gf('django.db.models.fields.IntegerField')(blank=True, null=True)),
+            ('color_max', self.gf('django.db.models.fields.IntegerField')(blank=True, null=True)),
+            ('ratio_min', self.gf('django.db.models.fields.FloatField')(blank=True, null=True)),
+            ('ratio_max', self.gf('django.db.models.fields.FloatField')(blank=True, null=True)),
+            ('comment', self.gf('django.db.models.fields.TextField')(blank=True, null=True)),
+        ))
+        db.send_create_signal(u'djff', ['CaptureJobRecord'])
+
+        # Adding model 'Image'
+        db.create_table(u'djff_image', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('xp', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Experiment'])),
+            ('cjr', self.gf('django.db.models.fields.related.ForeignKey')(null=True, to=orm['djff.CaptureJobRecord'])),
+            ('capture_timestamp', self.gf('django.db.models.fields.DateTimeField')()),
+            ('voltage', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('current', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('image_file', self.gf('django.db.models.fields.files.ImageField')(max_length=100)),
+            ('is_cal_image', self.gf('django.db.models.fields.BooleanField')(default=False)),
+            ('bad_tags', self.gf('django.db.models.fields.IntegerField')(default=0)),
+        ))
+        db.send_create_signal(u'djff', ['Image'])
+
+        # Adding model 'ImageAnalysis'
+        db.create_table(u'djff_imageanalysis', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Image'])),
+            ('analysis_datetime', self.gf('django.db.models.fields.DateTimeField')()),
+            ('silhouette', self.gf('jsonfield.fields.JSONField')()),
+            ('moments', self.gf('jsonfield.fields.JSONField')()),
+            ('hu_moments', self.gf('jsonfield.fields.JSONField')()),
+            ('meta_data', self.gf('jsonfield.fields.JSONField')()),
+        ))
+        db.send_create_signal(u'djff', ['ImageAnalysis'])
+
+        # Adding model 'AutomaticTag'
+        db.create_table(u'djff_automatictag', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Image'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('image_analysis', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.ImageAnalysis'])),
+            ('centroid', self.gf('jsonfield.fields.JSONField')()),
+            ('orientation', self.gf('jsonfield.fields.JSONField')()),
+        ))
+        db.send_create_signal(u'djff', ['AutomaticTag'])
+
+        # Adding model 'ManualTag'
+        db.create_table(u'djff_manualtag', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Image'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('start', self.gf('django.db.models.fields.CommaSeparatedIntegerField')(max_length=20)),
+            ('end', self.gf('django.db.models.fields.CommaSeparatedIntegerField')(max_length=20)),
+            ('researcher', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Researcher'])),
+        ))
+        db.send_create_signal(u'djff', ['ManualTag'])
+
+        # Adding model 'EllipseSearchTag'
+        db.create_table(u'djff_ellipsesearchtag', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Image'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('start', self.gf('django.db.models.fields.CommaSeparatedIntegerField')(max_length=20)),
+            ('end', self.gf('django.db.models.fields.CommaSeparatedIntegerField')(max_length=20)),
+        ))
+        db.send_create_signal(u'djff', ['EllipseSearchTag'])
+
+        # Adding model 'ManualVerification'
+        db.create_table(u'djff_manualverification', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('tag', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.ManualTag'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('researcher', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Researcher'])),
+        ))
+        db.send_create_signal(u'djff', ['ManualVerification'])
+
+        # Adding model 'AnalysisVerification'
+        db.create_table(u'djff_analysisverification', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image_analysis', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.ImageAnalysis'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('researcher', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Researcher'])),
+        ))
+        db.send_create_signal(u'djff', ['AnalysisVerification'])
+
+        # Adding model 'CaptureJobTemplate'
+        db.create_table(u'djff_capturejobtemplate', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('voltage', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('current', self.gf('django.db.models.fields.FloatField')(default=15)),
+            ('duration', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('interval', self.gf('django.db.models.fields.FloatField')(default=1)),
+            ('startup_delay', self.gf('django.db.models.fields.FloatField')(default=30.0)),
+            ('description', self.gf('django.db.models.fields.TextField')(blank=True, null=True)),
+        ))
+        db.send_create_signal(u'djff', ['CaptureJobTemplate'])
+
+        # Adding model 'Fish'
+        db.create_table(u'djff_fish', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('species', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Species'])),
+            ('comment', self.gf('django.db.models.fields.TextField')(blank=True, null=True)),
+        ))
+        db.send_create_signal(u'djff', ['Fish'])
+
+        # Adding model 'Tank'
+        db.create_table(u'djff_tank', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('short_name', self.gf('django.db.models.fields.CharField')(default='', max_length=10, unique=True)),
+            ('description', self.gf('django.db.models.fields.TextField')(blank=True, null=True)),
+        ))
+        db.send_create_signal(u'djff', ['Tank'])
+
+        # Adding model 'FishLocale'
+        db.create_table(u'djff_fishlocale', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('fish', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Fish'])),
+            ('tank', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Tank'])),
+            ('datetime_in_tank', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+        ))
+        db.send_create_signal(u'djff', ['FishLocale'])
+
+        # Adding model 'CaptureJobQueue'
+        db.create_table(u'djff_capturejobqueue', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('name', self.gf('django.db.models.fields.CharField')(max_length=50)),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+            ('queue', self.gf('jsonfield.fields.JSONField')()),
+            ('comment', self.gf('django.db.models.fields.TextField')()),
+        ))
+        db.send_create_signal(u'djff', ['CaptureJobQueue'])
+
+        # Adding model 'KMeansEstimator'
+        db.create_table(u'djff_kmeansestimator', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('estimator_params', self.gf('jsonfield.fields.JSONField')()),
+            ('cluster_centers', self.gf('jsonfield.fields.JSONField')()),
+            ('labels', self.gf('jsonfield.fields.JSONField')()),
+            ('inertia', self.gf('jsonfield.fields.JSONField')()),
+            ('scaler_params', self.gf('jsonfield.fields.JSONField')()),
+            ('scaler_mean', self.gf('jsonfield.fields.JSONField')()),
+            ('scaler_std', self.gf('jsonfield.fields.JSONField')()),
+            ('label_deltas', self.gf('jsonfield.fields.JSONField')()),
+            ('comment', self.gf('django.db.models.fields.TextField')(blank=True, null=True)),
+            ('metadata', self.gf('jsonfield.fields.JSONField')()),
+        ))
+        db.send_create_signal(u'djff', ['KMeansEstimator'])
+
+        # Adding model 'ClassificationDeltaSet'
+        db.create_table(u'djff_classificationdeltaset', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('estimator', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.KMeansEstimator'])),
+            ('timestamp', self.gf('django.db.models.fields.DateTimeField')(auto_now_add=True, blank=True)),
+            ('deltas', self.gf('jsonfield.fields.JSONField')()),
+        ))
+        db.send_create_signal(u'djff', ['ClassificationDeltaSet'])
+
+        # Adding model 'PriorityManualImage'
+        db.create_table(u'djff_prioritymanualimage', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('image', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['djff.Image'])),
+            ('priority', self.gf('django.db.models.fields.IntegerField')(default=5)),
+        ))
+        db.send_create_signal(u'djff', ['PriorityManualImage'])
+
+    def backwards(self, orm):
+        # Deleting model 'PriorityManualImage'
+        db.delete_table(u'djff_prioritymanualimage')
+
+        # Deleting model 'ClassificationDeltaSet'
+        db.delete_table(u'djff_classificationdeltaset')
+
+        # Deleting model 'KMeansEstimator'
+        db.delete_table(u'djff_kmeansestimator')
+
+        # Deleting model 'CaptureJobQueue'
+        db.delete_table(u'djff_capturejobqueue')
+
+        # Deleting model 'FishLocale'
+        db.delete_table(u'djff_fishlocale')
+
+        # Deleting model 'Tank'
+        db.delete_table(u'djff_tank')
+
+        # Deleting model 'Fish'
+        db.delete_table(u'djff_fish')
+
+        # Deleting model 'CaptureJobTemplate'
+        db.delete_table(u'djff_capturejobtemplate')
+
+        # Deleting model 'AnalysisVerification'
+        db.delete_table(u'djff_analysisverification')
+
+        # Deleting model 'ManualVerification'
+        db.delete_table(u'djff_manualverification')
+
+        # Deleting model 'EllipseSearchTag'
+        db.delete_table(u'djff_ellipsesearchtag')
+
+        # Deleting model 'ManualTag'
+        db.delete_table(u'djff_manualtag')
+
+        # Deleting model 'AutomaticTag'
+        db.delete_table(u'djff_automatictag')
+
+        # Deleting model 'ImageAnalysis'
+        db.delete_table(u'djff_imageanalysis')
+
+        # Deleting model 'Image'
+        db.delete_table(u'djff_image')
+
+        # Deleting model 'CaptureJobRecord'
+        db.delete_table(u'djff_capturejobrecord')
+
+        # Deleting model 'Experiment'
+        db.delete_table(u'djff_experiment')
+
+        # Deleting model 'PowerSupplyLog'
+        db.delete_table(u'djff_powersupplylog')
+
+        # Deleting model 'Researcher'
+        db.delete_table(u'djff_researcher')
+
+        # Deleting model 'Species'
+        db.delete_table(u'djff_species')
+
+    models = {
+        u'djff.analysisverification': {
+            'Meta': {'object_name': 'AnalysisVerification'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image_analysis': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.ImageAnalysis']"}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Researcher']"}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.automatictag': {
+            'Meta': {'object_name': 'AutomaticTag'},
+            'centroid': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'image_analysis': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.ImageAnalysis']"}),
+            'orientation': ('jsonfield.fields.JSONField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.capturejobqueue': {
+            'Meta': {'object_name': 'CaptureJobQueue'},
+            'comment': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'queue': ('jsonfield.fields.JSONField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+        },
+        u'djff.capturejobrecord': {
+            'Meta': {'object_name': 'CaptureJobRecord'},
+            'color_max': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'color_min': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            'current': ('django.db.models.fields.FloatField', [], {'default': '18'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job_start': ('django.db.models.fields.DateTimeField', [], {'blank': 'True', 'null': 'True'}),
+            'job_stop': ('django.db.models.fields.DateTimeField', [], {'blank': 'True', 'null': 'True'}),
+            'major_max': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'major_min': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'ratio_max': ('django.db.models.fields.FloatField', [], {'blank': 'True', 'null': 'True'}),
+            'ratio_min': ('django.db.models.fields.FloatField', [], {'blank': 'True', 'null': 'True'}),
+            'remaining': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'null': 'True', 'to': u"orm['djff.Researcher']"}),
+            'running': ('django.db.models.fields.NullBooleanField', [], {'blank': 'True', 'default': 'None', 'null': 'True'}),
+            'total': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'voltage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'xp': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Experiment']"}),
+        },
+        u'djff.capturejobtemplate': {
+            'Meta': {'object_name': 'CaptureJobTemplate'},
+            'current': ('django.db.models.fields.FloatField', [], {'default': '15'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interval': ('django.db.models.fields.FloatField', [], {'default': '1'}),
+            'startup_delay': ('django.db.models.fields.FloatField', [], {'default': '30.0'}),
+            'voltage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+        },
+        u'djff.classificationdeltaset': {
+            'Meta': {'object_name': 'ClassificationDeltaSet'},
+            'deltas': ('jsonfield.fields.JSONField', [], {}),
+            'estimator': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.KMeansEstimator']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.ellipsesearchtag': {
+            'Meta': {'object_name': 'EllipseSearchTag'},
+            'end': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'start': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.experiment': {
+            'Meta': {'object_name': 'Experiment'},
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'default': '\'New Experiment\'', 'max_length': '250'}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'null': 'True', 'to': u"orm['djff.Researcher']"}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Species']"}),
+            'xp_start': ('django.db.models.fields.DateTimeField', [], {}),
+        },
+        u'djff.fish': {
+            'Meta': {'object_name': 'Fish'},
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Species']"}),
+        },
+        u'djff.fishlocale': {
+            'Meta': {'object_name': 'FishLocale'},
+            'datetime_in_tank': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fish': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Fish']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tank': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Tank']"}),
+        },
+        u'djff.image': {
+            'Meta': {'object_name': 'Image'},
+            'bad_tags': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'capture_timestamp': ('django.db.models.fields.DateTimeField', [], {}),
+            'cjr': ('django.db.models.fields.related.ForeignKey', [], {'null': 'True', 'to': u"orm['djff.CaptureJobRecord']"}),
+            'current': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image_file': ('django.db.models.fields.files.ImageField', [], {'max_length': '100'}),
+            'is_cal_image': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'voltage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'xp': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Experiment']"}),
+        },
+        u'djff.imageanalysis': {
+            'Meta': {'object_name': 'ImageAnalysis'},
+            'analysis_datetime': ('django.db.models.fields.DateTimeField', [], {}),
+            'hu_moments': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'meta_data': ('jsonfield.fields.JSONField', [], {}),
+            'moments': ('jsonfield.fields.JSONField', [], {}),
+            'silhouette': ('jsonfield.fields.JSONField', [], {}),
+        },
+        u'djff.kmeansestimator': {
+            'Meta': {'object_name': 'KMeansEstimator'},
+            'cluster_centers': ('jsonfield.fields.JSONField', [], {}),
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            'estimator_params': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'inertia': ('jsonfield.fields.JSONField', [], {}),
+            'label_deltas': ('jsonfield.fields.JSONField', [], {}),
+            'labels': ('jsonfield.fields.JSONField', [], {}),
+            'metadata': ('jsonfield.fields.JSONField', [], {}),
+            'scaler_mean': ('jsonfield.fields.JSONField', [], {}),
+            'scaler_params': ('jsonfield.fields.JSONField', [], {}),
+            'scaler_std': ('jsonfield.fields.JSONField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.manualtag': {
+            'Meta': {'object_name': 'ManualTag'},
+            'end': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Researcher']"}),
+            'start': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.manualverification': {
+            'Meta': {'object_name': 'ManualVerification'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Researcher']"}),
+            'tag': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.ManualTag']"}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.powersupplylog': {
+            'Meta': {'object_name': 'PowerSupplyLog'},
+            'current_meas': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'measurement_datetime': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'voltage_meas': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+        },
+        u'djff.prioritymanualimage': {
+            'Meta': {'object_name': 'PriorityManualImage'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'priority': ('django.db.models.fields.IntegerField', [], {'default': '5'}),
+        },
+        u'djff.researcher': {
+            'Meta': {'object_name': 'Researcher'},
+            'bad_tags': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'email': ('django.db.models.fields.EmailField', [], {'blank': 'True', 'max_length': '75', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+        },
+        u'djff.species': {
+            'Meta': {'object_name': 'Species'},
+            'common_name': ('django.db.models.fields.CharField', [], {'blank': 'True', 'max_length': '200', 'null': 'True', 'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.files.ImageField', [], {'blank': 'True', 'max_length': '100', 'null': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'default': '\'genus species\'', 'max_length': '200', 'unique': 'True'}),
+            'shortname': ('django.db.models.fields.CharField', [], {'default': '\'ABC\'', 'max_length': '5', 'unique': 'True'}),
+        },
+        u'djff.tank': {
+            'Meta': {'object_name': 'Tank'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'short_name': ('django.db.models.fields.CharField', [], {'default': '\'\'', 'max_length': '10', 'unique': 'True'}),
+        },
+    }
+
+    complete_apps = ['djff']
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'EllipseSearchTag.foreground_box'
+        db.add_column(u'djff_ellipsesearchtag', 'foreground_box',
+                      self.gf('django.db.models.fields.CommaSeparatedIntegerField')(default='', max_length=24, blank=True),
+                      keep_default=False)
+
+    def backwards(self, orm):
+        # Deleting field 'EllipseSearchTag.foreground_box'
+        db.delete_column(u'djff_ellipsesearchtag', 'foreground_box')
+
+    models = {
+        u'djff.analysisverification': {
+            'Meta': {'object_name': 'AnalysisVerification'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image_analysis': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.ImageAnalysis']"}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Researcher']"}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.automatictag': {
+            'Meta': {'index_together': "[['image', 'timestamp']]", 'object_name': 'AutomaticTag'},
+            'centroid': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'image_analysis': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.ImageAnalysis']"}),
+            'orientation': ('jsonfield.fields.JSONField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.capturejobqueue': {
+            'Meta': {'object_name': 'CaptureJobQueue'},
+            'comment': ('django.db.models.fields.TextField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '50'}),
+            'queue': ('jsonfield.fields.JSONField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+        },
+        u'djff.capturejobrecord': {
+            'Meta': {'object_name': 'CaptureJobRecord'},
+            'color_max': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'color_min': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            'current': ('django.db.models.fields.FloatField', [], {'default': '18'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'job_start': ('django.db.models.fields.DateTimeField', [], {'blank': 'True', 'null': 'True'}),
+            'job_stop': ('django.db.models.fields.DateTimeField', [], {'blank': 'True', 'null': 'True'}),
+            'major_max': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'major_min': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'ratio_max': ('django.db.models.fields.FloatField', [], {'blank': 'True', 'null': 'True'}),
+            'ratio_min': ('django.db.models.fields.FloatField', [], {'blank': 'True', 'null': 'True'}),
+            'remaining': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'null': 'True', 'to': u"orm['djff.Researcher']"}),
+            'resolved_cal_image': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'null': 'True', 'on_delete': 'models.SET_NULL', 'related_name': '\'+\'', 'to': u"orm['djff.Image']"}),
+            'running': ('django.db.models.fields.NullBooleanField', [], {'blank': 'True', 'default': 'None', 'null': 'True'}),
+            'total': ('django.db.models.fields.IntegerField', [], {'blank': 'True', 'null': 'True'}),
+            'voltage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'xp': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Experiment']"}),
+        },
+        u'djff.capturejobtemplate': {
+            'Meta': {'object_name': 'CaptureJobTemplate'},
+            'current': ('django.db.models.fields.FloatField', [], {'default': '15'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            'duration': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'interval': ('django.db.models.fields.FloatField', [], {'default': '1'}),
+            'startup_delay': ('django.db.models.fields.FloatField', [], {'default': '30.0'}),
+            'voltage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+        },
+        u'djff.classificationdeltaset': {
+            'Meta': {'object_name': 'ClassificationDeltaSet'},
+            'deltas': ('jsonfield.fields.JSONField', [], {}),
+            'estimator': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.KMeansEstimator']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.ellipsesearchtag': {
+            'Meta': {'object_name': 'EllipseSearchTag'},
+            'end': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            'foreground_box': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'blank': 'True', 'default': "''", 'max_length': '24'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'start': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.experiment': {
+            'Meta': {'object_name': 'Experiment'},
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'default': '\'New Experiment\'', 'max_length': '250'}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'null': 'True', 'to': u"orm['djff.Researcher']"}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Species']"}),
+            'xp_start': ('django.db.models.fields.DateTimeField', [], {}),
+        },
+        u'djff.fish': {
+            'Meta': {'object_name': 'Fish'},
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'species': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Species']"}),
+        },
+        u'djff.fishlocale': {
+            'Meta': {'object_name': 'FishLocale'},
+            'datetime_in_tank': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fish': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Fish']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'tank': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Tank']"}),
+        },
+        u'djff.image': {
+            'Meta': {'index_together': "[['xp', 'is_cal_image', 'capture_timestamp']]", 'object_name': 'Image'},
+            'bad_tags': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'capture_timestamp': ('django.db.models.fields.DateTimeField', [], {}),
+            'cjr': ('django.db.models.fields.related.ForeignKey', [], {'null': 'True', 'to': u"orm['djff.CaptureJobRecord']"}),
+            'current': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image_file': ('django.db.models.fields.files.ImageField', [], {'max_length': '100'}),
+            'is_cal_image': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'tag_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'voltage': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'xp': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Experiment']"}),
+        },
+        u'djff.imageanalysis': {
+            'Meta': {'index_together': "[['image', 'analysis_datetime']]", 'object_name': 'ImageAnalysis'},
+            'analysis_datetime': ('django.db.models.fields.DateTimeField', [], {}),
+            'hu_moments': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'meta_data': ('jsonfield.fields.JSONField', [], {}),
+            'moments': ('jsonfield.fields.JSONField', [], {}),
+            'silhouette': ('jsonfield.fields.JSONField', [], {}),
+        },
+        u'djff.kmeansestimator': {
+            'Meta': {'object_name': 'KMeansEstimator'},
+            'cluster_centers': ('jsonfield.fields.JSONField', [], {}),
+            'comment': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            'estimator_params': ('jsonfield.fields.JSONField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'inertia': ('jsonfield.fields.JSONField', [], {}),
+            'label_deltas': ('jsonfield.fields.JSONField', [], {}),
+            'labels': ('jsonfield.fields.JSONField', [], {}),
+            'metadata': ('jsonfield.fields.JSONField', [], {}),
+            'scaler_mean': ('jsonfield.fields.JSONField', [], {}),
+            'scaler_params': ('jsonfield.fields.JSONField', [], {}),
+            'scaler_std': ('jsonfield.fields.JSONField', [], {}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.manualtag': {
+            'Meta': {'index_together': "[['researcher', 'image']]", 'object_name': 'ManualTag'},
+            'end': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Researcher']"}),
+            'start': ('django.db.models.fields.CommaSeparatedIntegerField', [], {'max_length': '20'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'verification_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+        },
+        u'djff.manualverification': {
+            'Meta': {'object_name': 'ManualVerification'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'researcher': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Researcher']"}),
+            'tag': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.ManualTag']"}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+        },
+        u'djff.powersupplylog': {
+            'Meta': {'object_name': 'PowerSupplyLog'},
+            'current_meas': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'measurement_datetime': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'voltage_meas': ('django.db.models.fields.FloatField', [], {'null': 'True'}),
+        },
+        u'djff.prioritymanualimage': {
+            'Meta': {'object_name': 'PriorityManualImage'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['djff.Image']"}),
+            'priority': ('django.db.models.fields.IntegerField', [], {'default': '5'}),
+        },
+        u'djff.researcher': {
+            'Meta': {'object_name': 'Researcher'},
+            'bad_tags': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'email': ('django.db.models.fields.EmailField', [], {'blank': 'True', 'max_length': '75', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'tag_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'verified_tag_count': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+        },
+        u'djff.species': {
+            'Meta': {'object_name': 'Species'},
+            'common_name': ('django.db.models.fields.CharField', [], {'blank': 'True', 'max_length': '200', 'null': 'True', 'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'image': ('django.db.models.fields.files.ImageField', [], {'blank': 'True', 'max_length': '100', 'null': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'default': '\'genus species\'', 'max_length': '200', 'unique': 'True'}),
+            'shortname': ('django.db.models.fields.CharField', [], {'default': '\'ABC\'', 'max_length': '5', 'unique': 'True'}),
+        },
+        u'djff.tank': {
+            'Meta': {'object_name': 'Tank'},
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'short_name': ('django.db.models.fields.CharField', [], {'default': '\'\'', 'max_length': '10', 'unique': 'True'}),
+        },
+    }
+
+    complete_apps = ['djff']
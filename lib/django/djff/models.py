@@ -22,6 +22,7 @@ import sklearn.cluster as skc
 import sklearn.preprocessing as skp
 
 import lib.django.djff.utils.djff_imagekit as ffik
+import lib.contour_codec as lco
 
 
 class Species(models.Model):
@@ -69,12 +70,17 @@ class Researcher(models.Model):
         "how many of this researcher's tags have been deleted during validation",
         default=0)
 
+    # kept up to date by the signal receivers at the bottom of this module
+    tag_count = models.IntegerField("how many tags this researcher has", default=0)
+    verified_tag_count = models.IntegerField(
+        "how many of this researcher's tags have been verified at least once", default=0)
+
     def __unicode__(self):
         return u'{}'.format(self.name)
 
     @property
     def tag_score(self):
-        return self.manualtag_set.count()
+        return self.tag_count
 
     @property
     def all_tags_count(self):
@@ -82,13 +88,11 @@ class Researcher(models.Model):
 
     @property
     def unverified_tags(self):
-        tags = self.manualtag_set.filter(researcher=self.id).annotate(ver_count=ddm.Count('manualverification'))
-        return tags.filter(ver_count=0).count()
+        return self.tag_count - self.verified_tag_count
 
     @property
     def verified_tags(self):
-        tags = self.manualtag_set.filter(researcher=self.id).annotate(ver_count=ddm.Count('manualverification'))
-        return tags.filter(ver_count__gt=0).count()
+        return self.verified_tag_count
 
     @property
     def accuracy_score(self):
@@ -200,6 +204,11 @@ class CaptureJobRecord(models.Model):
     comment = models.TextField('general comments about this Capture Job Record (optional)',
                                null=True, blank=True, )
 
+    # the cal image in effect when the job started, filled in when the job is created or
+    # a cal image is posted for it; see cal_image
+    resolved_cal_image = models.ForeignKey('Image', null=True, blank=True, related_name='+',
+                                           on_delete=models.SET_NULL)
+
     @property
     def search_envelope(self):
         envelope = dict()
@@ -236,17 +245,37 @@ class CaptureJobRecord(models.Model):
 
     @property
     def cal_image(self):
-        cal_images = Image.objects.filter(
-            xp_id=self.xp_id, is_cal_image=True
-        ).order_by('capture_timestamp')
-        return_image = None
-        for ci in cal_images:
-            if ci.capture_timestamp <= self.job_start:
-                return_image = ci
-            else:
-                break
+        """
+        The latest cal image of the experiment taken no later than the start of the job, or
+        None.  Batch tasks ask for this once per image, so the image is remembered by this
+        process once it's been looked up.
+        """
+        if self.resolved_cal_image_id is None:
+            cal_image = self.latest_cal_image()
+            if cal_image is not None:
+                CaptureJobRecord.objects.filter(pk=self.id).update(resolved_cal_image=cal_image)
+                self.resolved_cal_image = cal_image
+            return cal_image
+
+        try:
+            cal_image = _cal_images.pop(self.resolved_cal_image_id)
+        except KeyError:
+            cal_image = self.resolved_cal_image
+
+        _cal_images[cal_image.id] = cal_image
+        while len(_cal_images) > CAL_IMAGES_PER_PROCESS:
+            _cal_images.popitem(last=False)
+
+        return cal_image
+
+    def latest_cal_image(self):
+        """Looks up the cal image for cal_image, ignoring the stored one."""
+        if self.job_start is None:
+            return None
 
-        return return_image
+        return Image.objects.filter(
+            xp_id=self.xp_id, is_cal_image=True, capture_timestamp__lte=self.job_start
+        ).order_by('-capture_timestamp').first()
 
     @property
     def slug(self):
@@ -261,6 +290,15 @@ class CaptureJobRecord(models.Model):
         return Image.objects.filter(cjr__pk=self.pk).count()
 
 
+# cal images already looked up by CaptureJobRecord.cal_image, by image ID
+CAL_IMAGES_PER_PROCESS = 64
+_cal_images = collections.OrderedDict()
+
+
+def forget_cal_images():
+    _cal_images.clear()
+
+
 def generate_image_filename(instance, filename):
     if instance.cjr_id is None and instance.is_cal_image:
         cjr_id = 0
@@ -315,6 +353,13 @@ class Image(models.Model):
         "how many of this image's tags have been deleted during validation",
         default=0)
 
+    # kept up to date by the signal receivers at the bottom of this module
+    tag_count = models.IntegerField("how many tags this image has", default=0)
+
+    class Meta:
+        # for CaptureJobRecord.cal_image
+        index_together = [['xp', 'is_cal_image', 'capture_timestamp']]
+
     @property
     def angle(self):
         my_tags = ManualTag.objects.filter(image=self)
@@ -420,6 +465,15 @@ class ImageAnalysis(models.Model):
 
     meta_data = jsonfield.JSONField('Any metadata other than what gets its own field')
 
+    class Meta:
+        # for Image.latest_analysis and ManualTag.latest_analysis
+        index_together = [['image', 'analysis_datetime']]
+
+    @property
+    def silhouette_array(self):
+        """The silhouette as an OpenCV contour array, however it was stored."""
+        return lco.decode_contour(self.silhouette)
+
     @property
     def orientation_from_moments(self):
         # from http://en.wikipedia.org/wiki/Image_moment
@@ -452,12 +506,21 @@ class AutomaticTag(models.Model):
     centroid = jsonfield.JSONField('The center of mass of the fish')
     orientation = jsonfield.JSONField("Angle of the fish referenced against oncoming water flow")
 
+    class Meta:
+        # for Image.latest_automatictag
+        index_together = [['image', 'timestamp']]
+
     def __unicode__(self):
         return u'image_analysis_id({}) centroid({}) orientation({})'.format(
             self.image_analysis_id, self.centroid, self.orientation
         )
 
 
+def point_string(point):
+    """A point as it's stored in a tag's start or end field."""
+    return ','.join(map(str, point))
+
+
 class ManualTag(models.Model):
     image = models.ForeignKey(Image)
     timestamp = models.DateTimeField('DTG of image capture', auto_now_add=True)
@@ -467,6 +530,14 @@ class ManualTag(models.Model):
                                             max_length=20)
     researcher = models.ForeignKey(Researcher)
 
+    # kept up to date by the signal receivers at the bottom of this module
+    verification_count = models.IntegerField('how many times this tag has been verified',
+                                             default=0)
+
+    class Meta:
+        # for Image.untagged_image, which skips images the researcher already tagged
+        index_together = [['researcher', 'image']]
+
     @property
     def int_start(self):
         return tuple(int(x) for x in self.start.split(','))
@@ -477,12 +548,12 @@ class ManualTag(models.Model):
 
     @int_start.setter
     def int_start(self, value):
-        self.start = ','.join(map(str, value))
+        self.start = point_string(value)
         self.save()
 
     @int_end.setter
     def int_end(self, value):
-        self.end = ','.join(map(str, value))
+        self.end = point_string(value)
         self.save()
 
     @property
@@ -535,6 +606,9 @@ class EllipseSearchTag(models.Model):
                                               max_length=20)
     end = models.CommaSeparatedIntegerField('the approximated arrow end',
                                             max_length=20)
+    # top,left,bottom,right of the part of the delta image that was searched
+    foreground_box = models.CommaSeparatedIntegerField('the region that was searched',
+                                                       max_length=24, blank=True, default='')
 
     @property
     def int_start(self):
@@ -546,12 +620,12 @@ class EllipseSearchTag(models.Model):
 
     @int_start.setter
     def int_start(self, value):
-        self.start = ','.join(map(str, value))
+        self.start = point_string(value)
         self.save()
 
     @int_end.setter
     def int_end(self, value):
-        self.end = ','.join(map(str, value))
+        self.end = point_string(value)
         self.save()
 
     @property
@@ -741,23 +815,81 @@ class PriorityManualImage(models.Model):
                     'valid': True}
 
 
+@django.dispatch.dispatcher.receiver(ddms.post_save, sender=CaptureJobRecord)
+def cjr_save(sender, instance, created, **kwargs):
+    if created and instance.resolved_cal_image_id is None:
+        cal_image = instance.latest_cal_image()
+        if cal_image is not None:
+            CaptureJobRecord.objects.filter(pk=instance.id).update(resolved_cal_image=cal_image)
+            instance.resolved_cal_image = cal_image
+
+
+@django.dispatch.dispatcher.receiver(ddms.post_save, sender=Image)
+def cal_image_save(sender, instance, created, **kwargs):
+    if not (created and instance.is_cal_image):
+        return
+
+    # this is the cal image for the experiment's jobs that start after it and before the
+    # next cal image
+    CaptureJobRecord.objects.filter(
+        xp_id=instance.xp_id, job_start__gte=instance.capture_timestamp
+    ).filter(
+        ddm.Q(resolved_cal_image__isnull=True) |
+        ddm.Q(resolved_cal_image__capture_timestamp__lt=instance.capture_timestamp)
+    ).update(resolved_cal_image=instance)
+
+
 @django.dispatch.dispatcher.receiver(ddms.post_delete, sender=Image)
 def image_delete(sender, instance, **kwargs):
+    _cal_images.pop(instance.id, None)
+
     # pass False so ImageField won't save the model
     instance.image_file.delete(False)
 
 
-@django.dispatch.dispatcher.receiver(ddms.pre_delete, sender=ManualTag)
-def tag_delete(sender, instance, **kwargs):
-    instance.researcher.bad_tags += 1
-    instance.researcher.save()
+# The counters below are changed with UPDATE ... SET x = x + 1 so that they never need
+# the row read first and concurrent changes can't undo each other.
+
 
-    instance.image.bad_tags += 1
-    instance.image.save()
+@django.dispatch.dispatcher.receiver(ddms.post_delete, sender=ManualTag)
+def tag_delete(sender, instance, **kwargs):
+    # the tag's verifications were deleted (and uncounted) before it was
+    Researcher.objects.filter(pk=instance.researcher_id).update(
+        bad_tags=ddm.F('bad_tags') + 1, tag_count=ddm.F('tag_count') - 1)
+    Image.objects.filter(pk=instance.image_id).update(
+        bad_tags=ddm.F('bad_tags') + 1, tag_count=ddm.F('tag_count') - 1)
 
 
 @django.dispatch.dispatcher.receiver(ddms.post_save, sender=ManualTag)
-def image_delete(sender, instance, **kwargs):
-    PriorityManualImage.objects.filter(image_id=instance.image.id).delete()
+def tag_save(sender, instance, created, **kwargs):
+    if created:
+        Researcher.objects.filter(pk=instance.researcher_id).update(
+            tag_count=ddm.F('tag_count') + 1)
+        Image.objects.filter(pk=instance.image_id).update(tag_count=ddm.F('tag_count') + 1)
+
+    PriorityManualImage.objects.filter(image_id=instance.image_id).delete()
+
+
+@django.dispatch.dispatcher.receiver(ddms.post_save, sender=ManualVerification)
+def verification_save(sender, instance, created, **kwargs):
+    if not created:
+        return
+
+    ManualTag.objects.filter(pk=instance.tag_id).update(
+        verification_count=ddm.F('verification_count') + 1)
+    # the tagger has one more verified tag if this was the tag's first verification
+    Researcher.objects.filter(manualtag=instance.tag_id,
+                              manualtag__verification_count=1).update(
+        verified_tag_count=ddm.F('verified_tag_count') + 1)
+
+
+@django.dispatch.dispatcher.receiver(ddms.post_delete, sender=ManualVerification)
+def verification_delete(sender, instance, **kwargs):
+    # and one fewer if this was its last
+    Researcher.objects.filter(manualtag=instance.tag_id,
+                              manualtag__verification_count=1).update(
+        verified_tag_count=ddm.F('verified_tag_count') - 1)
+    ManualTag.objects.filter(pk=instance.tag_id).update(
+        verification_count=ddm.F('verification_count') - 1)
 
 
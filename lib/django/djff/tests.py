@@ -1,9 +1,24 @@
+import os
+import time
+import shutil
+import datetime
+import tempfile
+import threading
+
 from django.test import TestCase
-from lib.django.djff.models import (Experiment, Species)
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from lib.django.djff.models import (Experiment, Species, Researcher, CaptureJobRecord, Image,
+                                    ImageAnalysis, ManualTag, ManualVerification,
+                                    EllipseSearchTag, PowerSupplyLog, forget_cal_images)
 import lib.django.djff.views as views
+import lib.write_behind as lwb
+import lib.workers.results_tasks as results_tasks
 import django.utils as du
 from django.utils import timezone
 from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 import django.utils.timezone as dut
 
 
@@ -13,3 +28,371 @@ class SpeciesTests(TestCase):
         self.assertTrue(xp.species)
 
 
+class ImageDeleteTests(TestCase):
+    """
+    Deleting an image deletes its file.  The receiver that does that used to share its
+    name with a later one, so its weak reference died and files were left behind.
+    """
+
+    def setUp(self):
+        self.media_dir = tempfile.mkdtemp()
+        self.field = Image._meta.get_field('image_file')
+        self.saved_storage = self.field.storage
+        self.field.storage = FileSystemStorage(location=self.media_dir)
+
+        now = dut.now()
+        species = Species.objects.create(name='testus deletus', shortname='TSTID')
+        self.xp = Experiment.objects.create(name='TEST_DATA image deletes', xp_start=now,
+                                            species=species)
+
+    def tearDown(self):
+        self.field.storage = self.saved_storage
+        shutil.rmtree(self.media_dir)
+
+    def test_deleting_an_image_deletes_its_file(self):
+        image = Image(xp=self.xp, is_cal_image=True, capture_timestamp=dut.now())
+        image.image_file.save('cal.jpg', ContentFile('not really a jpeg'))
+        path = image.image_file.path
+        self.assertTrue(os.path.isfile(path))
+
+        Image.objects.get(pk=image.id).delete()
+        self.assertFalse(os.path.isfile(path))
+
+
+class QueryCountTests(TestCase):
+    """
+    The hot lookups should cost the same number of queries however much data there is.
+    """
+
+    def setUp(self):
+        self.now = dut.now()
+        species = Species.objects.create(name='testus countus', shortname='TSTQC')
+        self.xp = Experiment.objects.create(name='TEST_DATA query counts',
+                                            xp_start=self.now, species=species)
+        self.cjr = CaptureJobRecord.objects.create(xp=self.xp, job_start=self.now)
+        self.researcher = Researcher.objects.create(name='query counter')
+        self.verifier = Researcher.objects.create(name='query verifier')
+        forget_cal_images()
+
+    def make_image(self, is_cal_image=False, minutes_ago=0):
+        return Image.objects.create(
+            xp=self.xp, cjr=None if is_cal_image else self.cjr, is_cal_image=is_cal_image,
+            capture_timestamp=self.now - datetime.timedelta(minutes=minutes_ago),
+            image_file='test_image.jpg')
+
+    def make_tag(self, image):
+        return ManualTag.objects.create(image=image, researcher=self.researcher,
+                                        start='0,0', end='10,10')
+
+    def verify(self, tag):
+        return ManualVerification.objects.create(tag=tag, researcher=self.verifier)
+
+    def queries_for(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context.captured_queries)
+
+    def test_researcher_stats_take_no_queries(self):
+        image = self.make_image()
+        tags = [self.make_tag(image) for i in range(3)]
+        self.verify(tags[0])
+        self.verify(tags[0])
+        self.verify(tags[1])
+
+        researcher = Researcher.objects.get(pk=self.researcher.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(researcher.tag_score, 3)
+            self.assertEqual(researcher.verified_tags, 2)
+            self.assertEqual(researcher.unverified_tags, 1)
+            self.assertEqual(researcher.all_tags_count, 3)
+            self.assertEqual(researcher.accuracy_score, 1.0)
+
+        self.assertEqual(ManualTag.objects.get(pk=tags[0].id).verification_count, 2)
+        self.assertEqual(Image.objects.get(pk=image.id).tag_count, 3)
+
+    def test_counters_follow_deletes(self):
+        image = self.make_image()
+        tags = [self.make_tag(image) for i in range(3)]
+        verification = self.verify(tags[0])
+        self.verify(tags[1])
+
+        verification.delete()
+        tags[1].delete()
+
+        researcher = Researcher.objects.get(pk=self.researcher.id)
+        self.assertEqual(researcher.tag_count, 2)
+        self.assertEqual(researcher.verified_tag_count, 0)
+        self.assertEqual(researcher.bad_tags, 1)
+
+        image = Image.objects.get(pk=image.id)
+        self.assertEqual(image.tag_count, 2)
+        self.assertEqual(image.bad_tags, 1)
+
+    def test_tagging_and_verifying_cost_the_same_with_more_tags(self):
+        image = self.make_image()
+        first_tag_queries = self.queries_for(lambda: self.make_tag(image))
+        first_verification_queries = self.queries_for(
+            lambda: self.verify(ManualTag.objects.all()[0]))
+
+        for i in range(20):
+            self.verify(self.make_tag(image))
+
+        self.assertEqual(self.queries_for(lambda: self.make_tag(image)), first_tag_queries)
+        self.assertEqual(self.queries_for(lambda: self.verify(ManualTag.objects.all()[0])),
+                         first_verification_queries)
+
+    def test_cal_image_lookup_is_one_query(self):
+        for minutes_ago in range(1, 11):
+            self.make_image(is_cal_image=True, minutes_ago=minutes_ago)
+        latest_cal = self.make_image(is_cal_image=True, minutes_ago=0)
+        self.make_image(is_cal_image=True, minutes_ago=-5)
+
+        cjr = CaptureJobRecord.objects.get(pk=self.cjr.id)
+        self.assertEqual(cjr.resolved_cal_image_id, latest_cal.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(cjr.cal_image.id, latest_cal.id)
+
+        # and the next job record asking for it doesn't need to look it up again
+        cjr = CaptureJobRecord.objects.get(pk=self.cjr.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(cjr.cal_image.id, latest_cal.id)
+
+    def test_cal_image_is_resolved_when_the_job_is_created(self):
+        for minutes_ago in range(2, 11):
+            self.make_image(is_cal_image=True, minutes_ago=minutes_ago)
+        latest_cal = self.make_image(is_cal_image=True, minutes_ago=1)
+
+        cjr = CaptureJobRecord.objects.create(
+            xp=self.xp, job_start=self.now - datetime.timedelta(seconds=30))
+        self.assertEqual(CaptureJobRecord.objects.get(pk=cjr.id).resolved_cal_image_id,
+                         latest_cal.id)
+
+    def test_unresolved_cal_image_is_one_query_and_then_stored(self):
+        cal = self.make_image(is_cal_image=True, minutes_ago=1)
+        CaptureJobRecord.objects.filter(pk=self.cjr.id).update(resolved_cal_image=None)
+
+        cjr = CaptureJobRecord.objects.get(pk=self.cjr.id)
+        # the lookup, and storing what it found
+        with self.assertNumQueries(2):
+            self.assertEqual(cjr.cal_image.id, cal.id)
+        self.assertEqual(CaptureJobRecord.objects.get(pk=self.cjr.id).resolved_cal_image_id,
+                         cal.id)
+
+    def test_latest_analysis_is_one_query(self):
+        image = self.make_image()
+        for minutes_ago in range(5, -1, -1):
+            latest = ImageAnalysis.objects.create(
+                image=image, analysis_datetime=self.now - datetime.timedelta(minutes=minutes_ago),
+                silhouette=False, moments={}, hu_moments=[], meta_data={})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(image.latest_analysis.id, latest.id)
+
+
+class WriteBehindTests(TestCase):
+    """
+    A flush that fails must neither lose the rows nor raise in whoever triggered it.
+    """
+
+    def setUp(self):
+        self.failing = True
+        self.buffer = lwb.WriteBehindBuffer([('good', self.write_logs),
+                                             ('bad', self.write_logs_then_fail)],
+                                            max_rows=3, max_age=3600, max_attempts=2)
+
+    def tearDown(self):
+        if self.buffer._timer is not None:
+            self.buffer._timer.cancel()
+
+    def write_logs(self, logs):
+        PowerSupplyLog.objects.bulk_create(logs)
+
+    def write_logs_then_fail(self, logs):
+        self.write_logs(logs)
+        if self.failing:
+            raise ValueError('bad row')
+
+    def log(self):
+        return PowerSupplyLog(current_meas=1.0, voltage_meas=2.0)
+
+    def test_failing_kind_is_queued_again_and_the_rest_written(self):
+        self.buffer.add('good', self.log())
+        self.buffer.add('bad', self.log())
+        self.buffer.add('good', self.log())
+
+        self.assertEqual(PowerSupplyLog.objects.count(), 2)
+        self.assertEqual(self.buffer.depth, 1)
+        self.assertEqual(self.buffer.metrics()['depth'], {'good': 0, 'bad': 1})
+        self.assertEqual(self.buffer.failed_flushes, 1)
+
+        self.failing = False
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(PowerSupplyLog.objects.count(), 3)
+        self.assertEqual(self.buffer.depth, 0)
+
+    def test_kind_that_keeps_failing_is_dropped(self):
+        self.buffer.add('bad', self.log())
+
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.depth, 1)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.depth, 0)
+
+        self.assertEqual(self.buffer.rows_dropped, 1)
+        self.assertEqual(PowerSupplyLog.objects.count(), 0)
+
+
+class PostImageTests(TestCase):
+    """
+    post_image's image row waits in the write-behind buffer, so it only has an ID to
+    return when posting it filled the buffer.  Its path finds it either way.
+    """
+
+    def setUp(self):
+        self.media_dir = tempfile.mkdtemp()
+        self.field = Image._meta.get_field('image_file')
+        self.saved_storage = self.field.storage
+        self.field.storage = FileSystemStorage(location=self.media_dir)
+        self.saved_max_rows = results_tasks.write_behind.max_rows
+
+        now = dut.now()
+        species = Species.objects.create(name='testus postus', shortname='TSTPI')
+        self.xp = Experiment.objects.create(name='TEST_DATA posted images', xp_start=now,
+                                            species=species)
+        self.cjr = CaptureJobRecord.objects.create(xp=self.xp, voltage=0, current=0)
+
+    def tearDown(self):
+        results_tasks.write_behind.flush()
+        results_tasks.write_behind.max_rows = self.saved_max_rows
+        self.field.storage = self.saved_storage
+        shutil.rmtree(self.media_dir)
+
+    def post(self):
+        return results_tasks.post_image('not really a jpeg', {
+            'xp_id': self.xp.id, 'cjr_id': self.cjr.id, 'is_cal_image': True,
+            'capture_timestamp': time.time(), 'voltage': 0, 'current': 0})
+
+    def test_queued_image_has_no_id_until_the_buffer_is_flushed(self):
+        results_tasks.write_behind.max_rows = 1000
+        posted = self.post()
+
+        self.assertIsNone(posted['id'])
+        self.assertFalse(Image.objects.filter(image_file=posted['path']).exists())
+
+        results_tasks.write_behind.flush()
+        self.assertEqual(Image.objects.get(image_file=posted['path']).xp_id, self.xp.id)
+
+    def test_image_that_fills_the_buffer_gets_its_id(self):
+        results_tasks.write_behind.max_rows = 1
+        posted = self.post()
+
+        self.assertEqual(Image.objects.get(image_file=posted['path']).id, posted['id'])
+
+
+class StoreTagsTests(TestCase):
+    def setUp(self):
+        now = dut.now()
+        species = Species.objects.create(name='testus taggus', shortname='TSTST')
+        xp = Experiment.objects.create(name='TEST_DATA stored tags', xp_start=now,
+                                       species=species)
+        self.image = Image.objects.create(xp=xp, capture_timestamp=now,
+                                          image_file='test_image.jpg')
+
+    def test_ellipse_search_tags_keep_their_foreground_box(self):
+        tag_ids = results_tasks.store_ellipse_search_tags([
+            {'image_id': self.image.id, 'start': (1, 2), 'end': (3, 4), 'score': 0.5,
+             'foreground_box': (10, 20, 110, 220)},
+            {'image_id': self.image.id, 'start': [5, 6], 'end': [7, 8], 'score': 0.5},
+        ])
+
+        tags = EllipseSearchTag.objects.order_by('id')
+        self.assertEqual(tag_ids, [tag.id for tag in tags])
+        self.assertEqual([tag.foreground_box for tag in tags], ['10,20,110,220', ''])
+        self.assertEqual([tag.int_end for tag in tags], [(3, 4), (7, 8)])
+
+    def test_stored_tags_get_their_own_ids_back(self):
+        first_ids = results_tasks.store_ellipse_search_tags(
+            [{'image_id': self.image.id, 'start': (i, i), 'end': (i, i + 1)}
+             for i in range(3)])
+        second_ids = results_tasks.store_ellipse_search_tags(
+            [{'image_id': self.image.id, 'start': (i, i), 'end': (i, i + 1)}
+             for i in range(3, 5)])
+
+        self.assertEqual([EllipseSearchTag.objects.get(pk=tag_id).int_start
+                          for tag_id in first_ids + second_ids],
+                         [(i, i) for i in range(5)])
+        self.assertEqual(results_tasks.store_ellipse_search_tags([]), [])
+
+
+class CalReferenceTests(TestCase):
+    """
+    Streaming analysis keeps one cal image reference per job and cal image.  Building a
+    real one needs the cal file and redis, so a stub stands in for it here.
+    """
+
+    def setUp(self):
+        self.now = dut.now()
+        species = Species.objects.create(name='testus calibrus', shortname='TSTCR')
+        self.xp = Experiment.objects.create(name='TEST_DATA cal references',
+                                            xp_start=self.now, species=species)
+        self.references = list()
+
+        self.saved = results_tasks.FFImage, results_tasks.ImageReference
+        results_tasks.FFImage = lambda source_filename, normalize_image: source_filename
+        results_tasks.ImageReference = self.make_reference
+        results_tasks._cal_references.clear()
+        forget_cal_images()
+
+    def tearDown(self):
+        results_tasks.FFImage, results_tasks.ImageReference = self.saved
+        results_tasks._cal_references.clear()
+
+    def make_reference(self, ff_image, source_path):
+        # slow enough that threads asking at once would all miss without the lock
+        time.sleep(0.01)
+        reference = {'source_path': source_path}
+        self.references.append(reference)
+        return reference
+
+    def make_cal(self, minutes_ago):
+        return Image.objects.create(
+            xp=self.xp, is_cal_image=True,
+            capture_timestamp=self.now - datetime.timedelta(minutes=minutes_ago),
+            image_file='cal_{}.jpg'.format(minutes_ago))
+
+    def test_job_gets_a_new_reference_when_its_cal_image_changes(self):
+        cjr = CaptureJobRecord.objects.create(xp=self.xp, job_start=self.now)
+        self.assertIsNone(results_tasks.cjr_cal_reference(cjr))
+
+        first_cal = self.make_cal(2)
+        cjr = CaptureJobRecord.objects.get(pk=cjr.id)
+        first = results_tasks.cjr_cal_reference(cjr)
+        self.assertEqual(first['source_path'], first_cal.image_file.path)
+        self.assertIs(results_tasks.cjr_cal_reference(
+            CaptureJobRecord.objects.get(pk=cjr.id)), first)
+
+        newer_cal = self.make_cal(1)
+        cjr = CaptureJobRecord.objects.get(pk=cjr.id)
+        self.assertEqual(cjr.resolved_cal_image_id, newer_cal.id)
+        newer = results_tasks.cjr_cal_reference(cjr)
+        self.assertIsNot(newer, first)
+        self.assertEqual(newer['source_path'], newer_cal.image_file.path)
+        self.assertEqual(len(self.references), 2)
+
+    def test_threads_asking_at_once_share_one_reference(self):
+        self.make_cal(1)
+        # the cal image is loaded with the job here, so the threads need no queries
+        cjr = CaptureJobRecord.objects.create(xp=self.xp, job_start=self.now)
+
+        found = list()
+        threads = [threading.Thread(
+            target=lambda: found.append(results_tasks.cjr_cal_reference(cjr)))
+            for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.references), 1)
+        self.assertEqual(len(found), 8)
+        self.assertTrue(all(reference is self.references[0] for reference in found))
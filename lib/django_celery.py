@@ -2,11 +2,44 @@ from __future__ import absolute_import
 
 import os
 from celery import Celery
+import celery.signals
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lib.django.django_fishface.settings')
 from django.conf import settings
+import django.db
 
 celery_app = Celery()
 celery_app.config_from_object('etc.celeryconfig')
 
-celery_app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
\ No newline at end of file
+celery_app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+# Database connections in the worker processes.  Django only recycles connections at
+# the end of a web request, so the workers do it around each task instead: a connection
+# is reused until it's CONN_MAX_AGE seconds old or broken, opened fresh in each new
+# worker process, and closed when the process stops.
+
+
+def close_database_connections():
+    for connection in django.db.connections.all():
+        connection.close()
+
+
+@celery.signals.worker_process_init.connect
+def open_database_connections_afresh(**kwargs):
+    # a connection inherited across the fork is shared with the parent, so drop it
+    # without touching the socket and let this process open its own
+    for connection in django.db.connections.all():
+        connection.connection = None
+
+
+@celery.signals.task_prerun.connect
+@celery.signals.task_postrun.connect
+def recycle_database_connections(**kwargs):
+    for connection in django.db.connections.all():
+        connection.close_if_unusable_or_obsolete()
+
+
+@celery.signals.worker_process_shutdown.connect
+def close_database_connections_at_shutdown(**kwargs):
+    close_database_connections()
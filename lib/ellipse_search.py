@@ -0,0 +1,1067 @@
+import math
+import collections
+
+import numpy as np
+import cv2
+
+import lib.cluster_utilities as lcu
+
+import etc.fishface_config as ff_conf
+
+COARSE_ANGLES = range(0, 180, 10)
+REFINEMENT_HALF_WIDTH = 11
+ENVELOPE_MAJOR_MIN = 20
+ENVELOPE_MAJOR_MAX = 60
+ENVELOPE_MINOR_MIN = int(ENVELOPE_MAJOR_MIN/2.3)
+ENVELOPE_GOOD_FITS = 10
+ENVELOPE_EARLY_STOP_PATIENCE = 5
+# the side of the square blocks that the images are averaged over to bound match scores
+PRUNE_BLOCK_SIZE = 2
+# slack for rounding when deciding a match can't beat the best one so far
+PRUNE_TOLERANCE = 1e-4
+# stands in for 1 / sqrt(0) when bounding the scores of empty windows, which are always 1
+EMPTY_WINDOW_FACTOR = 1e30
+ENVELOPE_KEYS = 'major_min major_max ratio_min ratio_max color_min color_max'.split(' ')
+
+
+def ellipse_axes(ratio, major, scale=1):
+    return (int(0.5 * major / scale), int(0.5 * major / ratio / scale))
+
+
+def draw_cropped_ellipse(color, angle, axes, canvas_size, center):
+    """Draws a filled ellipse on a square canvas and returns it cropped to the
+    bounding box of its non-zero pixels."""
+    canvas = np.zeros((canvas_size, canvas_size), dtype=np.uint8)
+    cv2.ellipse(img=canvas, center=center, axes=axes, angle=angle,
+                startAngle=0, endAngle=360, color=int(color), thickness=-1)
+
+    non_zeroes = np.where(canvas != 0)
+    nz_mins = np.amin(non_zeroes, axis=1)
+    nz_maxes = np.amax(non_zeroes, axis=1)
+
+    return np.ascontiguousarray(
+        canvas[nz_mins[0]:nz_maxes[0] + 1, nz_mins[1]:nz_maxes[1] + 1]
+    )
+
+
+class EllipseTemplateBank(object):
+    """
+    All of the ellipse templates needed to search the envelope of a single CJR.
+
+    The coarse sweep templates are drawn when the bank is created.  Refinement templates
+    are drawn the first time they're asked for and kept from then on.  Each template is
+    stored cropped to its ellipse, so the bank holds no empty canvas.
+
+    A bank with a scale greater than 1 draws its templates that many times smaller, for
+    searching a downsampled image.  Templates are still looked up by their full
+    resolution parameters.
+    """
+
+    def __init__(self, envelope, scale=1):
+        self.envelope = dict((key, envelope[key]) for key in ENVELOPE_KEYS)
+        self.scale = scale
+
+        self.canvas_size = int(envelope['major_max'] / scale) + 2
+        self.center = tuple([int(envelope['major_max'] / scale // 2)] * 2)
+
+        self.colors = lcu.mam_envelope(envelope, 'color')
+        self.majors = lcu.mam_envelope(envelope, 'major')
+        self.ratios = lcu.mam_envelope(envelope, 'ratio', ints=False)
+
+        self._templates = dict()
+
+        for params in self.coarse_params:
+            self.template(*params)
+
+    @property
+    def coarse_params(self):
+        """(color, angle, ratio, major) for every template in the coarse sweep, in the
+        order the sweep has always used."""
+        return [(color, angle, ratio, major)
+                for color in self.colors
+                for angle in COARSE_ANGLES
+                for ratio in self.ratios
+                for major in self.majors]
+
+    def template(self, color, angle, ratio, major, canvas_size=None):
+        if canvas_size is None:
+            canvas_size = self.canvas_size
+
+        key = (color, angle, ratio, major, canvas_size)
+        try:
+            return self._templates[key]
+        except KeyError:
+            template = draw_cropped_ellipse(color, angle,
+                                           ellipse_axes(ratio, major, self.scale),
+                                           canvas_size, self.center)
+            self._templates[key] = template
+            return template
+
+    def __len__(self):
+        return len(self._templates)
+
+    @property
+    def nbytes(self):
+        return sum(template.nbytes for template in self._templates.itervalues())
+
+
+_template_banks = collections.OrderedDict()
+_envelope_masks = dict()
+
+
+def envelope_key(envelope):
+    return tuple(envelope[key] for key in ENVELOPE_KEYS)
+
+
+def template_bank(envelope, scale=1):
+    """
+    Returns the template bank for an envelope, building it if this process hasn't
+    seen the envelope recently.  Banks are kept across tasks, so consecutive chunks
+    from the same CJR don't redraw anything.
+    """
+    key = envelope_key(envelope) + (scale,)
+
+    try:
+        bank = _template_banks.pop(key)
+    except KeyError:
+        bank = EllipseTemplateBank(envelope, scale=scale)
+
+    _template_banks[key] = bank
+    while len(_template_banks) > ff_conf.ELLIPSE_TEMPLATE_BANKS_PER_PROCESS:
+        _template_banks.popitem(last=False)
+
+    return bank
+
+
+class TemplateMatcher(object):
+    """
+    Scores templates against an image, or an N x H x W stack of images, the way
+    cv2.matchTemplate does with TM_SQDIFF_NORMED.  Subclasses supply the scoring; this
+    class keeps the integral images that normalize scores, and picks out the best match
+    of each template in each image.
+
+    Templates are handled in order of size, so the window energy of the images is
+    computed once per template size.
+
+    With prune set, best_match_arrays is a branch and bound search, and the images are
+    also kept averaged over PRUNE_BLOCK_SIZE square blocks, which lower_bounds uses to
+    bound the scores cheaply.  matches_avoided counts, per image, the matches that were
+    skipped because they couldn't have beaten the best one.
+    """
+
+    # arrays with one entry per image, which frames_of() slices
+    _frame_arrays = ('_integral_sq', '_block_spectra', '_block_integral_sq',
+                     'matches_avoided')
+
+    def __init__(self, images, batch_size=ff_conf.FFT_MATCH_BATCH_SIZE, prune=False):
+        images = np.asarray(images)
+        if images.ndim == 2:
+            images = images[np.newaxis]
+
+        self.frames = images.shape[0]
+        self.shape = images.shape[1:]
+        self.batch_size = batch_size
+        self.prune = prune
+
+        float_images = images.astype(np.float64)
+        integral_shape = (self.frames, self.shape[0] + 1, self.shape[1] + 1)
+        self._integral_sq = np.zeros(integral_shape, dtype=np.float64)
+        self._integral_sq[:, 1:, 1:] = (float_images ** 2).cumsum(axis=1).cumsum(axis=2)
+
+        self.matches_avoided = np.zeros(self.frames, dtype=np.int64)
+        self._block_spectra = self._block_integral_sq = None
+        if prune:
+            self._setup_blocks(float_images)
+
+        self._setup(images, float_images)
+
+    def _setup_blocks(self, float_images):
+        k = PRUNE_BLOCK_SIZE
+        block_shape = (self.shape[0] // k, self.shape[1] // k)
+        blocks = float_images[:, :block_shape[0] * k, :block_shape[1] * k].reshape(
+            self.frames, block_shape[0], k, block_shape[1], k).mean(axis=(2, 4))
+        self._block_integral_sq = np.zeros((self.frames, block_shape[0] + 1,
+                                            block_shape[1] + 1), dtype=np.float64)
+        self._block_integral_sq[:, 1:, 1:] = (blocks ** 2).cumsum(axis=1).cumsum(axis=2)
+
+        self.block_shape = block_shape
+        self.block_fft_shape = tuple(cv2.getOptimalDFTSize(side) for side in block_shape)
+        padded = np.zeros(self.block_fft_shape, dtype=np.float32)
+        self._block_spectra = np.empty((self.frames,) + self.block_fft_shape,
+                                       dtype=np.float32)
+        for spectrum, image in zip(self._block_spectra, blocks):
+            padded[:block_shape[0], :block_shape[1]] = image
+            spectrum[...] = cv2.dft(padded)
+
+    def _setup(self, images, float_images):
+        pass
+
+    def frames_of(self, indices):
+        """A matcher for some of the images of the stack that shares this matcher's
+        work."""
+        indices = list(indices)
+        matcher = self.__class__.__new__(self.__class__)
+        matcher.__dict__.update(self.__dict__)
+        matcher.frames = len(indices)
+        for name in self._frame_arrays:
+            if getattr(self, name) is not None:
+                setattr(matcher, name, getattr(self, name)[indices])
+        return matcher
+
+    def frame(self, index):
+        """A matcher for one image of the stack that shares this matcher's work."""
+        return self.frames_of([index])
+
+    @staticmethod
+    def _window_totals(ii, template_shape):
+        h, w = template_shape
+        return ii[:, h:, w:] - ii[:, :-h, w:] - ii[:, h:, :-w] + ii[:, :-h, :-w]
+
+    def window_energy(self, template_shape):
+        """Sum of the squared image pixels under every valid placement of a template."""
+        return self._window_totals(self._integral_sq, template_shape)
+
+    @staticmethod
+    def _mask_of(template):
+        """(mask, color) such that template == mask * color, where the mask is the
+        template itself unless the template is one color on black."""
+        color = int(template.max())
+        if color and np.array_equal(template, (template > 0) * np.uint8(color)):
+            return (template > 0).view(np.uint8), color
+        return template, 1
+
+    def _mask_key(self, template):
+        mask = self._mask_of(template)[0]
+        return (mask.shape, mask.tostring())
+
+    def _group_key(self, template):
+        """Templates with the same key share work when they are matched one after
+        another."""
+        return template.shape
+
+    def _order(self, templates):
+        """The order to match templates in: grouped by size, so that the window energy
+        of the images is computed once per size."""
+        keys = [self._group_key(template) for template in templates]
+        return sorted(range(len(templates)), key=lambda i: keys[i])
+
+    def _pruned_order(self, templates, bounds):
+        """The order to match templates in when pruning: still grouped, but with the
+        groups, and the templates in each group, in order of their lowest bound, so that
+        the likely winners are matched first."""
+        keys = [self._group_key(template) for template in templates]
+        lowest = bounds.min(axis=1)
+
+        group_lowest = dict()
+        for key, bound in zip(keys, lowest):
+            group_lowest[key] = min(group_lowest.get(key, np.inf), bound)
+
+        return sorted(range(len(templates)),
+                      key=lambda i: (group_lowest[keys[i]], keys[i], lowest[i], i))
+
+    def _prepare(self, templates):
+        """Whatever per-template work _score_maps wants done a batch at a time."""
+        return [None] * len(templates)
+
+    def _score_maps(self, template, prepared, window_energy, frames=None):
+        """The N x h x w score maps of one template, or just those of the given frames,
+        in which case window_energy is just theirs too."""
+        raise NotImplementedError
+
+    def scores(self, templates):
+        """Yields (index, score maps) for each template, where the score maps are the
+        TM_SQDIFF_NORMED results for every image as an N x h x w array.  Templates come
+        out grouped by size rather than in the order they were given."""
+        order = self._order(templates)
+
+        energy_shape = window_energy = None
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            prepared = self._prepare([templates[index] for index in batch])
+
+            for index, template_prepared in zip(batch, prepared):
+                template = templates[index]
+                if template.shape != energy_shape:
+                    energy_shape = template.shape
+                    window_energy = self.window_energy(energy_shape)
+
+                yield index, self._score_maps(template, template_prepared, window_energy)
+
+    def _phase_placements(self, template_shape):
+        """
+        For each of the offsets (oy, ox) that the images' blocks can start at within a
+        placement of a template, the placements where they do: the window energy of the
+        images under each of those placements is window_energy[:, top::k, left::k], and
+        each placement's first complete block is at (first_row, first_column) plus its
+        index in that array.  Yields (oy, ox, top, left, first_row, first_column, rows,
+        columns) for the offsets that have any placements.
+        """
+        k = PRUNE_BLOCK_SIZE
+        height = self.shape[0] - template_shape[0] + 1
+        width = self.shape[1] - template_shape[1] + 1
+
+        for oy in range(k):
+            for ox in range(k):
+                top, left = (k - oy) % k, (k - ox) % k
+                rows, columns = len(range(top, height, k)), len(range(left, width, k))
+                if rows and columns:
+                    yield oy, ox, top, left, int(oy > 0), int(ox > 0), rows, columns
+
+    def _block_phases(self, mask, block_energies):
+        """
+        The mask averaged over the blocks of each placement in _phase_placements, as a
+        list of (correlation of the block mask with each block image, energy of the block
+        images under it, energy of the block mask), or None if a placement has no
+        complete blocks in it.  block_energies keeps the energies of the block images by
+        block mask shape, for the masks the size of this one.
+        """
+        k = PRUNE_BLOCK_SIZE
+
+        phases = list()
+        for oy, ox, top, left, first_row, first_column, rows, columns in \
+                self._phase_placements(mask.shape):
+            block_rows, block_columns = (mask.shape[0] - oy) // k, (mask.shape[1] - ox) // k
+            if not block_rows or not block_columns:
+                return None
+
+            block_mask = mask[oy:oy + block_rows * k, ox:ox + block_columns * k].astype(
+                np.float32).reshape(block_rows, k, block_columns, k).mean(axis=(1, 3))
+
+            placements = (slice(None), slice(first_row, first_row + rows),
+                          slice(first_column, first_column + columns))
+            correlations = self._block_correlations(block_mask)
+            if block_mask.shape not in block_energies:
+                block_energies[block_mask.shape] = self._window_totals(
+                    self._block_integral_sq, block_mask.shape)
+            block_window_energy = block_energies[block_mask.shape]
+
+            phases.append((correlations[placements], block_window_energy[placements],
+                           np.sum(block_mask.astype(np.float64) ** 2)))
+
+        return phases
+
+    def _block_correlations(self, block_mask):
+        """The correlation of a block mask with each block image, the way FFTMatcher
+        correlates masks with images."""
+        padded = np.zeros(self.block_fft_shape, dtype=np.float32)
+        padded[:block_mask.shape[0], :block_mask.shape[1]] = block_mask
+        mask_spectrum = cv2.dft(padded)
+
+        height = self.block_shape[0] - block_mask.shape[0] + 1
+        width = self.block_shape[1] - block_mask.shape[1] + 1
+        correlations = np.empty((self.frames, height, width), dtype=np.float32)
+        for correlation, block_spectrum in zip(correlations, self._block_spectra):
+            product = cv2.mulSpectrums(block_spectrum, mask_spectrum, 0, conjB=True)
+            correlation[...] = cv2.idft(product, flags=cv2.DFT_REAL_OUTPUT +
+                                        cv2.DFT_SCALE)[:height, :width]
+        return correlations
+
+    def _inverse_root_energies(self, template_shape):
+        """k * k / sqrt(window energy) of each placement in _phase_placements.  Empty
+        windows always score 1, so they get a factor big enough to push their bound
+        there."""
+        k = PRUNE_BLOCK_SIZE
+        window_energy = self.window_energy(template_shape)
+
+        inverses = list()
+        for oy, ox, top, left, first_row, first_column, rows, columns in \
+                self._phase_placements(template_shape):
+            energy = window_energy[:, top::k, left::k]
+            inverse = np.empty(energy.shape, dtype=np.float64)
+            inverse.fill(EMPTY_WINDOW_FACTOR)
+            np.sqrt(energy, out=inverse, where=energy > 0)
+            np.divide(k * k, inverse, out=inverse, where=energy > 0)
+            inverses.append(inverse)
+
+        return inverses
+
+    def lower_bounds(self, templates):
+        """
+        A lower bound on the best score of every template in every image, as a T x N
+        array, worked out on the images averaged over PRUNE_BLOCK_SIZE square blocks.
+
+        The squared difference between a block of image and the same block of template
+        is at least the block's area times the squared difference of their averages.  So
+        a placement's squared difference is at least the block area times the squared
+        difference between the block image and the template averaged over the blocks the
+        placement covers completely, which depends on where in the template the blocks
+        start.  Dividing that by the placement's exact normalization bounds its score.
+        """
+        bounds = np.empty((len(templates), self.frames), dtype=np.float64)
+        keys = [self._mask_key(template) for template in templates]
+        order = sorted(range(len(templates)), key=lambda i: keys[i])
+
+        phases_key = phases = None
+        energy_shape = inverses = block_energies = None
+        for index in order:
+            template = templates[index]
+            mask, color = self._mask_of(template)
+
+            if template.shape != energy_shape:
+                energy_shape = template.shape
+                inverses = self._inverse_root_energies(energy_shape)
+                block_energies = dict()
+
+            if keys[index] != phases_key:
+                phases_key = keys[index]
+                phases = self._block_phases(mask, block_energies)
+
+            template_energy = color * color * np.sum(mask.astype(np.float64) ** 2)
+            if phases is None or not template_energy:
+                # some placements hold no complete block, or the template is empty, so
+                # there's nothing to bound
+                bounds[index] = 0
+                continue
+
+            # each placement's bound is sq_diff / sqrt(window energy * template energy),
+            # and the template energy is the same for all of them
+            bound = np.empty(self.frames, dtype=np.float64)
+            bound.fill(np.inf)
+            for (correlations, block_window_energy, block_mask_energy), inverse in \
+                    zip(phases, inverses):
+                sq_diff = np.multiply(correlations, -2.0 * color, dtype=np.float64)
+                sq_diff += block_window_energy
+                sq_diff += color * color * block_mask_energy
+                sq_diff *= inverse
+                np.minimum(bound, sq_diff.reshape(self.frames, -1).min(axis=1), out=bound)
+
+            # scores saturate at 1, and rounding can leave a squared difference below 0
+            bounds[index] = np.clip(bound / math.sqrt(template_energy), 0, 1)
+
+        return bounds
+
+    def best_match_arrays(self, templates):
+        """
+        The best match of every template in every image.  Returns a T x N array of scores
+        and a T x N x 2 array of (x, y) locations, matching what cv2.minMaxLoc reports as
+        the minimum of a cv2.matchTemplate result.
+
+        With pruning, this is a branch and bound search: templates are matched in order
+        of their lower_bounds, and each image skips the templates whose bound can't beat
+        the best score it has seen so far.  Skipped matches score inf, so the winner for
+        each image is the same as without pruning.
+        """
+        if self.prune:
+            return self._pruned_best_match_arrays(templates)
+
+        scores = np.empty((len(templates), self.frames), dtype=np.float64)
+        locations = np.empty((len(templates), self.frames, 2), dtype=np.int32)
+
+        for index, score_maps in self.scores(templates):
+            scores[index], locations[index] = self._best_of(score_maps)
+
+        return scores, locations
+
+    @staticmethod
+    def _best_of(score_maps):
+        flat_maps = score_maps.reshape(len(score_maps), -1)
+        best = np.argmin(flat_maps, axis=1)
+
+        locations = np.empty((len(score_maps), 2), dtype=np.int32)
+        locations[:, 1], locations[:, 0] = np.unravel_index(best, score_maps.shape[1:])
+
+        return flat_maps[np.arange(len(score_maps)), best], locations
+
+    def _pruned_best_match_arrays(self, templates):
+        bounds = self.lower_bounds(templates)
+
+        scores = np.empty((len(templates), self.frames), dtype=np.float64)
+        scores.fill(np.inf)
+        locations = np.empty((len(templates), self.frames, 2), dtype=np.int32)
+        locations.fill(-1)
+        best = np.empty(self.frames, dtype=np.float64)
+        best.fill(np.inf)
+
+        pending = collections.deque(self._pruned_order(templates, bounds))
+
+        energy_shape = window_energy = None
+        while pending:
+            # the best scores only get better, so a template that no image needs now
+            # won't be needed later, and isn't worth preparing
+            batch = list()
+            while pending and len(batch) < self.batch_size:
+                index = pending.popleft()
+                if (bounds[index] <= best + PRUNE_TOLERANCE).any():
+                    batch.append(index)
+                else:
+                    self.matches_avoided += 1
+            prepared = self._prepare([templates[index] for index in batch])
+
+            for index, template_prepared in zip(batch, prepared):
+                needed = np.flatnonzero(bounds[index] <= best + PRUNE_TOLERANCE)
+                self.matches_avoided += 1
+                self.matches_avoided[needed] -= 1
+                if not len(needed):
+                    continue
+
+                template = templates[index]
+                if template.shape != energy_shape:
+                    energy_shape = template.shape
+                    window_energy = self.window_energy(energy_shape)
+
+                if len(needed) == self.frames:
+                    score_maps = self._score_maps(template, template_prepared, window_energy)
+                else:
+                    score_maps = self._score_maps(template, template_prepared,
+                                                  window_energy[needed], frames=needed)
+
+                scores[index, needed], locations[index, needed] = self._best_of(score_maps)
+                best[needed] = np.minimum(best[needed], scores[index, needed])
+
+        return scores, locations
+
+    def best_matches(self, templates):
+        """(score, (x, y)) for each template against the first image."""
+        scores, locations = self.best_match_arrays(templates)
+        return [(float(score), (int(x), int(y)))
+                for score, (x, y) in zip(scores[:, 0], locations[:, 0])]
+
+
+class FFTMatcher(TemplateMatcher):
+    """
+    Each image is transformed to the frequency domain only once, and each template once,
+    with cv2.dft in single precision; a template is then scored against every image in
+    the stack with one spectrum product and inverse transform per image.
+
+    A template that is a single color on black is that color times its mask, and so is
+    its correlation with an image.  Templates are matched grouped by mask, and the
+    correlations of a mask are worked out once and rescaled for each of its colors, so
+    the coarse sweep transforms one template per color-less ellipse rather than one per
+    color.
+    """
+
+    _frame_arrays = TemplateMatcher._frame_arrays + ('image_spectra',)
+
+    def _setup(self, images, float_images):
+        self.fft_shape = tuple(cv2.getOptimalDFTSize(side) for side in self.shape)
+
+        padded = np.zeros(self.fft_shape, dtype=np.float32)
+        self.image_spectra = np.empty((self.frames,) + self.fft_shape, dtype=np.float32)
+        for spectrum, image in zip(self.image_spectra, images):
+            padded[:self.shape[0], :self.shape[1]] = image
+            spectrum[...] = cv2.dft(padded)
+
+        self._correlations_key = None
+        self._correlations = None
+        self._correlated = None
+
+    def frames_of(self, indices):
+        matcher = super(FFTMatcher, self).frames_of(indices)
+        matcher._correlations_key = None
+        matcher._correlations = None
+        matcher._correlated = None
+        return matcher
+
+    def _group_key(self, template):
+        return self._mask_key(template)
+
+    def _prepare(self, templates):
+        prepared = list()
+        spectra = dict()
+        padded = np.zeros(self.fft_shape, dtype=np.float32)
+        for template in templates:
+            mask, color = self._mask_of(template)
+            key = (mask.shape, mask.tostring())
+            if key not in spectra:
+                padded.fill(0)
+                padded[:mask.shape[0], :mask.shape[1]] = mask
+                spectra[key] = (cv2.dft(padded), np.sum(mask.astype(np.float64) ** 2))
+            prepared.append((key, color) + spectra[key])
+        return prepared
+
+    def _mask_correlations(self, key, mask_spectrum, shape, frames=None):
+        """The correlation of a mask with each image, or just with the given frames,
+        kept for the next template with the same mask.  Each image is only correlated
+        with a mask the first time it's asked for."""
+        if key != self._correlations_key:
+            height, width = self.shape[0] - shape[0] + 1, self.shape[1] - shape[1] + 1
+            self._correlations = np.empty((self.frames, height, width), dtype=np.float32)
+            self._correlated = np.zeros(self.frames, dtype=bool)
+            self._correlations_key = key
+
+        if frames is None:
+            frames = np.arange(self.frames)
+
+        height, width = self._correlations.shape[1:]
+        for frame in frames:
+            if not self._correlated[frame]:
+                product = cv2.mulSpectrums(self.image_spectra[frame], mask_spectrum, 0,
+                                           conjB=True)
+                self._correlations[frame] = cv2.idft(
+                    product, flags=cv2.DFT_REAL_OUTPUT + cv2.DFT_SCALE)[:height, :width]
+                self._correlated[frame] = True
+
+        if len(frames) == self.frames:
+            return self._correlations
+        return self._correlations[frames]
+
+    def _score_maps(self, template, prepared, window_energy, frames=None):
+        key, color, mask_spectrum, mask_energy = prepared
+        correlations = self._mask_correlations(key, mask_spectrum, template.shape, frames)
+
+        template_energy = color * color * mask_energy
+        sq_diff = np.multiply(correlations, -2.0 * color, dtype=np.float64)
+        sq_diff += window_energy
+        sq_diff += template_energy
+        np.maximum(sq_diff, 0, out=sq_diff)
+
+        norm = window_energy * template_energy
+        np.sqrt(norm, out=norm)
+
+        # same saturation rule as OpenCV: anything that isn't clearly below the norm
+        # (including empty windows) scores as a complete mismatch
+        mismatched = sq_diff >= norm
+        np.divide(sq_diff, norm, out=sq_diff, where=~mismatched)
+        sq_diff[mismatched] = 1.0
+        return sq_diff
+
+
+class CV2Matcher(TemplateMatcher):
+    """Scores with cv2.matchTemplate directly, one image at a time."""
+
+    _frame_arrays = TemplateMatcher._frame_arrays + ('images',)
+
+    def _setup(self, images, float_images):
+        self.images = np.ascontiguousarray(images)
+
+    def _score_maps(self, template, prepared, window_energy, frames=None):
+        images = self.images if frames is None else self.images[frames]
+        return np.array([cv2.matchTemplate(image, template, cv2.TM_SQDIFF_NORMED)
+                         for image in images])
+
+
+class SearchConfig(object):
+    """
+    How find_best_ellipses searches a stack of delta images.
+
+    backend is one of BACKENDS.  'cv2' matches templates with cv2.matchTemplate, 'fft'
+    with FFTMatcher, and 'pyramid' runs the coarse sweep with FFTMatcher on copies of the
+    images that have been halved pyramid_levels times, then refines at full resolution
+    in a window around each coarse winner.
+
+    foreground_roi limits the search to the foreground of each image.
+
+    prune makes the coarse sweep a branch and bound search, which finds the same
+    ellipses without matching the templates that can't beat the best one so far.
+    """
+
+    BACKENDS = ('cv2', 'fft', 'pyramid')
+    FIELDS = ('backend', 'pyramid_levels', 'foreground_roi', 'prune')
+
+    def __init__(self, backend=ff_conf.ELLIPSE_SEARCH_BACKEND,
+                 pyramid_levels=ff_conf.ELLIPSE_SEARCH_PYRAMID_LEVELS,
+                 foreground_roi=ff_conf.ELLIPSE_SEARCH_FOREGROUND_ROI,
+                 prune=ff_conf.ELLIPSE_SEARCH_PRUNE):
+        if backend not in self.BACKENDS:
+            raise ValueError('Unknown ellipse search backend: {}'.format(backend))
+        if backend == 'pyramid' and pyramid_levels < 1:
+            raise ValueError('The pyramid backend needs at least one pyramid level.')
+
+        self.backend = backend
+        self.pyramid_levels = int(pyramid_levels)
+        self.foreground_roi = bool(foreground_roi)
+        self.prune = bool(prune)
+
+    @property
+    def matcher_class(self):
+        return CV2Matcher if self.backend == 'cv2' else FFTMatcher
+
+    @property
+    def coarse_levels(self):
+        """How many times the coarse sweep halves the images."""
+        return self.pyramid_levels if self.backend == 'pyramid' else 0
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.FIELDS)
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        """Ignores fields this version doesn't know, e.g. from a job written by an older one."""
+        return cls(**dict((name, value) for name, value in config_dict.iteritems()
+                          if name in cls.FIELDS))
+
+    def __repr__(self):
+        return 'SearchConfig({})'.format(', '.join(
+            '{}={!r}'.format(name, getattr(self, name)) for name in self.FIELDS))
+
+
+def ellipse_center(location, ratio, major, scale=1):
+    axes = ellipse_axes(ratio, major, scale)
+    return (location[0] + axes[1], location[1] + axes[0])
+
+
+def refinement_sweep(matcher, bank, color, angle_approx, ratio, major):
+    """Tries every angle within REFINEMENT_HALF_WIDTH degrees of the coarse winner, and
+    returns the best as a (score, angle, center) tuple for each of the matcher's images.
+    Ties go to the smallest angle."""
+    angles = range(angle_approx - REFINEMENT_HALF_WIDTH,
+                   angle_approx + REFINEMENT_HALF_WIDTH + 1)
+    scores, locations = matcher.best_match_arrays([
+        bank.template(color, angle, ratio, major, canvas_size=major + 2) for angle in angles
+    ])
+
+    return [(float(scores[best, i]), angles[best],
+             ellipse_center(locations[best, i], ratio, major))
+            for i, best in enumerate(np.argmin(scores, axis=0))]
+
+
+def window_around(center, half_size, shape):
+    """(top, left, bottom, right) of a square window around an (x, y) center, clipped to
+    an image of the given shape."""
+    x, y = center
+    return (max(0, y - half_size), max(0, x - half_size),
+            min(shape[0], y + half_size + 1), min(shape[1], x + half_size + 1))
+
+
+def foreground_box(delta, padding, seed=None):
+    """
+    (top, left, bottom, right) of the foreground of a better_delta image, padded and
+    clipped to the image.
+
+    The foreground is the Otsu-thresholded blob that contains the (x, y) seed point if
+    one is given, or else the largest blob.  If nothing is found, the whole image is used.
+    """
+    height, width = delta.shape[:2]
+
+    thresh, mask = cv2.threshold(delta, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    contours = cv2.findContours(mask, mode=cv2.RETR_EXTERNAL,
+                                method=cv2.CHAIN_APPROX_SIMPLE)[0]
+    if contours is None or len(contours) == 0:
+        return (0, 0, height, width)
+
+    blob = None
+    if seed is not None:
+        seed = tuple(float(c) for c in seed)
+        for contour in contours:
+            if cv2.pointPolygonTest(contour, seed, False) >= 0:
+                blob = contour
+                break
+
+    if blob is None:
+        blob = max(contours, key=cv2.contourArea)
+
+    x, y, w, h = cv2.boundingRect(blob)
+
+    return (max(0, y - padding), max(0, x - padding),
+            min(height, y + h + padding), min(width, x + w + padding))
+
+
+def uniform_boxes(boxes, shape):
+    """Grows each (top, left, bottom, right) box to the size of the largest one without
+    leaving an image of the given shape, so that the crops can be stacked."""
+    boxes = np.array(boxes)
+    height = (boxes[:, 2] - boxes[:, 0]).max()
+    width = (boxes[:, 3] - boxes[:, 1]).max()
+
+    tops = np.minimum(boxes[:, 0], shape[0] - height)
+    lefts = np.minimum(boxes[:, 1], shape[1] - width)
+
+    return np.column_stack((tops, lefts, tops + height, lefts + width))
+
+
+def find_best_ellipses(deltas, envelope, config=None):
+    """
+    Runs the coarse sweep over an N x H x W stack of delta images from the same CJR, then
+    the refinement sweep around each image's coarse winner.
+
+    Returns a dict of per-image arrays: 'score', 'angle', 'center' (N x 2, as x, y),
+    'color', 'major', 'box' (N x 4), the (top, left, bottom, right) region of each
+    delta image that was searched, and 'matches_avoided', the number of coarse template
+    matches that pruning skipped for each image.
+
+    config is a SearchConfig, and defaults to the one in fishface_config.  With the
+    pyramid backend, the full resolution refinement only looks at a window around each
+    coarse winner that is padded by major_max.  With foreground_roi set, the foreground
+    regions are padded by major_max and all grown to the same size so that they can still
+    be searched as one stack.
+    """
+    if config is None:
+        config = SearchConfig()
+
+    deltas = np.asarray(deltas)
+    frames = len(deltas)
+    pyramid_levels = config.coarse_levels
+
+    bank = template_bank(envelope)
+    scale = 2 ** pyramid_levels
+    padding = int(envelope['major_max']) + 2 * scale
+
+    if config.foreground_roi:
+        boxes = uniform_boxes([foreground_box(delta, padding) for delta in deltas],
+                              deltas.shape[1:])
+        deltas = np.array([delta[top:bottom, left:right]
+                           for delta, (top, left, bottom, right) in zip(deltas, boxes)])
+    else:
+        boxes = np.tile((0, 0) + deltas.shape[1:], (frames, 1))
+
+    if pyramid_levels:
+        small_deltas = list()
+        for delta in deltas:
+            for level in range(pyramid_levels):
+                delta = cv2.pyrDown(delta)
+            small_deltas.append(delta)
+
+        coarse_bank = template_bank(envelope, scale=scale)
+        coarse_matcher = FFTMatcher(small_deltas, prune=config.prune)
+    else:
+        coarse_bank = bank
+        coarse_matcher = config.matcher_class(deltas, prune=config.prune)
+
+    all_params = coarse_bank.coarse_params
+    coarse_scores, coarse_locations = coarse_matcher.best_match_arrays(
+        [coarse_bank.template(*params) for params in all_params])
+    winners = np.argmin(coarse_scores, axis=0)
+
+    result = {
+        'score': np.empty(frames, dtype=np.float64),
+        'angle': np.empty(frames, dtype=np.int32),
+        'center': np.empty((frames, 2), dtype=np.int32),
+        'color': np.empty(frames, dtype=np.int32),
+        'major': np.empty(frames, dtype=np.int32),
+        'box': boxes,
+        'matches_avoided': coarse_matcher.matches_avoided.copy(),
+    }
+
+    # the images that share a coarse winner are refined together, except with the
+    # pyramid, where each is refined in a window of its own
+    if pyramid_levels:
+        groups = [(winner, [i]) for i, winner in enumerate(winners)]
+    else:
+        grouped = collections.OrderedDict()
+        for i, winner in enumerate(winners):
+            grouped.setdefault(winner, list()).append(i)
+        groups = grouped.items()
+
+    for winner, frame_indices in groups:
+        (color, angle_approx, ratio, major) = all_params[winner]
+
+        if pyramid_levels:
+            i = frame_indices[0]
+            coarse_center = ellipse_center(coarse_locations[winner, i], ratio, major, scale)
+            top, left, bottom, right = window_around(
+                tuple(int(c * scale) for c in coarse_center), padding, deltas[i].shape)
+            matcher = FFTMatcher(deltas[i][top:bottom, left:right])
+            offset = (left, top)
+        else:
+            matcher = coarse_matcher.frames_of(frame_indices)
+            # only the coarse sweep is pruned, as with the pyramid
+            matcher.prune = False
+            offset = (0, 0)
+
+        refined = refinement_sweep(matcher, bank, color, angle_approx, ratio, major)
+
+        for i, (score, angle, center) in zip(frame_indices, refined):
+            result['score'][i] = score
+            result['angle'][i] = angle
+            result['center'][i] = (center[0] + offset[0] + boxes[i][1],
+                                   center[1] + offset[1] + boxes[i][0])
+            result['color'][i] = color
+            result['major'][i] = major
+
+    return result
+
+
+def find_best_ellipse(delta, envelope, config=None):
+    """
+    find_best_ellipses for a single delta image.  Returns the best ellipse as
+    (score, angle, center, color, major, box).
+    """
+    result = find_best_ellipses([delta], envelope, config=config)
+
+    return (float(result['score'][0]), int(result['angle'][0]),
+            tuple(int(c) for c in result['center'][0]),
+            int(result['color'][0]), int(result['major'][0]),
+            tuple(int(c) for c in result['box'][0]))
+
+
+def ellipse_tag(image_id, delta, score, angle, center, color, major, box, matches_avoided=0):
+    """
+    Turns the best ellipse in a delta image into a tag.  The ellipse only gives the
+    fish's axis, so the tail end is whichever end of that axis looks more like the
+    fish's color.
+    """
+    mask = np.ones((15, 15), dtype=np.uint8) * color
+
+    tail_search_radius = 0.75 * major
+
+    tail_center = tuple(map(int,
+                            (center[0] - tail_search_radius * math.cos(math.radians(angle)),
+                             center[1] - tail_search_radius * math.sin(math.radians(angle)))))
+    tail_candidate = delta[tail_center[1] - 7:tail_center[1] + 8,
+                           tail_center[0] - 7:tail_center[0] + 8]
+
+    angle2 = (angle + 180) % 360
+    tail_center2 = tuple(map(int,
+                             (center[0] - tail_search_radius * math.cos(math.radians(angle2)),
+                              center[1] - tail_search_radius * math.sin(math.radians(angle2)))))
+    tail_candidate2 = delta[tail_center2[1] - 7:tail_center2[1] + 8,
+                            tail_center2[0] - 7:tail_center2[0] + 8]
+
+    diff = np.sum(cv2.absdiff(mask, tail_candidate) ** 2)
+    diff2 = np.sum(cv2.absdiff(mask, tail_candidate2) ** 2)
+
+    if diff2 < diff:
+        angle = angle2
+
+    length = major / 2
+
+    sin_a = math.sin(math.radians(angle))
+    cos_a = math.cos(math.radians(angle))
+
+    start = tuple(map(int, (center[0] - length * 0.25 * cos_a,
+                            center[1] - length * 0.25 * sin_a)))
+    end = tuple(map(int, (center[0] - length * cos_a,
+                          center[1] - length * sin_a)))
+
+    return {
+        'image_id': image_id,
+        'start': start,
+        'end': end,
+        'score': score,
+        'foreground_box': box,
+        'matches_avoided': matches_avoided,
+    }
+
+
+def ellipse_tags(image_ids, deltas, envelope, config=None):
+    """Searches a stack of delta images from the same CJR and returns a tag for each."""
+    result = find_best_ellipses(deltas, envelope, config=config)
+
+    return [
+        ellipse_tag(image_id, delta,
+                    float(result['score'][i]), int(result['angle'][i]),
+                    tuple(int(c) for c in result['center'][i]),
+                    int(result['color'][i]), int(result['major'][i]),
+                    tuple(int(c) for c in result['box'][i]),
+                    int(result['matches_avoided'][i]))
+        for i, (image_id, delta) in enumerate(zip(image_ids, deltas))
+    ]
+
+
+def stacks(jobs, frames_per_stack=None):
+    """
+    Groups (image_id, data, cal, envelope) jobs into (cal, envelope, image_ids, data)
+    stacks of images that share a cal image and an envelope, so that each stack can be
+    searched with one call to ellipse_tags.  With frames_per_stack set, stacks are split
+    so that none holds more images than that.
+    """
+    grouped = collections.OrderedDict()
+    for (image_id, data, cal, envelope) in jobs:
+        stack = grouped.setdefault((cal, envelope_key(envelope)),
+                                   (cal, envelope, list(), list()))
+        stack[2].append(image_id)
+        stack[3].append(data)
+
+    if frames_per_stack is None:
+        return grouped.values()
+
+    return [(cal, envelope, image_ids[start:start + frames_per_stack],
+             data[start:start + frames_per_stack])
+            for (cal, envelope, image_ids, data) in grouped.values()
+            for start in range(0, len(image_ids), frames_per_stack)]
+
+
+def envelope_sizes(width):
+    """The ellipse heights tried for an ellipse of the given width."""
+    return range(int(width/2.3), int(width/1.5))
+
+
+def envelope_mask(width, height):
+    """A filled width x height ellipse of ones, drawn once per size and kept."""
+    try:
+        return _envelope_masks[(width, height)]
+    except KeyError:
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.ellipse(img=mask, box=((width // 2, height // 2), (width, height), 0),
+                    color=1, thickness=-1)
+        _envelope_masks[(width, height)] = mask
+        return mask
+
+
+def find_ellipse_envelope(delta, start, degrees, radius_of_roi, early_stop=None,
+                          score_surface=False):
+    """
+    Measures the fish in a manually tagged delta image for its CJR's search envelope.
+    start is the tagged (x, y) start point and degrees the angle that turns the tag
+    horizontal.  Returns the (width, height) of the best fitting ellipse, the fish's color
+    and the (top, left, bottom, right) region of the rotated ROI that was searched.
+
+    Of the ENVELOPE_GOOD_FITS best fitting sizes, the largest wins.  Widths are tried
+    from small to large, and with early_stop set the search ends once the best fit for
+    each of ENVELOPE_EARLY_STOP_PATIENCE widths in a row was worse than every one of the
+    good fits so far.  That can drop larger widths that would still have made the good
+    fits, so an early stopped search may pick a different envelope than the full one.
+    early_stop defaults to ENVELOPE_EARLY_STOP in fishface_config.
+
+    With score_surface set, a fourth value is returned: the score of every size tried as
+    a float16 array indexed by [width - ENVELOPE_MAJOR_MIN, height - ENVELOPE_MINOR_MIN],
+    with NaN for the sizes that weren't tried.
+    """
+    if early_stop is None:
+        early_stop = ff_conf.ENVELOPE_EARLY_STOP
+
+    start = np.array(start)
+
+    adjust = np.array([int(radius_of_roi), int(radius_of_roi/2)], dtype=np.int32)
+
+    retval, roi_corner, roi_far_corner = cv2.clipLine(
+        (0, 0, delta.shape[1], delta.shape[0]),
+        tuple(start - adjust),
+        tuple(start + adjust),
+    )
+
+    # shift the rotation so that only the ROI gets warped instead of the whole frame
+    rotate_matrix = cv2.getRotationMatrix2D(tuple(start), degrees, 1)
+    rotate_matrix[:, 2] -= roi_corner
+    roi = cv2.warpAffine(delta, rotate_matrix, (roi_far_corner[0] - roi_corner[0],
+                                                roi_far_corner[1] - roi_corner[1]))
+
+    roi_corner = np.array(roi_corner)
+    start = start - roi_corner
+
+    color = int(np.average(
+        roi[start[1] - 2:start[1] + 2, start[0] - 2:start[0] + 2].astype(np.float32)
+    ))
+
+    box = foreground_box(roi, ENVELOPE_MAJOR_MAX, seed=start)
+    roi = roi[box[0]:box[2], box[1]:box[3]]
+
+    if score_surface:
+        surface = np.empty((ENVELOPE_MAJOR_MAX - ENVELOPE_MAJOR_MIN,
+                            max(envelope_sizes(ENVELOPE_MAJOR_MAX - 1)) -
+                            ENVELOPE_MINOR_MIN + 1), dtype=np.float16)
+        surface.fill(np.nan)
+
+    scores = list()
+    worse_widths = 0
+    for x in range(ENVELOPE_MAJOR_MIN, ENVELOPE_MAJOR_MAX):
+        width_scores = list()
+        for y in envelope_sizes(x):
+            # a single channel scores the same as the three identical channels of the
+            # RGB copy this used to match against
+            template = envelope_mask(x, y) * np.uint8(color)
+            match = cv2.minMaxLoc(cv2.matchTemplate(roi, template, cv2.TM_SQDIFF_NORMED))
+            width_scores.append((match[0], (x, y), match[2]))
+
+            if score_surface:
+                surface[x - ENVELOPE_MAJOR_MIN, y - ENVELOPE_MINOR_MIN] = match[0]
+
+        good_scores = sorted(scores)[:ENVELOPE_GOOD_FITS]
+        if (len(good_scores) == ENVELOPE_GOOD_FITS and
+                min(width_scores)[0] > good_scores[-1][0]):
+            worse_widths += 1
+        else:
+            worse_widths = 0
+
+        scores.extend(width_scores)
+
+        if early_stop and worse_widths >= ENVELOPE_EARLY_STOP_PATIENCE:
+            break
+
+    good_scores = sorted(scores)[:ENVELOPE_GOOD_FITS]
+    best_score, ellipse_size, ellipse_corner = sorted(good_scores, key=lambda x: -x[1][0]*x[1][1])[0]
+
+    if score_surface:
+        return ellipse_size, color, box, surface
+
+    return ellipse_size, color, box
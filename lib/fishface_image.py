@@ -1,9 +1,13 @@
 import os
 import sys
+import hashlib
+import cPickle
+import collections
 
 import numpy as np
 import cv2
 import functools
+import redis
 
 import etc.fishface_config as ff_conf
 
@@ -85,20 +89,188 @@ def normalize_image_string(image_string):
     return normalize_array(image_string_to_array(image_string))
 
 
+def new_log():
+    """An empty image log: a ring of the last FFIMAGE_LOG_LENGTH lines, or a plain list
+    if that's None."""
+    if ff_conf.FFIMAGE_LOG_LENGTH is None:
+        return list()
+    return collections.deque(maxlen=ff_conf.FFIMAGE_LOG_LENGTH)
+
+
+def _keep(value):
+    return value
+
+
+def _unless_false(convert):
+    """Lets False through unconverted, since the annotations use it for 'not found'."""
+    def converter(value):
+        return value if value is False else convert(value)
+    return converter
+
+
+class ImageMeta(object):
+    """
+    The metadata of an FFImage.  The fields that capture and analysis fill in have fixed,
+    typed slots; anything else goes in the extra dict.  It reads and writes like the dict
+    it replaced, so meta['largest_contour'] and friends work unchanged, and as_dict()
+    turns it back into a plain dict for task results.
+    """
+
+    FIELDS = {
+        'image_id': _keep,
+        'source_filename': _keep,
+        'filename': _keep,
+        'timestamp': float,
+        'log': _keep,
+        'all_contours': _keep,
+        'largest_contour': _unless_false(lambda contour: np.asarray(contour, dtype=np.int32)),
+        'largest_contour_bounding_box': lambda box: tuple(int(x) for x in box),
+        'moments': _unless_false(dict),
+        'hu_moments': _unless_false(lambda hu: np.asarray(hu, dtype=np.float64)),
+    }
+
+    __slots__ = tuple(sorted(FIELDS)) + ('extra',)
+
+    def __init__(self, meta=None):
+        self.extra = dict()
+        if meta is not None:
+            self.update(meta)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, self.FIELDS[key](value))
+        else:
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return hasattr(self, key)
+        return key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in self.__slots__[:-1] if hasattr(self, key)] + self.extra.keys()
+
+    def iteritems(self):
+        for key in self.keys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def update(self, other):
+        for key, value in other.iteritems():
+            self[key] = value
+
+    def as_dict(self):
+        meta = dict(self.iteritems())
+        if 'log' in meta:
+            meta['log'] = list(meta['log'])
+        return meta
+
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self, state):
+        self.extra = dict()
+        self.update(state)
+
+    def __repr__(self):
+        return 'ImageMeta({!r})'.format(self.as_dict())
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Bytes used by obj and everything it holds through containers, slots, attributes and
+    array bases.  Objects are only counted once, however many times they're referred to.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, np.ndarray):
+        if obj.base is not None:
+            size += deep_sizeof(obj.base, seen)
+        elif size < obj.nbytes:
+            # older numpys leave the data buffer out of getsizeof
+            size += obj.nbytes
+    elif isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen)
+                    for key, value in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    else:
+        for name in getattr(obj.__class__, '__slots__', ()):
+            if hasattr(obj, name):
+                size += deep_sizeof(getattr(obj, name), seen)
+        if hasattr(obj, '__dict__'):
+            size += deep_sizeof(obj.__dict__, seen)
+
+    return size
+
+
 class FFImage(object):
+    """
+    Operations work on the ndarray directly.  The PNG encoding of the current array is
+    only made when something asks for png_string, e.g. write_file_to_dir or pickling, so
+    a chain of operations costs no encodes until its result is actually needed.  uint8
+    array sources are copied (after normalizing) rather than round tripped through a PNG.
+    With share_array set, an array that's already normalized is used as it is instead,
+    so the caller's array and the FFImage's change together; that's only for callers
+    that hand over an array they won't use again.
+
+    The log is a ring of FFIMAGE_LOG_LENGTH lines if that's set.
+    """
+
+    __slots__ = ('meta', 'source_image_string', '_png_string', '_png_dirty', '_array',
+                 '_array_clean')
+
     def __init__(self, source=None, source_filename=None, source_dir=None,
                  meta=None, log=None,
                  store_source_image_as=None,
-                 normalize_image=True):
+                 normalize_image=True,
+                 share_array=False):
         image_string = None
+        image_array = None
 
+        if not isinstance(meta, ImageMeta):
+            meta = ImageMeta(meta)
         self.meta = meta
 
-        if self.meta is None:
-            self.meta = dict()
-
         if log is None:
-            log = list()
+            log = new_log()
         self.meta['log'] = log
 
         if isinstance(source, basestring):
@@ -123,30 +295,41 @@ class FFImage(object):
                 raise InvalidSource('input_array must have shape {} and dtype {}.'.format(
                     ff_conf.NORMALIZED_SHAPE, ff_conf.NORMALIZED_DTYPE))
 
-            image_string = array_to_png_string(source)
+            if source.dtype == ff_conf.NORMALIZED_DTYPE:
+                # encode the array only if someone asks
+                image_array = normalize_array(source) if normalize_image else source
+                if image_array is source and not share_array:
+                    image_array = source.copy()
+            else:
+                image_string = array_to_png_string(source)
 
-        if image_string is None and source is not None:
+        if image_string is None and image_array is None and source is not None:
             raise Exception('None of the provided sources were usable.  Need a jpeg filename' +
                             'string, a raw jpeg as a string, or a numpy array image.')
 
-        if image_string is None:
-            image_string = array_to_png_string(np.zeros(ff_conf.NORMALIZED_SHAPE,
-                                                        dtype=ff_conf.NORMALIZED_DTYPE))
+        if image_string is None and image_array is None:
+            image_array = np.zeros(ff_conf.NORMALIZED_SHAPE, dtype=ff_conf.NORMALIZED_DTYPE)
 
-        if normalize_image and image_string is not None:
+        self._array = None
+        self._array_clean = True
+        self._png_string = None
+        self._png_dirty = False
+
+        if image_array is not None:
+            # array sources have no separate source string; the array is the source
+            self.source_image_string = None
+            self._array = image_array
+            self._png_dirty = True
+        elif normalize_image:
             image_array = normalize_image_string(image_string)
             if store_source_image_as is None or store_source_image_as is 'png':
                 self.source_image_string = array_to_png_string(image_array)
-                self.png_string = self.source_image_string
+                self._png_string = self.source_image_string
             else:
                 self.source_image_string = array_to_jpeg_string(image_array)
-                self.png_string = None
         else:
             self.source_image_string = image_string
 
-        self._array = None
-        self._array_clean = True
-
         if source_filename is None:
             self.meta['source_filename'] = 'IMAGE_NOT_FROM_A_FILE.jpg'
 
@@ -175,11 +358,24 @@ class FFImage(object):
         with open(full_path, 'wb') as write_file:
             write_file.write(image_string)
 
+    @property
+    def png_string(self):
+        if self._png_dirty:
+            self._png_string = array_to_png_string(self._array)
+            self._png_dirty = False
+
+        return self._png_string
+
+    @png_string.setter
+    def png_string(self, png_string):
+        self._png_string = png_string
+        self._png_dirty = False
+
     @property
     def array(self):
         if self._array is None:
-            if self.png_string is not None:
-                self._array = image_string_to_array(self.png_string)
+            if self._png_string is not None:
+                self._array = image_string_to_array(self._png_string)
             else:
                 self._array = image_string_to_array(self.source_image_string)
 
@@ -187,14 +383,47 @@ class FFImage(object):
 
     @array.setter
     def array(self, arr):
-        self.png_string = array_to_png_string(arr)
+        self._png_dirty = True
         if self._array_clean:
             self._array_clean = False
             if self.filename.endswith('jpg'):
                 self.meta['filename'] = self.filename[:-3] + 'png'
         self._array = arr
 
+    def __getstate__(self):
+        """
+        Only one encoded form of the image is pickled: the source string while the array
+        is unchanged from it, or else a PNG of the current array.  The decoded array is
+        never pickled.
+        """
+        png_string = self.png_string
+        source_image_string = self.source_image_string if self._array_clean else None
+
+        # when the png is the source string, pickle stores the one string once
+        return {
+            'meta': self.meta,
+            'array_clean': self._array_clean,
+            'source_image_string': source_image_string,
+            'png_string': png_string,
+        }
+
+    def __setstate__(self, state):
+        self.meta = state['meta']
+        self.source_image_string = state['source_image_string']
+        self._png_string = state['png_string']
+        self._png_dirty = False
+        self._array = None
+        self._array_clean = state['array_clean']
+
+    @property
+    def content_hash(self):
+        """SHA-1 of the encoded image that would be pickled."""
+        state = self.__getstate__()
+        return hashlib.sha1(state['source_image_string'] or state['png_string']).hexdigest()
+
     def sanitize(self):
+        # don't throw away the only copy of the current image
+        self.png_string
         self._array = None
         del self.meta['all_contours']
 
@@ -206,17 +435,20 @@ class FFImage(object):
             return self.meta['source_filename']
 
     @property
-    def approximate_memory_usage(self):
+    def memory_usage(self):
         """
-        Quick and super extra really dirty.
+        Bytes held by this image as (total, breakdown), with deep_sizeof of each part.
+        Anything shared between parts, like a png_string that is the source string, is
+        counted in the first part that holds it.
         """
+        seen = set()
         total = dict()
-        if self._array is not None:
-            total['array'] = self._array.nbytes
-        total['jpeg_string'] = sys.getsizeof(self.source_image_string)
-        total['png_string'] = sys.getsizeof(self.png_string)
-        total['meta'] = sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.meta.iteritems())
-        total['log'] = sum(sys.getsizeof(v) for v in self.meta['log'])
+        total['object'] = sys.getsizeof(self)
+        total['array'] = deep_sizeof(self._array, seen)
+        total['source_image_string'] = deep_sizeof(self.source_image_string, seen)
+        total['png_string'] = deep_sizeof(self._png_string, seen)
+        total['log'] = deep_sizeof(self.meta.get('log'), seen)
+        total['meta'] = deep_sizeof(self.meta, seen)
 
         return sum(total.itervalues()), total
 
@@ -238,5 +470,67 @@ class FFImage(object):
         return '\n'.join(return_value)
 
 
+_referenced_images = collections.OrderedDict()
+_redis_client = None
+
+
+def _redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis(host=ff_conf.REDIS_HOSTNAME, password=ff_conf.REDIS_PASSWORD)
+    return _redis_client
+
+
+class ImageReference(object):
+    """
+    Stands in for an FFImage in task arguments that would otherwise carry the same image
+    over and over, like the cal image that goes with every image of a CJR.
+
+    Creating a reference puts the pickled image in redis, keyed by its content hash, for
+    IMAGE_REFERENCE_TTL seconds.  resolve() looks for the image in this process's cache,
+    then in redis, and last of all, if a source_path on the django host was given, loads
+    the file with lib.media_cache.load_image, which works on workers without the media
+    mounted.
+    """
+
+    def __init__(self, ff_image, source_path=None):
+        self.content_hash = ff_image.content_hash
+        self.source_path = source_path
+
+        _redis().setex(self.redis_key, cPickle.dumps(ff_image, cPickle.HIGHEST_PROTOCOL),
+                       ff_conf.IMAGE_REFERENCE_TTL)
+        _cache_referenced_image(self.content_hash, ff_image)
+
+    @property
+    def redis_key(self):
+        return 'ff_cache_image_{}'.format(self.content_hash)
+
+    def resolve(self):
+        """The referenced FFImage.  It's shared by everything in this process that
+        resolves the same reference, so don't modify it."""
+        ff_image = _referenced_images.pop(self.content_hash, None)
+
+        if ff_image is None:
+            pickled_image = _redis().get(self.redis_key)
+            if pickled_image is not None:
+                ff_image = cPickle.loads(pickled_image)
+            elif self.source_path is not None:
+                # imported here because lib.media_cache builds FFImages itself
+                import lib.media_cache as lmc
+                ff_image = lmc.load_image(self.source_path)
+            else:
+                raise InvalidSource('Referenced image {} is no longer available.'.format(
+                    self.content_hash))
+
+        _cache_referenced_image(self.content_hash, ff_image)
+        return ff_image
+
+
+def _cache_referenced_image(content_hash, ff_image):
+    _referenced_images[content_hash] = ff_image
+    while len(_referenced_images) > ff_conf.IMAGE_REFERENCES_PER_PROCESS:
+        _referenced_images.popitem(last=False)
+
+
 class InvalidSource(Exception):
     pass
\ No newline at end of file
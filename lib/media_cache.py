@@ -0,0 +1,110 @@
+import os
+import tempfile
+import contextlib
+
+import cv2
+
+import lib.cluster_utilities as lcu
+from lib.fishface_image import FFImage, InvalidSource
+
+import etc.cluster_config as cl_conf
+from lib.fishface_logging import logger
+
+
+@contextlib.contextmanager
+def _sftp_session():
+    """An SFTP session to the django host."""
+    # imported here so that workers with the media mounted never need fabric
+    import fabric.network as fn
+    from fabric.state import env as fabric_env
+
+    fabric_env['key_filename'] = cl_conf.SCP_SECRET_KEYFILE
+    with contextlib.closing(fn.connect(cl_conf.SCP_USER, cl_conf.SCP_HOST,
+                                       cl_conf.SCP_PORT, None)) as ssh:
+        with contextlib.closing(ssh.open_sftp()) as sftp:
+            yield sftp
+
+
+def fetch_files(file_list):
+    """
+    Copies each file on the django host that isn't in the cluster cache directory yet
+    into it, and returns whether each fetch worked (files already here count as
+    fetched).  Each copy is written under a temporary name and renamed into place, so a
+    failed fetch never leaves a partial file to be read as a cached one.
+    """
+    fetch_successes = list()
+    fetch_file_list = list()
+
+    # determine what's already here
+    for remote_filename in file_list:
+        local_filename = lcu.remote_to_local_filename(remote_filename)
+        if os.path.isfile(local_filename):
+            fetch_successes.append(True)
+        else:
+            fetch_file_list.append((remote_filename, local_filename))
+
+    if fetch_file_list:
+        # fetch what isn't already here
+        with _sftp_session() as sftp:
+            for remote_filename, local_filename in fetch_file_list:
+                logger.info("Fetching file: {} to: {}".format(remote_filename, local_filename))
+                fetch_successes.append(_fetch_file(sftp, remote_filename, local_filename))
+
+    return fetch_successes
+
+
+def _fetch_file(sftp, remote_filename, local_filename):
+    local_dir = os.path.dirname(local_filename)
+    if not os.path.isdir(local_dir):
+        try:
+            os.makedirs(local_dir)
+        except OSError:
+            # somebody else got there first
+            pass
+
+    temp_filename = None
+    try:
+        with contextlib.closing(sftp.open(remote_filename)) as r_file:
+            with tempfile.NamedTemporaryFile(dir=local_dir, suffix='.tmp',
+                                             delete=False) as l_file:
+                temp_filename = l_file.name
+                l_file.write(r_file.read())
+        os.rename(temp_filename, local_filename)
+        return True
+    except (IOError, OSError):
+        logger.exception("Couldn't fetch file: {}".format(remote_filename))
+        if temp_filename is not None and os.path.isfile(temp_filename):
+            os.remove(temp_filename)
+        return False
+
+
+def local_media_path(path):
+    """
+    A readable local path for a media file on the django host.  If the media directory
+    is mounted here, that's just the path.  Otherwise it's a copy in the cluster cache
+    directory, which is fetched the first time it's needed and read from then on.
+    """
+    if os.path.isfile(path):
+        return path
+
+    local_path = lcu.remote_to_local_filename(path)
+    if not os.path.isfile(local_path) and not all(fetch_files([path])):
+        raise IOError("Couldn't fetch media file: {}".format(path))
+
+    return local_path
+
+
+def load_image(path, meta=None):
+    """
+    An FFImage of a media file on the django host, read through the local cache.  The
+    file is decoded straight into the image's array, which is never encoded again unless
+    somebody asks for it.
+    """
+    array = cv2.imread(local_media_path(path), 0)
+    if array is None:
+        raise InvalidSource("Couldn't decode media file: {}".format(path))
+
+    image = FFImage(array, share_array=True, meta=meta)
+    image.meta['source_filename'] = os.path.basename(path)
+    image.meta['filename'] = image.meta['source_filename']
+    return image
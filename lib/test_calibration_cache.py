@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import lib.calibration_cache as lcc
+
+
+class CacheKeyTests(unittest.TestCase):
+    def test_non_ascii_names_have_keys(self):
+        name = u'cal/épée-CAL.jpg'
+        key = lcc.cache_key(name, 1234.5)
+
+        self.assertEqual(len(key), 40)
+        self.assertEqual(lcc.cache_key(name.encode('utf-8'), 1234.5), key)
+        self.assertNotEqual(lcc.cache_key(name, 1234.75), key)
+        self.assertNotEqual(lcc.cache_key(u'cal/epee-CAL.jpg', 1234.5), key)
+
+    def test_unicode_and_byte_names_share_keys(self):
+        self.assertEqual(lcc.cache_key(u'cal/CAL.jpg', 10), lcc.cache_key('cal/CAL.jpg', 10.0))
@@ -0,0 +1,65 @@
+import os
+import unittest
+
+import numpy as np
+import cv2
+from scipy import stats
+
+import lib.cluster_utilities as lcu
+import lib.calibration_cache as lcc
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class BetterDeltaTests(unittest.TestCase):
+    def setUp(self):
+        self.data = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-DATA.jpg'), 0)
+        self.cal = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-CAL.jpg'), 0)
+
+    def test_matches_legacy_on_sample_images(self):
+        np.testing.assert_array_equal(lcu.better_delta(self.data, self.cal),
+                                      lcu.legacy_better_delta(self.data, self.cal))
+
+    def test_matches_legacy_on_every_pixel_pair(self):
+        data, cal = [grid.astype(np.uint8) for grid in np.mgrid[0:256, 0:256]]
+        np.testing.assert_array_equal(lcu.better_delta(data, cal),
+                                      lcu.legacy_better_delta(data, cal))
+
+    def test_stack_matches_single_frames(self):
+        stack = np.array([self.data, self.cal, 255 - self.data])
+        delta_stack = lcu.better_delta(stack, self.cal)
+
+        for frame, delta in zip(stack, delta_stack):
+            np.testing.assert_array_equal(delta, lcu.legacy_better_delta(frame, self.cal))
+
+    def test_reused_buffers(self):
+        stack = np.array([self.data, self.cal])
+        out = np.empty_like(stack)
+        work = lcu.delta_work_buffers(stack.shape)
+
+        for frames in (stack, 255 - stack):
+            self.assertIs(lcu.better_delta(frames, self.cal, out=out, work=work), out)
+            for frame, delta in zip(frames, out):
+                np.testing.assert_array_equal(delta, lcu.legacy_better_delta(frame, self.cal))
+
+    def test_precomputed_cal_arrays(self):
+        cal_frame = lcc.CalibrationFrame.from_array(self.cal)
+        np.testing.assert_array_equal(lcu.better_delta(self.data, *cal_frame.arrays),
+                                      lcu.legacy_better_delta(self.data, self.cal))
+
+
+class BrightnessOffsetTests(unittest.TestCase):
+    def setUp(self):
+        self.data = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-DATA.jpg'), 0)
+        self.cal = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-CAL.jpg'), 0)
+
+    def test_matches_mstats_mode_on_sample_images(self):
+        for data, cal in [(self.data, self.cal), (self.cal, self.data),
+                          (cv2.add(self.data, 20), self.cal)]:
+            mode = stats.mstats.mode(data.astype(np.int16) - cal.astype(np.int16), axis=None)
+            self.assertEqual(lcu.brightness_offset(data, cal), int(mode[0][0]))
+
+    def test_ties_go_to_the_smallest_difference(self):
+        data = np.array([[10, 10, 20, 20]], dtype=np.uint8)
+        cal = np.zeros_like(data)
+        self.assertEqual(lcu.brightness_offset(data, cal), 10)
@@ -0,0 +1,46 @@
+import os
+import json
+import unittest
+
+import numpy as np
+import cv2
+
+from lib.fishface_image import FFImage
+import lib.contour_codec as lco
+import lib.workers.drone_tasks as drone_tasks
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ContourCodecTests(unittest.TestCase):
+    def setUp(self):
+        # the silhouette that store_analyses would store for the sample frame
+        data = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-DATA.jpg'), 0)
+        cal = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-CAL.jpg'), 0)
+        meta = drone_tasks.get_fish_contour(FFImage(data), cal)
+        self.contour = np.asarray(meta['largest_contour'], dtype=np.int32)
+
+    def test_round_trip(self):
+        encoded = lco.encode_contour(self.contour, tolerance=0)
+        self.assertTrue(lco.is_encoded(encoded))
+        np.testing.assert_array_equal(lco.decode_contour(encoded), self.contour)
+
+    def test_encoding_is_smaller_than_the_list_it_replaces(self):
+        # four bytes a point is 16/3 characters of base64, against the dozen or so of
+        # each [[x, y]] entry.  On the sample silhouette that's 527 characters of JSON
+        # against 1313.
+        encoded = lco.encode_contour(self.contour, tolerance=0)
+        ratio = float(len(json.dumps(encoded))) / len(json.dumps(self.contour.tolist()))
+        self.assertLess(ratio, 0.42)
+
+    def test_simplification_stays_within_tolerance(self):
+        decoded = lco.decode_contour(lco.encode_contour(self.contour, tolerance=2.0))
+        self.assertLess(len(decoded), len(self.contour))
+        for point in self.contour[::10]:
+            distance = cv2.pointPolygonTest(decoded, tuple(float(x) for x in point[0]), True)
+            self.assertLessEqual(abs(distance), 2.0 + 1e-6)
+
+    def test_legacy_lists_and_missing_contours(self):
+        np.testing.assert_array_equal(lco.decode_contour(self.contour.tolist()), self.contour)
+        self.assertIs(lco.encode_contour(False), False)
+        self.assertIs(lco.decode_contour(False), False)
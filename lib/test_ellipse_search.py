@@ -0,0 +1,256 @@
+import os
+import unittest
+
+import numpy as np
+import cv2
+
+import lib.cluster_utilities as lcu
+import lib.ellipse_search as les
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENVELOPE = {
+    'major_min': 30, 'major_max': 50,
+    'ratio_min': 2.0, 'ratio_max': 3.0,
+    'color_min': 40, 'color_max': 80,
+}
+
+
+def sample_deltas(count):
+    """The sample delta image and copies of it with the fish moved a little."""
+    data = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-DATA.jpg'), 0)
+    cal = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-CAL.jpg'), 0)
+    delta = lcu.better_delta(data, cal)
+    return np.array([np.roll(np.roll(delta, 7 * i, axis=1), 3 * i, axis=0)
+                     for i in range(count)])
+
+
+def assert_same_ellipses(result, expected):
+    np.testing.assert_allclose(result['score'], expected['score'], atol=1e-6)
+    for key in ('angle', 'center', 'color', 'major', 'box'):
+        np.testing.assert_array_equal(result[key], expected[key], err_msg=key)
+
+
+class MatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.deltas = sample_deltas(2)
+        bank = les.template_bank(ENVELOPE)
+        self.templates = [bank.template(*params) for params in bank.coarse_params]
+
+    def test_fft_scores_match_cv2(self):
+        fft_maps = dict(les.FFTMatcher(self.deltas).scores(self.templates[::13]))
+        for index, template in enumerate(self.templates[::13]):
+            for delta, fft_map in zip(self.deltas, fft_maps[index]):
+                cv2_map = cv2.matchTemplate(delta, template, cv2.TM_SQDIFF_NORMED)
+                np.testing.assert_allclose(fft_map, cv2_map, atol=1e-5)
+
+    def test_fft_scores_match_cv2_for_templates_of_several_colors(self):
+        template = np.tile(np.arange(10, 60, 2, dtype=np.uint8), (20, 1))
+        fft_maps = dict(les.FFTMatcher(self.deltas).scores([template]))[0]
+        for delta, fft_map in zip(self.deltas, fft_maps):
+            cv2_map = cv2.matchTemplate(delta, template, cv2.TM_SQDIFF_NORMED)
+            np.testing.assert_allclose(fft_map, cv2_map, atol=1e-5)
+
+    def test_fft_best_matches_match_cv2(self):
+        cv2_scores, cv2_locations = les.CV2Matcher(self.deltas).best_match_arrays(
+            self.templates)
+        fft_scores, fft_locations = les.FFTMatcher(self.deltas).best_match_arrays(
+            self.templates)
+
+        np.testing.assert_allclose(fft_scores, cv2_scores, atol=1e-5)
+        np.testing.assert_array_equal(fft_locations, cv2_locations)
+
+    def test_lower_bounds_never_exceed_scores(self):
+        templates = self.templates[::3]
+        for matcher_class in (les.CV2Matcher, les.FFTMatcher):
+            bounds = matcher_class(self.deltas, prune=True).lower_bounds(templates)
+            scores = matcher_class(self.deltas).best_match_arrays(templates)[0]
+
+            self.assertTrue((bounds <= scores + 1e-6).all(), matcher_class.__name__)
+            # loose enough bounds would prune nothing
+            self.assertTrue((bounds > scores.min(axis=0)).any(), matcher_class.__name__)
+
+    def test_pruning_keeps_the_winners(self):
+        templates = self.templates[::3]
+        for matcher_class in (les.CV2Matcher, les.FFTMatcher):
+            scores, locations = matcher_class(self.deltas).best_match_arrays(templates)
+            matcher = matcher_class(self.deltas, prune=True)
+            pruned_scores, pruned_locations = matcher.best_match_arrays(templates)
+
+            winners = np.argmin(scores, axis=0)
+            np.testing.assert_array_equal(np.argmin(pruned_scores, axis=0), winners)
+            frames = np.arange(len(self.deltas))
+            np.testing.assert_array_equal(pruned_locations[winners, frames],
+                                          locations[winners, frames])
+
+            np.testing.assert_array_equal(matcher.matches_avoided,
+                                          np.isinf(pruned_scores).sum(axis=0))
+            self.assertTrue((matcher.matches_avoided > 0).all(), matcher_class.__name__)
+
+
+class SyntheticSearchTests(unittest.TestCase):
+    """Two frames holding one ellipse each, drawn from the template bank at 90 degrees
+    (where the template's corner plus its axes is exactly its center), next to a speck of
+    clutter."""
+
+    COLOR, ANGLE, RATIO, MAJOR = 60, 90, 2.5, 50
+    CORNERS = ((100, 40), (30, 90))
+    CENTERS = ((110, 65), (40, 115))
+
+    # the pyramid search refines at full resolution, but around a coarse winner found
+    # on images that were halved pyramid_levels times.  Halved twice, these ellipses are
+    # too small for the coarse sweep to tell their sizes apart.
+    PYRAMID_LEVELS = 1
+    PYRAMID_CENTER_TOLERANCE = 2 ** PYRAMID_LEVELS
+    PYRAMID_ANGLE_TOLERANCE = les.COARSE_ANGLES[1] - les.COARSE_ANGLES[0]
+
+    def setUp(self):
+        template = les.template_bank(ENVELOPE).template(
+            self.COLOR, self.ANGLE, self.RATIO, self.MAJOR)
+        height, width = template.shape
+
+        self.deltas = np.zeros((len(self.CORNERS), 160, 240), dtype=np.uint8)
+        for delta, (x, y) in zip(self.deltas, self.CORNERS):
+            delta[y:y + height, x:x + width] = template
+            delta[10:16, 200:206] = 50
+
+    def search(self, **kwargs):
+        return les.find_best_ellipses(self.deltas, ENVELOPE, les.SearchConfig(**kwargs))
+
+    def test_backends_find_the_drawn_ellipse(self):
+        for backend in ('cv2', 'fft'):
+            result = self.search(backend=backend, foreground_roi=False)
+
+            np.testing.assert_allclose(result['score'], 0, atol=1e-6)
+            np.testing.assert_array_equal(result['angle'], self.ANGLE)
+            np.testing.assert_array_equal(result['center'], self.CENTERS)
+            np.testing.assert_array_equal(result['color'], self.COLOR)
+            np.testing.assert_array_equal(result['major'], self.MAJOR)
+
+    def test_roi_search_matches_full_frame_search(self):
+        for backend in ('cv2', 'fft'):
+            full = self.search(backend=backend, foreground_roi=False)
+            roi = self.search(backend=backend, foreground_roi=True)
+
+            np.testing.assert_allclose(roi['score'], full['score'], atol=1e-6)
+            for key in ('angle', 'center', 'color', 'major'):
+                np.testing.assert_array_equal(roi[key], full[key], err_msg=key)
+            self.assertTrue((roi['box'][:, 2:] - roi['box'][:, :2] <
+                             full['box'][:, 2:] - full['box'][:, :2]).all())
+
+    def test_pruned_search_matches_unpruned_search(self):
+        for backend in ('cv2', 'fft', 'pyramid'):
+            full = self.search(backend=backend)
+            pruned = self.search(backend=backend, prune=True)
+
+            assert_same_ellipses(pruned, full)
+            np.testing.assert_array_equal(full['matches_avoided'], 0)
+            self.assertTrue((pruned['matches_avoided'] > 0).all(), backend)
+
+    def test_pyramid_search_lands_near_the_drawn_ellipse(self):
+        result = self.search(backend='pyramid', pyramid_levels=self.PYRAMID_LEVELS,
+                             foreground_roi=True)
+
+        self.assertLessEqual(np.abs(result['center'] - self.CENTERS).max(),
+                             self.PYRAMID_CENTER_TOLERANCE)
+        self.assertLessEqual(np.abs(result['angle'] - self.ANGLE).max(),
+                             self.PYRAMID_ANGLE_TOLERANCE)
+
+    def test_foreground_box(self):
+        x, y = self.CORNERS[0]
+        self.assertEqual(les.foreground_box(self.deltas[0], 0), (y, x, y + 51, x + 21))
+        self.assertEqual(les.foreground_box(self.deltas[0], 50), (0, 50, 141, 171))
+        self.assertEqual(les.foreground_box(self.deltas[0], 2, seed=(202, 12)),
+                         (8, 198, 18, 208))
+        self.assertEqual(les.foreground_box(np.zeros((20, 30), dtype=np.uint8), 5),
+                         (0, 0, 20, 30))
+
+    def test_ellipse_tags(self):
+        result = self.search(backend='cv2', foreground_roi=True)
+        tags = les.ellipse_tags(['first', 'second'], self.deltas, ENVELOPE,
+                                les.SearchConfig(backend='cv2', foreground_roi=True))
+
+        self.assertEqual([tag['image_id'] for tag in tags], ['first', 'second'])
+        for tag, (x, y), box in zip(tags, self.CENTERS, result['box']):
+            # a vertical fish, with its tail above or below the center
+            self.assertEqual((tag['start'][0], tag['end'][0]), (x, x))
+            self.assertAlmostEqual(abs(tag['start'][1] - y), self.MAJOR / 8.0, delta=1)
+            self.assertEqual(abs(tag['end'][1] - y), self.MAJOR / 2)
+            self.assertEqual(tag['foreground_box'], tuple(box))
+            self.assertAlmostEqual(tag['score'], 0, places=6)
+            self.assertEqual(tag['matches_avoided'], 0)
+
+
+class EnvelopeTests(unittest.TestCase):
+    """A filled ellipse of SIZE and COLOR, drawn from its envelope mask in an empty frame."""
+
+    SIZE, COLOR = (40, 20), 60
+    CENTER = (120, 80)
+
+    def setUp(self):
+        width, height = self.SIZE
+        self.delta = np.zeros((160, 240), dtype=np.uint8)
+        left, top = self.CENTER[0] - width // 2, self.CENTER[1] - height // 2
+        self.delta[top:top + height, left:left + width] = (
+            les.envelope_mask(width, height) * np.uint8(self.COLOR))
+
+    def find(self, **kwargs):
+        return les.find_ellipse_envelope(self.delta, self.CENTER, 0, 60, **kwargs)
+
+    def test_score_surface(self):
+        size, color, box, surface = self.find(score_surface=True)
+
+        self.assertEqual(color, self.COLOR)
+        self.assertEqual(surface.dtype, np.float16)
+        self.assertEqual(surface.shape, (
+            les.ENVELOPE_MAJOR_MAX - les.ENVELOPE_MAJOR_MIN,
+            max(les.envelope_sizes(les.ENVELOPE_MAJOR_MAX - 1)) - les.ENVELOPE_MINOR_MIN + 1))
+
+        for x in range(les.ENVELOPE_MAJOR_MIN, les.ENVELOPE_MAJOR_MAX):
+            tried = set(les.envelope_sizes(x))
+            for y in range(les.ENVELOPE_MINOR_MIN,
+                           les.ENVELOPE_MINOR_MIN + surface.shape[1]):
+                score = surface[x - les.ENVELOPE_MAJOR_MIN, y - les.ENVELOPE_MINOR_MIN]
+                self.assertEqual(np.isnan(score), y not in tried, msg=(x, y))
+
+        best = np.unravel_index(np.nanargmin(surface), surface.shape)
+        self.assertEqual(best, (self.SIZE[0] - les.ENVELOPE_MAJOR_MIN,
+                                self.SIZE[1] - les.ENVELOPE_MINOR_MIN))
+        self.assertEqual((size, color, box), self.find())
+
+    def test_early_stop_leaves_the_rest_of_the_surface_untried(self):
+        full = self.find(score_surface=True)[3]
+        stopped = self.find(early_stop=True, score_surface=True)[3]
+
+        tried = ~np.isnan(stopped)
+        np.testing.assert_array_equal(stopped[tried], full[tried])
+        self.assertLessEqual(tried.sum(), (~np.isnan(full)).sum())
+
+
+class StackingTests(unittest.TestCase):
+    def test_uniform_boxes(self):
+        boxes = les.uniform_boxes([(0, 0, 10, 20), (50, 60, 70, 70), (90, 95, 100, 100)],
+                                  (100, 100))
+        np.testing.assert_array_equal(boxes, [(0, 0, 20, 20),
+                                              (50, 60, 70, 80),
+                                              (80, 80, 100, 100)])
+
+    def test_stacks(self):
+        other_envelope = dict(ENVELOPE, major_max=60)
+        jobs = [(1, 'd1', 'cal_a', ENVELOPE),
+                (2, 'd2', 'cal_b', ENVELOPE),
+                (3, 'd3', 'cal_a', dict(ENVELOPE)),
+                (4, 'd4', 'cal_a', other_envelope),
+                (5, 'd5', 'cal_a', ENVELOPE)]
+
+        self.assertEqual(les.stacks(jobs), [
+            ('cal_a', ENVELOPE, [1, 3, 5], ['d1', 'd3', 'd5']),
+            ('cal_b', ENVELOPE, [2], ['d2']),
+            ('cal_a', other_envelope, [4], ['d4']),
+        ])
+        self.assertEqual(les.stacks(jobs, frames_per_stack=2), [
+            ('cal_a', ENVELOPE, [1, 3], ['d1', 'd3']),
+            ('cal_a', ENVELOPE, [5], ['d5']),
+            ('cal_b', ENVELOPE, [2], ['d2']),
+            ('cal_a', other_envelope, [4], ['d4']),
+        ])
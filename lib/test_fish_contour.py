@@ -0,0 +1,102 @@
+import os
+import unittest
+
+import numpy as np
+import cv2
+from scipy import ndimage
+
+from lib.fishface_image import FFImage
+import lib.workers.drone_tasks as drone_tasks
+
+import etc.fishface_config as ff_conf
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def operation_markers(data, cal):
+    """The markers image made the way get_fish_contour made it before
+    FishContourPipeline: one FFImage operation at a time."""
+    image = FFImage(data)
+    color_image = cv2.cvtColor(data, cv2.COLOR_GRAY2BGR)
+
+    drone_tasks.delta_image(image, cal)
+    drone_tasks.threshold_by_type(image)
+    drone_tasks.erode(image)
+    drone_tasks.distance_transform(image)
+    drone_tasks.threshold_by_type(image, otsu=False, thresh=5)
+
+    markers = image.array.copy()
+    drone_tasks.dilate(image, iterations=7)
+    border = image.array.copy()
+    border = border - cv2.erode(border, None)
+
+    markers, num_blobs = ndimage.measurements.label(markers)
+    markers[border == 255] = 255
+
+    markers = markers.astype(np.int32)
+    cv2.watershed(image=color_image, markers=markers)
+    markers[markers == -1] = 0
+    return 255 - markers.astype(np.uint8)
+
+
+def turned(data, cal, degrees):
+    """The sample fish turned about its middle, on the unchanged cal background."""
+    rotate_matrix = cv2.getRotationMatrix2D((170, 126), degrees, 1)
+    fish = cv2.warpAffine((data.astype(np.float32) - cal), rotate_matrix,
+                          tuple(reversed(data.shape)))
+    return np.clip(cal + fish, 0, 255).astype(np.uint8)
+
+
+class FishContourPathTests(unittest.TestCase):
+    def setUp(self):
+        self.cal = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-CAL.jpg'), 0)
+        self.sample = cv2.imread(os.path.join(SAMPLE_DIR, 'sample-DATA.jpg'), 0)
+
+        # one dark fish on the cal frame and nothing else, so the fast path takes it
+        self.data = self.cal.copy()
+        cv2.ellipse(self.data, (256, 192), (60, 20), 30, 0, 360, 0, -1)
+
+        self.fast_path = ff_conf.CONTOUR_FAST_PATH
+
+    def tearDown(self):
+        ff_conf.CONTOUR_FAST_PATH = self.fast_path
+
+    def contour(self, fast_path, data=None):
+        ff_conf.CONTOUR_FAST_PATH = fast_path
+        return drone_tasks.get_fish_contour(FFImage(self.data if data is None else data),
+                                            self.cal)
+
+    def test_watershed_path_matches_the_operations_on_sample_frames(self):
+        pipeline = drone_tasks.FishContourPipeline(self.sample.shape)
+        ff_conf.CONTOUR_FAST_PATH = False
+
+        for data in (self.sample, turned(self.sample, self.cal, 39)):
+            expected = operation_markers(data, self.cal)
+            np.testing.assert_array_equal(pipeline.run(data, self.cal, list()), expected)
+
+            expected_image = FFImage(expected)
+            drone_tasks.annotate_hu_moments(expected_image)
+            meta = self.contour(False, data=data)
+            self.assertEqual(meta['contour_path'], 'watershed')
+            np.testing.assert_array_equal(meta['largest_contour'],
+                                          expected_image.meta['largest_contour'])
+            self.assertEqual(meta['moments'], expected_image.meta['moments'])
+
+    def test_both_paths_find_the_isolated_fish(self):
+        fast = self.contour(True)
+        watershed = self.contour(False)
+
+        self.assertEqual(fast['contour_path'], 'components')
+        self.assertEqual(watershed['contour_path'], 'watershed')
+
+        # the fast path traces the thresholded blob, and the watershed the region it
+        # grows from the blob's core, which also takes in its outline
+        for meta in (fast, watershed):
+            moments = meta['moments']
+            self.assertAlmostEqual(moments['m00'], np.pi * 60 * 20, delta=400)
+            self.assertAlmostEqual(moments['m10'] / moments['m00'], 256, delta=1)
+            self.assertAlmostEqual(moments['m01'] / moments['m00'], 192, delta=1)
+
+            x, y, width, height = cv2.boundingRect(meta['largest_contour'])
+            self.assertLess(width, self.data.shape[1] / 2)
+            self.assertLess(height, self.data.shape[0] / 2)
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import os
+import cPickle
+import unittest
+
+import numpy as np
+import cv2
+
+import lib.fishface_image as lffi
+from lib.fishface_image import FFImage, ImageMeta, ImageReference, InvalidSource
+
+import etc.fishface_config as ff_conf
+
+
+class ArraySourceTests(unittest.TestCase):
+    def setUp(self):
+        self.source = np.empty(ff_conf.NORMALIZED_SHAPE, dtype=ff_conf.NORMALIZED_DTYPE)
+        self.source.fill(7)
+
+    def test_array_sources_are_copied(self):
+        image = FFImage(self.source)
+        image.array[...] = 0
+
+        self.assertTrue((self.source == 7).all())
+        self.assertTrue((image.array == 0).all())
+
+    def test_array_sources_can_be_shared(self):
+        image = FFImage(self.source, share_array=True)
+
+        self.assertIs(image.array, self.source)
+
+    def test_resized_array_sources_are_never_shared(self):
+        source = np.zeros((192, 256), dtype=ff_conf.NORMALIZED_DTYPE)
+        image = FFImage(source, share_array=True)
+
+        self.assertEqual(image.array.shape, ff_conf.NORMALIZED_SHAPE)
+        self.assertFalse(np.may_share_memory(image.array, source))
+
+
+class FilenameTests(unittest.TestCase):
+    def test_unicode_filenames_are_kept(self):
+        name = u'épée-CAL.jpg'
+        meta = ImageMeta({'source_filename': name, 'filename': name})
+        self.assertEqual(meta['source_filename'], name)
+        self.assertEqual(meta['filename'], name)
+
+        image = FFImage(np.zeros(ff_conf.NORMALIZED_SHAPE, dtype=ff_conf.NORMALIZED_DTYPE),
+                        meta={'filename': name})
+        self.assertEqual(image.filename, name)
+
+        image.array = image.array.copy()
+        self.assertEqual(image.filename, u'épée-CAL.png')
+
+
+def new_log_with(lines):
+    log = lffi.new_log()
+    log.extend(lines)
+    return log
+
+
+class ImageMetaTests(unittest.TestCase):
+    def test_meta_reads_and_writes_like_a_dict(self):
+        meta = ImageMeta({'image_id': 9, 'timestamp': '12.5', 'color': 'blue'})
+
+        self.assertEqual(meta['image_id'], 9)
+        self.assertEqual(meta['timestamp'], 12.5)
+        self.assertEqual(meta['color'], 'blue')
+        self.assertEqual(meta.extra, {'color': 'blue'})
+        self.assertIn('timestamp', meta)
+        self.assertNotIn('moments', meta)
+        self.assertEqual(meta.get('moments', 'none'), 'none')
+        self.assertRaises(KeyError, lambda: meta['moments'])
+        self.assertEqual(sorted(meta), ['color', 'image_id', 'timestamp'])
+        self.assertEqual(len(meta), 3)
+
+        meta['largest_contour'] = [[1, 2], [3, 4]]
+        self.assertEqual(meta['largest_contour'].dtype, np.int32)
+        meta['moments'] = False
+        self.assertIs(meta['moments'], False)
+
+        del meta['color']
+        del meta['largest_contour']
+        self.assertEqual(meta.as_dict(), {'image_id': 9, 'timestamp': 12.5,
+                                          'moments': False})
+        self.assertRaises(KeyError, meta.__delitem__, 'largest_contour')
+
+    def test_meta_pickles_as_its_dict(self):
+        meta = ImageMeta({'image_id': 9, 'log': new_log_with(['one']), 'color': 'blue'})
+
+        unpickled = round_trip(meta)
+        self.assertEqual(unpickled.as_dict(), {'image_id': 9, 'log': ['one'],
+                                               'color': 'blue'})
+
+
+class LogTests(unittest.TestCase):
+    def setUp(self):
+        self.saved_length = ff_conf.FFIMAGE_LOG_LENGTH
+
+    def tearDown(self):
+        ff_conf.FFIMAGE_LOG_LENGTH = self.saved_length
+
+    def test_log_ring_drops_its_oldest_lines(self):
+        ff_conf.FFIMAGE_LOG_LENGTH = 3
+        image = FFImage()
+        for line in range(5):
+            image.log = line
+
+        self.assertEqual(list(image.log), [2, 3, 4])
+        self.assertEqual(image.meta.as_dict()['log'], [2, 3, 4])
+
+    def test_log_is_unbounded_without_a_length(self):
+        ff_conf.FFIMAGE_LOG_LENGTH = None
+        image = FFImage()
+        for line in range(5):
+            image.log = line
+
+        self.assertEqual(image.log, range(5))
+
+
+class MemoryUsageTests(unittest.TestCase):
+    def setUp(self):
+        self.source = np.zeros(ff_conf.NORMALIZED_SHAPE, dtype=ff_conf.NORMALIZED_DTYPE)
+
+    def test_memory_usage_counts_the_array_and_the_encoded_image(self):
+        image = FFImage(self.source)
+        png_string = image.png_string
+
+        total, breakdown = image.memory_usage
+
+        self.assertEqual(total, sum(breakdown.itervalues()))
+        self.assertGreaterEqual(breakdown['array'], self.source.nbytes)
+        self.assertGreaterEqual(breakdown['png_string'], len(png_string))
+        self.assertGreaterEqual(total, self.source.nbytes + len(png_string))
+
+    def test_shared_encoded_image_is_counted_once(self):
+        image = FFImage(lffi.array_to_png_string(self.source))
+        self.assertIs(image.png_string, image.source_image_string)
+
+        total, breakdown = image.memory_usage
+
+        self.assertGreaterEqual(breakdown['source_image_string'],
+                                len(image.source_image_string))
+        self.assertEqual(breakdown['png_string'], 0)
+        self.assertLess(breakdown['array'], self.source.nbytes)
+
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def round_trip(image):
+    return cPickle.loads(cPickle.dumps(image, cPickle.HIGHEST_PROTOCOL))
+
+
+class PickleTests(unittest.TestCase):
+    def setUp(self):
+        self.source = np.zeros(ff_conf.NORMALIZED_SHAPE, dtype=ff_conf.NORMALIZED_DTYPE)
+        self.source[100:150, 200:300] = 60
+
+    def assert_same_image(self, unpickled, image):
+        self.assertTrue((unpickled.array == image.array).all())
+        self.assertEqual(unpickled.filename, image.filename)
+        self.assertEqual(unpickled.meta['image_id'], image.meta['image_id'])
+        self.assertEqual(unpickled.content_hash, image.content_hash)
+
+    def test_image_without_a_png_is_encoded_once_and_round_trips(self):
+        image = FFImage(self.source, meta={'image_id': 3})
+        self.assertIsNone(image._png_string)
+
+        unpickled = round_trip(image)
+
+        self.assertIsNone(unpickled._array)
+        self.assertIsNone(unpickled.source_image_string)
+        self.assert_same_image(unpickled, image)
+
+    def test_image_with_a_png_round_trips(self):
+        png_string = lffi.array_to_png_string(self.source)
+        image = FFImage(png_string, meta={'image_id': 4})
+        self.assertIs(image.png_string, image.source_image_string)
+
+        unpickled = round_trip(image)
+
+        self.assertEqual(unpickled.source_image_string, image.source_image_string)
+        self.assert_same_image(unpickled, image)
+
+    def test_changed_image_round_trips_as_its_current_array(self):
+        image = FFImage(lffi.array_to_png_string(self.source), meta={'image_id': 5})
+        image.array = 255 - image.array
+
+        unpickled = round_trip(image)
+
+        self.assertIsNone(unpickled.source_image_string)
+        self.assert_same_image(unpickled, image)
+        self.assertTrue((unpickled.array == 255 - self.source).all())
+
+
+class StubRedis(object):
+    def __init__(self):
+        self.values = dict()
+
+    def setex(self, key, value, ttl):
+        self.values[key] = value
+
+    def get(self, key):
+        return self.values.get(key)
+
+
+class ImageReferenceTests(unittest.TestCase):
+    def setUp(self):
+        self.saved_client = lffi._redis_client
+        self.redis = lffi._redis_client = StubRedis()
+        lffi._referenced_images.clear()
+
+        self.path = os.path.join(SAMPLE_DIR, 'sample-CAL.jpg')
+        self.image = FFImage(cv2.imread(self.path, 0), normalize_image=False)
+
+    def tearDown(self):
+        lffi._redis_client = self.saved_client
+        lffi._referenced_images.clear()
+
+    def test_reference_resolves_from_this_process(self):
+        reference = ImageReference(self.image)
+
+        self.assertIs(round_trip(reference).resolve(), self.image)
+
+    def test_reference_resolves_from_redis(self):
+        reference = round_trip(ImageReference(self.image))
+        lffi._referenced_images.clear()
+
+        resolved = reference.resolve()
+        self.assertTrue((resolved.array == self.image.array).all())
+        self.assertIs(reference.resolve(), resolved)
+
+    def test_reference_falls_back_to_its_source_path(self):
+        reference = round_trip(ImageReference(self.image, source_path=self.path))
+        lffi._referenced_images.clear()
+        self.redis.values.clear()
+
+        resolved = reference.resolve()
+        self.assertTrue((resolved.array == self.image.array).all())
+        self.assertEqual(resolved.filename, 'sample-CAL.jpg')
+
+    def test_reference_without_a_source_path_can_expire(self):
+        reference = ImageReference(self.image)
+        lffi._referenced_images.clear()
+        self.redis.values.clear()
+
+        self.assertRaises(InvalidSource, reference.resolve)
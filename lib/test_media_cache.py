@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import contextlib
+import unittest
+
+import cv2
+
+import lib.media_cache as lmc
+import etc.cluster_config as cl_conf
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class LoadImageTests(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(SAMPLE_DIR, 'sample-DATA.jpg')
+
+    def test_image_is_decoded_once(self):
+        image = lmc.load_image(self.path, meta={'image_id': 7})
+
+        self.assertTrue((image.array == cv2.imread(self.path, 0)).all())
+        self.assertIsNone(image.source_image_string)
+        self.assertIsNone(image._png_string)
+
+        self.assertEqual(image.meta['image_id'], 7)
+        self.assertEqual(image.meta['source_filename'], 'sample-DATA.jpg')
+        self.assertEqual(image.filename, 'sample-DATA.jpg')
+
+
+class StubSftp(object):
+    """Serves the sample images in place of the django host's media directory."""
+
+    def __init__(self):
+        self.fetched = list()
+
+    def open(self, remote_filename):
+        self.fetched.append(remote_filename)
+        return open(os.path.join(SAMPLE_DIR, os.path.basename(remote_filename)), 'rb')
+
+
+class RemoteMediaTests(unittest.TestCase):
+    """A worker without the media mounted fetches each file once and then reads its copy."""
+
+    REMOTE_PATH = '/not/mounted/here/media/experiment_imagery/stills/sample-DATA.jpg'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved_cache_dir = cl_conf.LOCAL_CACHE_DIR
+        cl_conf.LOCAL_CACHE_DIR = self.cache_dir
+
+        self.sftp = StubSftp()
+        self.sessions = 0
+        self.saved_session = lmc._sftp_session
+        lmc._sftp_session = self.sftp_session
+
+    def tearDown(self):
+        lmc._sftp_session = self.saved_session
+        cl_conf.LOCAL_CACHE_DIR = self.saved_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    @contextlib.contextmanager
+    def sftp_session(self):
+        self.sessions += 1
+        yield self.sftp
+
+    def test_missing_file_is_fetched_once_and_loaded(self):
+        local_path = os.path.join(self.cache_dir,
+                                  'media/experiment_imagery/stills/sample-DATA.jpg')
+
+        image = lmc.load_image(self.REMOTE_PATH)
+        self.assertEqual(self.sftp.fetched, [self.REMOTE_PATH])
+        self.assertTrue(os.path.isfile(local_path))
+        self.assertEqual(os.listdir(os.path.dirname(local_path)), ['sample-DATA.jpg'])
+        self.assertTrue((image.array ==
+                         cv2.imread(os.path.join(SAMPLE_DIR, 'sample-DATA.jpg'), 0)).all())
+
+        self.assertEqual(lmc.local_media_path(self.REMOTE_PATH), local_path)
+        self.assertEqual(lmc.fetch_files([self.REMOTE_PATH]), [True])
+        self.assertEqual(self.sessions, 1)
+
+    def test_failed_fetch_leaves_nothing_behind(self):
+        missing_path = self.REMOTE_PATH.replace('sample-DATA', 'not-a-sample')
+
+        self.assertEqual(lmc.fetch_files([self.REMOTE_PATH, missing_path]), [True, False])
+        self.assertRaises(IOError, lmc.local_media_path, missing_path)
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir,
+                                                 'media/experiment_imagery/stills')),
+                         ['sample-DATA.jpg'])
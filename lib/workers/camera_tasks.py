@@ -111,6 +111,8 @@ class CaptureThread(thread_with_heartbeat.ThreadWithHeartbeat):
             meta['requested_timestamp'] = self._next_capture_time
             meta['delta'] = timestamp - self._next_capture_time
 
+            # the task's result usually has no image ID, since the image row waits in
+            # the results worker's write-behind buffer; its 'path' finds the image later
             r = celery_app.send_task('results.post_image',
                                      kwargs={'image_data': image, 'meta': meta})
 
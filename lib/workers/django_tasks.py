@@ -5,7 +5,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lib.django.django_fishface.sett
 import lib.django.djff.models as dm
 import django.db.models as ddm
 
-from lib.fishface_image import FFImage
+from lib.fishface_image import FFImage, ImageReference
+import lib.ellipse_search as les
 
 import celery
 from lib.django_celery import celery_app
@@ -41,8 +42,11 @@ def analyze_images_from_cjr(cjr_id):
     results = list()
 
     cjr = dm.CaptureJobRecord.objects.get(pk=cjr_id)
-    cal_image = FFImage(source_filename=cjr.cal_image.image_file.path,
-                        store_source_image_as='jpg')
+    # every message in the run names the cal image instead of carrying it.  The file's
+    # bytes go into the reference as they are; drones decode them.
+    cal_path = cjr.cal_image.image_file.path
+    cal_image = ImageReference(FFImage(source_filename=cal_path, normalize_image=False),
+                               source_path=cal_path)
     cjr_data = dm.Image.objects.filter(cjr_id=cjr.id)
 
     for chunk in chunkify(cjr_data, chunk_length=ff_conf.ML_STAGE_1_IMAGES_PER_CHUNK):
@@ -56,14 +60,12 @@ def analyze_images_from_cjr(cjr_id):
 
 @celery.shared_task(name='django.analyze_image_list')
 def analyze_image_list(data_list, cal_image):
-    return [
-        celery.chain(
-            celery_app.signature('drone.get_fish_contour', args=(FFImage(
-                source_filename=filename, meta=meta), cal_image)),
-            celery_app.signature('results.store_analyses')
-        ).apply_async()
-        for filename, meta in data_list
-    ]
+    # drones load the images themselves, so the message only carries paths and metadata,
+    # and the whole chunk is analyzed and stored by one task each
+    return celery.chain(
+        celery_app.signature('drone.get_fish_contours_batch', args=(data_list, cal_image)),
+        celery_app.signature('results.store_analyses')
+    ).apply_async()
 
 
 @celery.shared_task(name='django.training_eligible_data')
@@ -82,10 +84,8 @@ def training_eligible_data(
         return False
 
     eligible_tags = list(
-        dm.ManualTag.objects.annotate(
-            verify_count=ddm.Count('manualverification'),
-        ).filter(
-            verify_count__gte=minimum_verifications,
+        dm.ManualTag.objects.filter(
+            verification_count__gte=minimum_verifications,
             image_id__in=analyzed_image_ids
         )
     )
@@ -158,12 +158,12 @@ def automatically_tag_by_ellipse_search(all_image_ids, per_chunk=16):
     for image_ids in chunkify(all_image_ids, per_chunk):
         taggables = list()
         cals = dict()
-        for image in list(dm.Image.objects.filter(id__in=image_ids)):
+        for image in list(dm.Image.objects.select_related('cjr').filter(id__in=image_ids)):
             data = image.jpeg
 
-            cal_name = image.cjr.cal_image.image_file.name
+            cal_name = image.cjr.cal_image.image_file.path
             if cal_name not in cals:
-                cals[cal_name] = image.cal_jpeg
+                cals[cal_name] = os.path.getmtime(cal_name)
 
             taggables.append((image.id, data, cal_name, image.search_envelope))
 
@@ -181,30 +181,35 @@ def update_ellipse_parameters_with_tag(tag_id, radius_of_roi=100):
     tag = dm.ManualTag.objects.get(pk=tag_id)
     with open(tag.image.image_file.name, 'rb') as data_file:
         data = data_file.read()
-    with open(tag.image.cjr.cal_image.image_file.name, 'rb') as cal_file:
-        cal = cal_file.read()
+    cal_path = tag.image.cjr.cal_image.image_file.path
+    cal = (cal_path, os.path.getmtime(cal_path))
 
     return (tag_id, data, cal, tag.int_start, tag.degrees, radius_of_roi)
 
 
 @celery.shared_task(name='django.slurm_update_ellipse_parameters_with_tags')
-def update_ellipse_parameters_with_tags(all_tag_ids, radius_of_roi=100, per_chunk=ff_conf.ENVELOPE_JOBS_PER_CHUNK):
+def update_ellipse_parameters_with_tags(all_tag_ids, radius_of_roi=100, per_chunk=ff_conf.ENVELOPE_JOBS_PER_CHUNK,
+                                        early_stop=ff_conf.ENVELOPE_EARLY_STOP):
+    """early_stop ends each envelope search early; see ENVELOPE_EARLY_STOP in
+    fishface_config for what that costs."""
     results = list()
 
     for tag_ids in chunkify(all_tag_ids, per_chunk):
 
         jobs = list()
         cachable_filenames = set()
+        tags = dm.ManualTag.objects.select_related('image__cjr').in_bulk(tag_ids)
 
         for tag_id in tag_ids:
-            tag = dm.ManualTag.objects.get(pk=tag_id)
+            tag = tags[tag_id]
             data_filename = tag.image.image_file.name
             cal_filename = tag.image.cjr.cal_image.image_file.name
 
             cachable_filenames.add(data_filename)
             cachable_filenames.add(cal_filename)
 
-            jobs.append((tag_id, data_filename, cal_filename, tag.int_start, tag.degrees, radius_of_roi))
+            jobs.append((tag_id, data_filename, cal_filename, tag.int_start, tag.degrees, radius_of_roi,
+                         early_stop))
 
         results.append(
             (
@@ -218,12 +223,22 @@ def update_ellipse_parameters_with_tags(all_tag_ids, radius_of_roi=100, per_chun
 
 
 @celery.shared_task(name='django.slurm_automatically_tag_by_ellipse_search')
-def automatically_tag_by_ellipse_search(all_image_ids, per_chunk=ff_conf.ELLIPSE_JOBS_PER_CHUNK):
+def automatically_tag_by_ellipse_search(all_image_ids, per_chunk=ff_conf.ELLIPSE_JOBS_PER_CHUNK,
+                                        search_config=None):
+    """
+    search_config is a lib.ellipse_search.SearchConfig, and defaults to the one in
+    fishface_config.  The pyramid backend runs the coarse part of the search at reduced
+    resolution, which is much cheaper and a little less accurate.
+    """
+    if search_config is None:
+        search_config = les.SearchConfig()
+    search_options = search_config.as_dict()
+
     results = list()
     for image_ids in chunkify(all_image_ids, per_chunk):
         taggables = list()
         cachable_filenames = set()
-        for image in list(dm.Image.objects.filter(id__in=image_ids)):
+        for image in list(dm.Image.objects.select_related('cjr').filter(id__in=image_ids)):
             data_filename = image.image_file.name
 
             cal_filename = image.cjr.cal_image.image_file.name
@@ -231,7 +246,8 @@ def automatically_tag_by_ellipse_search(all_image_ids, per_chunk=ff_conf.ELLIPSE
             cachable_filenames.add(data_filename)
             cachable_filenames.add(cal_filename)
 
-            taggables.append((image.id, data_filename, cal_filename, image.search_envelope))
+            taggables.append((image.id, data_filename, cal_filename, image.search_envelope,
+                              search_options))
 
         results.append(
             (
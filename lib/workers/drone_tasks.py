@@ -1,16 +1,20 @@
 import time
-import math
 
 import numpy as np
 
 from scipy import ndimage
-from scipy import stats
 
 import cv2
 
 import celery
 from lib.misc_utilities import image_string_to_array
-from lib.fishface_image import FFImage, ff_operation, ff_annotation
+from lib.fishface_image import FFImage, ImageReference, ff_operation, ff_annotation
+import lib.ellipse_search as les
+import lib.calibration_cache as lcc
+import lib.cluster_utilities as lcu
+import lib.media_cache as lmc
+
+import etc.fishface_config as ff_conf
 
 #
 # Convenience functions
@@ -38,7 +42,7 @@ def debug_task(self, *args, **kwargs):
 
 
 def image_from_file(file_path):
-    return FFImage(cv2.imread(file_path, 0))
+    return FFImage(cv2.imread(file_path, 0), share_array=True)
 
 
 #
@@ -52,9 +56,9 @@ def delta_image(image, cal_image, ff_image=None):
         cal_image = cal_image.array
 
     # adjustment for overall brightness delta
-    delta_mode = stats.mstats.mode(image.astype(np.int16) - cal_image.astype(np.int16),
-                                   axis=None)
-    almost_there = cv2.absdiff(cal_image, image).astype(np.int16) + delta_mode[0][0]
+    almost_there = (cv2.absdiff(cal_image, image).astype(np.int16) +
+                    lcu.brightness_offset(image, cal_image,
+                                          stride=ff_conf.BRIGHTNESS_OFFSET_STRIDE))
     almost_there[almost_there < 0] = 0
     return almost_there.astype(np.uint8)
 
@@ -232,30 +236,162 @@ def draw_contours(image, contours, line_color=255, line_thickness=3, filled=True
     return image
 
 
-def better_delta(data, cal):
-    cal_over_data = (256*data / (cal.astype(np.uint16) + 1)).clip(0,255)
-    grain_extract_cal_data = (data - cal + 128).clip(0,255)
-    dodge_cod_ge = 255 - (cv2.divide((256 * grain_extract_cal_data),
-                                     cv2.subtract(255, cal_over_data) + 1)).clip(0,255)
-
-    return dodge_cod_ge.astype(np.uint8)
-
-
-def min_avg_max(min_val, max_val, ints=True):
-    result = [
-        min_val,
-        (float(min_val) + max_val) / 2,
-        max_val,
-        ]
-
-    if ints:
-        result = map(int, result)
-
-    return result
+#
+# Pipelines
+#
 
 
-def mam_envelope(envelope, name, ints=True):
-    return min_avg_max(envelope[name + '_min'], envelope[name + '_max'], ints=ints)
+class FishContourPipeline(object):
+    """
+    The chain of operations in get_fish_contour, run on working buffers that are
+    allocated once per frame shape and reused for every frame, in place wherever OpenCV
+    allows.  It makes the same markers image and log lines as running the individual
+    operations on an FFImage.
+
+    When CONTOUR_FAST_PATH is set and the thresholded frame already holds one dominant
+    blob, the watershed stages are skipped and the thresholded frame is the markers
+    image.  path says which way the last frame went: 'components' or 'watershed'.
+
+    timings holds the seconds each stage took on the last frame, and total_timings the
+    totals over all frames run so far.
+    """
+
+    STAGES = ('delta', 'threshold', 'components', 'erode', 'distance_transform',
+              'distance_threshold', 'dilate', 'label', 'watershed')
+
+    # 8-connected, like the contours that get traced from the result
+    CONNECTIVITY = np.ones((3, 3), dtype=np.int32)
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.kernel = kernel()
+
+        self._color = np.empty(shape + (3,), dtype=np.uint8)
+        self._diff = np.empty(shape, dtype=np.int16)
+        self._gray = np.empty(shape, dtype=np.uint8)
+        self._gray2 = np.empty(shape, dtype=np.uint8)
+        self._distance = np.empty(shape, dtype=np.float32)
+        self._seeds = np.empty(shape, dtype=np.float32)
+        self._dilated = np.empty(shape, dtype=np.float32)
+        self._border = np.empty(shape, dtype=np.float32)
+        self._labels = np.empty(shape, dtype=np.int32)
+        self._mask = np.empty(shape, dtype=np.bool_)
+
+        self.timings = dict()
+        self.total_timings = dict((stage, 0.0) for stage in self.STAGES)
+        self.frames = 0
+        self.path = None
+
+    def _timed(self, stage, started):
+        now = time.time()
+        self.timings[stage] = now - started
+        self.total_timings[stage] += now - started
+        return now
+
+    def run(self, data, cal, log):
+        """
+        Returns the markers image for a data frame and its cal frame, appending to log
+        as the operations would.  The result is one of the pipeline's buffers, so it's
+        only good until the next run.
+        """
+        self.timings = dict()
+        self.frames += 1
+
+        started = time.time()
+        cv2.cvtColor(data, cv2.COLOR_GRAY2BGR, dst=self._color)
+
+        # delta_image
+        log.append('OP: delta_image')
+        offset = lcu.brightness_offset(data, cal, stride=ff_conf.BRIGHTNESS_OFFSET_STRIDE,
+                                       diff=self._diff)
+        cv2.absdiff(cal, data, dst=self._gray)
+        np.add(self._gray, offset, out=self._diff, dtype=np.int16)
+        np.maximum(self._diff, 0, out=self._diff)
+        self._gray[...] = self._diff
+        started = self._timed('delta', started)
+
+        # threshold_by_type
+        log.append('OP: threshold_by_type')
+        thresh, _ = cv2.threshold(self._gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU,
+                                  dst=self._gray)
+        log.append('thresh:{}'.format(thresh))
+        started = self._timed('threshold', started)
+
+        if ff_conf.CONTOUR_FAST_PATH:
+            isolated = self._fish_is_isolated()
+            started = self._timed('components', started)
+            if isolated:
+                log.append('fast path: single dominant blob, skipping watershed')
+                self.path = 'components'
+                return self._gray
+
+        # erode
+        log.append('OP: erode')
+        cv2.erode(self._gray, self.kernel, dst=self._gray2)
+        started = self._timed('erode', started)
+
+        # distance_transform
+        log.append('OP: distance_transform')
+        cv2.distanceTransform(self._gray2, cv2.cv.CV_DIFF_L2, cv2.cv.CV_DIST_MASK_PRECISE,
+                              dst=self._distance)
+        started = self._timed('distance_transform', started)
+
+        # threshold_by_type(otsu=False, thresh=5)
+        log.append('OP: threshold_by_type')
+        thresh, _ = cv2.threshold(self._distance, 5, 255, cv2.THRESH_BINARY,
+                                  dst=self._seeds)
+        log.append('thresh:{}'.format(thresh))
+        started = self._timed('distance_threshold', started)
+
+        # dilate(iterations=7), and the border between the dilated blobs and the rest
+        log.append('OP: dilate')
+        cv2.dilate(self._seeds, self.kernel, dst=self._dilated, iterations=7)
+        cv2.erode(self._dilated, None, dst=self._border)
+        cv2.subtract(self._dilated, self._border, dst=self._border)
+        started = self._timed('dilate', started)
+
+        ndimage.measurements.label(self._seeds, output=self._labels)
+        np.equal(self._border, 255, out=self._mask)
+        self._labels[self._mask] = 255
+        started = self._timed('label', started)
+
+        cv2.watershed(image=self._color, markers=self._labels)
+        np.equal(self._labels, -1, out=self._mask)
+        self._labels[self._mask] = 0
+        self._gray[...] = self._labels
+        np.subtract(255, self._gray, out=self._gray)
+        self._timed('watershed', started)
+
+        self.path = 'watershed'
+        return self._gray
+
+    def _fish_is_isolated(self):
+        """Whether the thresholded frame is one blob of at least CONTOUR_FAST_PATH_MIN_AREA
+        pixels plus clutter that adds up to no more than CONTOUR_FAST_PATH_MAX_CLUTTER of
+        its area."""
+        blobs = ndimage.measurements.label(self._gray, structure=self.CONNECTIVITY,
+                                           output=self._labels)
+        if not blobs:
+            return False
+
+        areas = np.bincount(self._labels.ravel(), minlength=blobs + 1)[1:]
+        largest = areas.max()
+
+        return (largest >= ff_conf.CONTOUR_FAST_PATH_MIN_AREA and
+                areas.sum() - largest <= ff_conf.CONTOUR_FAST_PATH_MAX_CLUTTER * largest)
+
+
+_contour_pipelines = dict()
+
+
+def contour_pipeline(shape):
+    """This process's FishContourPipeline for frames of the given shape."""
+    try:
+        return _contour_pipelines[shape]
+    except KeyError:
+        pipeline = FishContourPipeline(shape)
+        _contour_pipelines[shape] = pipeline
+        return pipeline
 
 
 #
@@ -264,35 +400,47 @@ def mam_envelope(envelope, name, ints=True):
 
 
 @celery.shared_task(name='drone.get_fish_contour')
-def get_fish_contour(data, cal):
-    color_image = cv2.cvtColor(data.array, cv2.COLOR_GRAY2BGR)
-
-    delta_image(data, cal)
-    threshold_by_type(data)
-    erode(data)
-    distance_transform(data)
-    threshold_by_type(data, otsu=False, thresh=5)
-
-    markers = data.array.copy()
-    dilate(data, iterations=7)
-    border = data.array.copy()
-    border = border - cv2.erode(border, None)
-
-    markers, num_blobs = ndimage.measurements.label(markers)
-    markers[border == 255] = 255
-
-    markers = markers.astype(np.int32)
-    cv2.watershed(image=color_image, markers=markers)
-    markers[markers == -1] = 0
-    markers = 255 - markers.astype(np.uint8)
+def get_fish_contour(data, cal, stage_timings=False):
+    """
+    data is an FFImage, or a (path, meta) pair naming a media file that gets loaded here.
+    cal is an FFImage or an ImageReference.  With stage_timings set, the meta also gets
+    the seconds spent in each stage of FishContourPipeline.
+    """
+    if isinstance(data, (tuple, list)):
+        data = lmc.load_image(*data)
+    if isinstance(cal, ImageReference):
+        cal = cal.resolve()
+    if 'FFImage' in str(cal.__class__):
+        cal = cal.array
+
+    pipeline = contour_pipeline(data.array.shape)
+    markers = pipeline.run(data.array, cal, data.log)
 
     image = FFImage(markers, meta=data.meta, log=data.log)
 
     annotate_hu_moments(image)
 
     image.meta['timestamp'] = time.time()
+    image.meta['contour_path'] = pipeline.path
+    if stage_timings:
+        image.meta['stage_timings'] = dict(pipeline.timings)
+
+    return image.meta.as_dict()
 
-    return image.meta
+
+@celery.shared_task(name='drone.get_fish_contours_batch')
+def get_fish_contours_batch(data_list, cal, stage_timings=False):
+    """
+    get_fish_contour for every image in data_list against the same cal image, in one
+    task.  The cal image is resolved and decoded once, and every image runs through the
+    same pipeline buffers.  Returns the list of metas.
+    """
+    if isinstance(cal, ImageReference):
+        cal = cal.resolve()
+    if 'FFImage' in str(cal.__class__):
+        cal = cal.array
+
+    return [get_fish_contour(data, cal, stage_timings=stage_timings) for data in data_list]
 
 
 @celery.shared_task(name='drone.classify_data')
@@ -319,168 +467,34 @@ def compute_automatic_tags_with_estimator(analyses, estimator, scaler, label_del
 
 
 @celery.shared_task(name='drone.tagged_data_to_ellipse_box')
-def tagged_data_to_ellipse_box(args):
-    tag_id, data_jpeg, cal_jpeg, start, degrees, radius_of_roi = args
+def tagged_data_to_ellipse_box(args, score_surface=False, early_stop=None):
+    """cal is the (name, mtime) of the cal image file on the django host.  With
+    score_surface set, the envelope search's score surface is appended to the result for
+    diagnostics.  early_stop defaults to ENVELOPE_EARLY_STOP in fishface_config."""
+    tag_id, data_jpeg, cal, start, degrees, radius_of_roi = args
 
     data = cv2.imdecode(np.fromstring(data_jpeg, np.uint8), cv2.CV_LOAD_IMAGE_GRAYSCALE)
-    cal = cv2.imdecode(np.fromstring(cal_jpeg, np.uint8), cv2.CV_LOAD_IMAGE_GRAYSCALE)
-
-    delta = better_delta(data, cal)
-    start = np.array(start)
-
-    adjust = np.array([int(radius_of_roi), int(radius_of_roi/2)], dtype=np.int32)
-
-    retval, roi_corner, roi_far_corner = cv2.clipLine(
-        (0, 0, 512, 384),
-        tuple(start - adjust),
-        tuple(start + adjust),
-    )
-
-    rotate_matrix = cv2.getRotationMatrix2D(tuple(start), degrees, 1)
-    roi = cv2.warpAffine(delta, rotate_matrix, (512, 384))[
-        roi_corner[1]:roi_far_corner[1],
-        roi_corner[0]:roi_far_corner[0]
-    ]
-    roi = cv2.cvtColor(roi, cv2.COLOR_GRAY2RGB)
+    cal = lcc.media_calibration_frame(*cal)
 
-    roi_corner = np.array(roi_corner)
-    start = start - roi_corner
+    delta = lcu.better_delta(data, *cal.arrays)
 
-    color = int(np.average(
-        roi[start[1] - 2:start[1] + 2, start[0] - 2:start[0] + 2].astype(np.float32)
-    ))
-
-    scores = list()
-    for x in range(20, 60):
-        y_min = int(x/2.3)
-        y_max = int(x/1.5)
-        for y in range(y_min, y_max):
-            template = np.zeros((y, x, 3), dtype=np.uint8)
-            cv2.ellipse(img=template, box=((x // 2, y // 2), (x, y), 0),
-                        color=(color, color, color), thickness=-1)
-            match = cv2.minMaxLoc(cv2.matchTemplate(roi, template, cv2.TM_SQDIFF_NORMED))
-            scores.append((match[0], (x,y), match[2]))
-
-    good_scores = sorted(scores)[:10]
-    best_score, ellipse_size, ellipse_corner = sorted(good_scores, key=lambda x: -x[1][0]*x[1][1])[0]
-
-    return (tag_id, ellipse_size, color)
+    return (tag_id,) + tuple(les.find_ellipse_envelope(delta, start, degrees, radius_of_roi,
+                                                       early_stop=early_stop,
+                                                       score_surface=score_surface))
 
 
 @celery.shared_task(name='drone.compute_automatic_tags_with_ellipse_search')
 def compute_automatic_tags_with_ellipse_search(taggables, cals):
+    """cals maps the name of each cal image file on the django host to its mtime there."""
     image_tags = list()
-    for (image_id, data_jpeg, cal_name, envelope) in taggables:
-
-        delta = better_delta(image_string_to_array(data_jpeg),
-                             image_string_to_array(cals[cal_name]))
-
-        colors = mam_envelope(envelope, 'color')
-        majors = mam_envelope(envelope, 'major')
-        ratios = mam_envelope(envelope, 'ratio', ints=False)
-
-        results = list()
-        for color in colors:
-            for angle in range(0, 180, 10):
-                for ratio in ratios:
-                    for major in majors:
-                        template = np.zeros([int(envelope['major_max']) + 2] * 2, dtype=np.uint8)
-                        axes = (int(0.5 * major), int(0.5 * major / ratio))
-                        ellipse_params = {
-                            'img': template,
-                            'center': tuple([int(envelope['major_max']//2)] * 2),
-                            'axes': axes,
-                            'angle': angle,
-                            'startAngle': 0,
-                            'endAngle': 360,
-                            'color': int(color),
-                            'thickness': -1,
-                        }
-                        cv2.ellipse(**ellipse_params)
-                        non_zeroes = np.where(template!=0)
-                        nz_mins = np.amin(non_zeroes, axis=1)
-                        nz_maxes = np.amax(non_zeroes, axis=1)
-                        template = template[nz_mins[0]:nz_maxes[0] + 1, nz_mins[1]:nz_maxes[1] + 1]
-                        match = cv2.minMaxLoc(cv2.matchTemplate(
-                            delta, template, cv2.TM_SQDIFF_NORMED))
-                        results.append((match[0], (color, angle, ratio, major),
-                                        (match[2][0] + axes[1], match[2][1] + axes[0])
-                                       ))
-
-        intermediate_result = min(results)
-        (color, angle_approx, ratio, major) = intermediate_result[1]
-        axes = (int(major/2), int(0.5*major/ratio))
-
-        # for the second part of the algorithm, prefer a bit fatter ellipse
-        ratio -= - 0.2
-
-        results = list()
-        for angle in range(angle_approx - 11, angle_approx + 12):
-            template = np.zeros([major+2] * 2, dtype=np.uint8)
-            ellipse_params = {
-                'img': template,
-                'center': tuple([int(envelope['major_max']//2)] * 2),
-                'axes': axes,
-                'angle': angle,
-                'startAngle': 0,
-                'endAngle': 360,
-                'color': color,
-                'thickness': -1,
-            }
-            cv2.ellipse(**ellipse_params)
-            non_zeroes = np.where(template!=0)
-            nz_mins = np.amin(non_zeroes, axis=1)
-            nz_maxes = np.amax(non_zeroes, axis=1)
-            template = template[nz_mins[0]:nz_maxes[0]+1, nz_mins[1]:nz_maxes[1]+1]
-            match = cv2.minMaxLoc(cv2.matchTemplate(delta, template, cv2.TM_SQDIFF_NORMED))
-            results.append((
-                match[0],
-                angle,
-                (match[2][0] + axes[1], match[2][1] + axes[0])
-            ))
-
-        result = min(results)
-        score, angle, center = result
-
-        mask = np.ones((15, 15), dtype=np.uint8) * color
-
-        tail_search_radius = 0.75 * major
-
-        tail_center = tuple(map(int,
-                                (center[0] - tail_search_radius * math.cos(math.radians(angle)),
-                                 center[1] - tail_search_radius * math.sin(math.radians(angle)))))
-        tail_candidate = delta[tail_center[1] - 7:tail_center[1] + 8,
-                               tail_center[0] - 7:tail_center[0] + 8]
-
-        angle2 = (angle + 180) % 360
-        tail_center2 = tuple(map(int,
-                                 (center[0] - tail_search_radius * math.cos(math.radians(angle2)),
-                                  center[1] - tail_search_radius * math.sin(math.radians(angle2)))))
-        tail_candidate2 = delta[tail_center2[1] - 7:tail_center2[1] + 8,
-                                tail_center2[0] - 7:tail_center2[0] + 8]
-
-        diff = np.sum(cv2.absdiff(mask, tail_candidate) ** 2)
-        diff2 = np.sum(cv2.absdiff(mask, tail_candidate2) ** 2)
-
-        if diff2 < diff:
-            angle = angle2
-
-        length = major / 2
-
-        sin_a = math.sin(math.radians(angle))
-        cos_a = math.cos(math.radians(angle))
-
-        start = tuple(map(int, (center[0] - length * 0.25 * cos_a,
-                                center[1] - length * 0.25 * sin_a)))
-        end = tuple(map(int, (center[0] - length * cos_a,
-                              center[1] - length * sin_a)))
-
-        image_tags.append({
-            'image_id': image_id,
-            'start': start,
-            'end': end,
-            'score': score
-        })
+    for cal_name, envelope, image_ids, data in les.stacks(taggables):
+        cal = lcc.media_calibration_frame(cal_name, cals[cal_name])
+
+        deltas = lcu.better_delta(np.array([image_string_to_array(data_jpeg)
+                                            for data_jpeg in data]),
+                                  *cal.arrays)
+
+        image_tags.extend(les.ellipse_tags(image_ids, deltas, envelope))
 
     return image_tags
 
@@ -1,6 +1,7 @@
 import os
 import datetime
 import io
+import threading
 import collections
 
 import pytz
@@ -8,13 +9,23 @@ import pytz
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lib.django.django_fishface.settings')
 import lib.django.djff.models as dm
+import lib.contour_codec as lco
 import django.utils.timezone as dut
 import django.shortcuts as ds
 import django.core.files.base as dcfb
+import django.db.transaction as transaction
+from django.db import connection
+from django.db.models import AutoField
+from django.db.models.sql import InsertQuery
 
 import celery
-from lib.django_celery import celery_app
+import celery.signals
+from lib.django_celery import celery_app, close_database_connections
 
+from lib.fishface_image import FFImage, ImageReference
+import lib.write_behind as lwb
+
+import etc.fishface_config as ff_conf
 from lib.fishface_logging import logger, dense_log
 
 @celery.shared_task(name='results.ping')
@@ -33,60 +44,94 @@ def debug_task(self, *args, **kwargs):
 
 @celery.shared_task(name='results.store_analyses')
 def store_analyses(metas):
+    """
+    Stores the analysis in each meta in one transaction and returns the new analysis
+    IDs.  A single meta (not in a list) gets a single ID back.
+    """
     # if we only have one meta, wrap it in a list
-    if isinstance(metas, dict):
+    single = isinstance(metas, dict)
+    if single:
         metas = [metas]
 
-    for meta in metas:
-        # if we don't have an image ID in the metadata, there's not much use in proceeding
+    # if we don't have an image ID in the metadata, there's not much use in proceeding
+    try:
+        image_ids = [int(meta['image_id']) for meta in metas]
+    except KeyError:
+        raise AnalysisImportError('No image ID found in imported analysis metadata.')
+    images = dm.Image.objects.in_bulk(image_ids)
+
+    analyses = list()
+    for image_id, meta in zip(image_ids, metas):
         try:
-            image = dm.Image.objects.get(pk=int(meta['image_id']))
-            del meta['image_id']
+            image = images[image_id]
         except KeyError:
-            raise AnalysisImportError('No image ID found in imported analysis metadata.')
+            raise AnalysisImportError('No image with ID {} for imported analysis.'.format(
+                image_id))
+        del meta['image_id']
+        analyses.append(analysis_from_meta(image, meta))
+
+    # SQLite can't hand back the IDs of a bulk insert, so save each analysis, but all in
+    # one transaction
+    with transaction.atomic():
+        for analysis in analyses:
+            analysis.save()
+
+    analysis_ids = [analysis.id for analysis in analyses]
 
-        # remove the debugging and intermediate stuff that we don't need to keep
-        for key in 'log all_contours'.split(' '):
-            try:
-                del meta[key]
-            except KeyError:
-                pass
+    return analysis_ids[0] if single else analysis_ids
 
-        # translate the field names used during processing to the field names to store in the database
-        analysis_config = {
-            'analysis_datetime': 'timestamp',
-            'silhouette': 'largest_contour',
-            'hu_moments': 'hu_moments',
-            'moments': 'moments',
-        }
-        for key, meta_key in analysis_config.iteritems():
-            try:
-                analysis_config[key] = meta[meta_key]
-                del meta[meta_key]
-            except KeyError:
-                raise AnalysisImportError("Couldn't find '{}' in imported metadata.".format(meta_key))
 
-            if 'ndarray' in str(analysis_config[key].__class__):
-                analysis_config[key] = analysis_config[key].tolist()
+def analysis_from_meta(image, meta):
+    # remove the debugging and intermediate stuff that we don't need to keep
+    for key in 'log all_contours'.split(' '):
+        try:
+            del meta[key]
+        except KeyError:
+            pass
+
+    # translate the field names used during processing to the field names to store in the database
+    analysis_config = {
+        'analysis_datetime': 'timestamp',
+        'silhouette': 'largest_contour',
+        'hu_moments': 'hu_moments',
+        'moments': 'moments',
+    }
+    for key, meta_key in analysis_config.iteritems():
+        try:
+            analysis_config[key] = meta[meta_key]
+            del meta[meta_key]
+        except KeyError:
+            raise AnalysisImportError("Couldn't find '{}' in imported metadata.".format(meta_key))
 
-            if key == 'hu_moments':
-                analysis_config[key] = [x[0] for x in analysis_config[key]]
+        if key == 'silhouette':
+            analysis_config[key] = lco.encode_contour(analysis_config[key])
+            continue
 
-        analysis_config['analysis_datetime'] = datetime.datetime.utcfromtimestamp(
-            float(analysis_config['analysis_datetime'])).replace(tzinfo=dut.utc)
+        if 'ndarray' in str(analysis_config[key].__class__):
+            analysis_config[key] = analysis_config[key].tolist()
 
-        # whatever remains in the meta variable gets stored here
-        analysis_config['meta_data'] = meta
+        if key == 'hu_moments':
+            analysis_config[key] = [x[0] for x in analysis_config[key]]
 
-        analysis = dm.ImageAnalysis(image=image, **analysis_config)
+    analysis_config['analysis_datetime'] = datetime.datetime.utcfromtimestamp(
+        float(analysis_config['analysis_datetime'])).replace(tzinfo=dut.utc)
 
-        analysis.save()
+    # whatever remains in the meta variable gets stored here
+    analysis_config['meta_data'] = meta
 
-        return analysis.id
+    return dm.ImageAnalysis(image=image, **analysis_config)
 
 
 @celery.shared_task(name='results.post_image')
 def post_image(image_data, meta):
+    """
+    Stores a posted image.  The file is written right away, but the row only when the
+    write-behind buffer is flushed, so the 'id' this returns is None unless posting the
+    image filled the buffer and the flush saved the row (bulk inserted rows get no ID).
+    The stored file's 'path' is unique, so once the row is written it's the image with
+    that image_file.  With STREAMING_ANALYSIS on, the flush sends the image off to be
+    analyzed itself, once it has an ID.
+    """
     xp_id = meta.get('xp_id', False)
     cjr_id = meta.get('cjr_id', 0)
     if not xp_id and cjr_id:
@@ -115,8 +160,8 @@ def post_image(image_data, meta):
     )
 
     image = dm.Image(xp=xp, **image_config)
-    image.image_file.save(image.image_file.name, dcfb.ContentFile(image_data))
-    image.save()
+    image.image_file.save(image.image_file.name, dcfb.ContentFile(image_data), save=False)
+    write_behind.add('image', image)
 
     return {'id': image.id,
             'cjr_id': image.cjr_id,
@@ -124,6 +169,59 @@ def post_image(image_data, meta):
             'path': image.image_file.name}
 
 
+# cal image references for the jobs whose images were posted most recently, by CJR ID
+# and cal image ID.  The write-behind buffer's timer thread and whichever task fills the
+# buffer both analyze the images they flush, so the references are shared between threads.
+_cal_references = collections.OrderedDict()
+_cal_references_lock = threading.Lock()
+
+
+def cjr_cal_reference(cjr):
+    """
+    An ImageReference to the CJR's cal image, made once per CJR and cal image and kept
+    for the images that follow, or None if the CJR doesn't have a cal image yet.  A newer
+    cal image that resolves for the CJR gets a reference of its own.
+    """
+    cal_image_id = cjr.resolved_cal_image_id
+    if cal_image_id is None:
+        cal_image = cjr.cal_image
+        if cal_image is None:
+            return None
+        cal_image_id = cal_image.id
+    key = (cjr.id, cal_image_id)
+
+    with _cal_references_lock:
+        try:
+            reference = _cal_references.pop(key)
+        except KeyError:
+            cal_path = cjr.cal_image.image_file.path
+            reference = ImageReference(FFImage(source_filename=cal_path,
+                                               normalize_image=False),
+                                       source_path=cal_path)
+
+        _cal_references[key] = reference
+        while len(_cal_references) > ff_conf.STREAMING_ANALYSIS_CAL_REFERENCES:
+            _cal_references.popitem(last=False)
+
+    return reference
+
+
+def analyze_posted_image(image):
+    """Sends a freshly stored image off to be analyzed and to have its analysis stored."""
+    cal_reference = cjr_cal_reference(image.cjr)
+    if cal_reference is None:
+        logger.warning("No cal image for {}, so image {} wasn't analyzed as it arrived.".format(
+            image.cjr.full_slug, image.id))
+        return None
+
+    return celery.chain(
+        celery_app.signature('drone.get_fish_contour',
+                             args=((image.image_file.path, {'image_id': image.id}),
+                                   cal_reference)),
+        celery_app.signature('results.store_analyses')
+    ).apply_async()
+
+
 @celery.shared_task(name='results.new_cjr')
 def new_cjr(xp_id, voltage, current, start_timestamp):
     cjr = dm.CaptureJobRecord()
@@ -149,35 +247,102 @@ def job_status_report(status, start_timestamp, stop_timestamp, voltage, current,
         logger.debug('Still waiting for the CJR to be created for this job.')
         return
 
-    cjr = ds.get_object_or_404(dm.CaptureJobRecord, pk=int(cjr_id))
-
-    cjr.running = (status == "running")
-
-    cjr.job_start = dut.datetime.utcfromtimestamp(float(start_timestamp)).replace(tzinfo=dut.utc)
+    report = {
+        'running': (status == "running"),
+        'job_start': dut.datetime.utcfromtimestamp(
+            float(start_timestamp)).replace(tzinfo=dut.utc),
+        'total': int(total),
+        'remaining': int(remaining),
+    }
 
     if stop_timestamp is not None:
-        cjr.job_stop = dut.datetime.utcfromtimestamp(float(stop_timestamp)).replace(tzinfo=dut.utc)
-
-    cjr.total = int(total)
-    cjr.remaining = int(remaining)
-
-    cjr.save()
+        report['job_stop'] = dut.datetime.utcfromtimestamp(
+            float(stop_timestamp)).replace(tzinfo=dut.utc)
 
-    logger.info("Saved report for {}.".format(cjr.full_slug))
+    write_behind.add('job_status', (int(cjr_id), report))
 
-    return cjr.id
+    return int(cjr_id)
 
 
 @celery.shared_task(name='results.power_supply_report')
 def power_supply_log(timestamp, voltage_meas, current_meas, extra_report_data=None):
+    """Stores a power supply reading when the write-behind buffer is next flushed, so
+    there's no ID to return."""
     psl = dm.PowerSupplyLog()
     psl.measurement_datetime = dut.datetime.utcfromtimestamp(
         float(timestamp)).replace(tzinfo=dut.utc)
     psl.voltage_meas = voltage_meas
     psl.current_meas = current_meas
-    psl.save()
+    write_behind.add('power_supply_log', psl)
+
+
+@celery.shared_task(name='results.write_behind_metrics')
+def write_behind_metrics():
+    """The write-behind buffer's queue depths and flush latencies in this process."""
+    return write_behind.metrics()
+
+
+@celery.shared_task(name='results.flush_write_behind')
+def flush_write_behind():
+    return write_behind.flush()
+
+
+# Write-behind storage for the rows above
 
-    return psl.id
+
+def flush_images(images):
+    # a bulk insert skips the post_save signal, which makes a new cal image the cal image
+    # of the jobs it belongs to, and doesn't give back IDs, which analyzing an image as it
+    # arrives needs.  Those are saved one by one instead (still in the flush's transaction).
+    if not ff_conf.STREAMING_ANALYSIS:
+        dm.Image.objects.bulk_create([image for image in images if not image.is_cal_image])
+        for image in images:
+            if image.is_cal_image:
+                image.save()
+        return None
+
+    for image in images:
+        image.save()
+
+    def analyze_images():
+        for image in images:
+            if image.cjr_id and not image.is_cal_image:
+                analyze_posted_image(image)
+
+    return analyze_images
+
+
+def flush_job_status_reports(reports):
+    # only the latest report for each job matters
+    latest = collections.OrderedDict()
+    for cjr_id, report in reports:
+        latest.setdefault(cjr_id, dict()).update(report)
+
+    for cjr_id, report in latest.iteritems():
+        if not dm.CaptureJobRecord.objects.filter(pk=cjr_id).update(**report):
+            logger.error("Couldn't save report for nonexistent CJR {}.".format(cjr_id))
+
+    logger.info("Saved reports for CJRs {}.".format(', '.join(map(str, latest))))
+
+
+def flush_power_supply_logs(psls):
+    dm.PowerSupplyLog.objects.bulk_create(psls)
+
+
+write_behind = lwb.WriteBehindBuffer([('image', flush_images),
+                                      ('job_status', flush_job_status_reports),
+                                      ('power_supply_log', flush_power_supply_logs)],
+                                     max_rows=ff_conf.WRITE_BEHIND_MAX_ROWS,
+                                     max_age=ff_conf.WRITE_BEHIND_MAX_AGE,
+                                     max_attempts=ff_conf.WRITE_BEHIND_MAX_ATTEMPTS)
+
+
+@celery.signals.worker_process_shutdown.connect
+def flush_write_behind_at_shutdown(**kwargs):
+    logger.info('Flushing {} buffered rows before shutting down.'.format(write_behind.depth))
+    write_behind.flush()
+    # the flush may have reopened the connection that was closed at shutdown
+    close_database_connections()
 
 
 @celery.shared_task(name='results.store_estimator')
@@ -191,35 +356,95 @@ def store_estimator(ml_combo_data):
     return estimator_object.id
 
 
+def create_returning_ids(model, rows):
+    """
+    Inserts rows (unsaved model instances) and returns their new primary keys, in the
+    same order, setting each row's pk too.  Call this in a transaction.
+
+    Django 1.6's bulk_create can't hand back primary keys, so on PostgreSQL the rows go
+    in as multi-row INSERT ... RETURNING statements of up to INSERT_RETURNING_BATCH_SIZE
+    rows each.  Other databases (SQLite can't return the IDs of a bulk insert) save
+    each row, like store_analyses does.
+    """
+    if connection.vendor != 'postgresql':
+        for row in rows:
+            row.save()
+        return [row.pk for row in rows]
+
+    fields = [field for field in model._meta.local_concrete_fields
+              if not isinstance(field, AutoField)]
+    returning = ' RETURNING {}'.format(connection.ops.quote_name(model._meta.pk.column))
+    cursor = connection.cursor()
+
+    row_ids = list()
+    for start in range(0, len(rows), ff_conf.INSERT_RETURNING_BATCH_SIZE):
+        query = InsertQuery(model)
+        query.insert_values(fields, rows[start:start + ff_conf.INSERT_RETURNING_BATCH_SIZE])
+        for statement, params in query.get_compiler(connection=connection).as_sql():
+            cursor.execute(statement + returning, params)
+            row_ids.extend(row_id for (row_id,) in cursor.fetchall())
+
+    for row, row_id in zip(rows, row_ids):
+        row.pk = row_id
+    return row_ids
+
+
 @celery.shared_task(name='results.store_automatic_analysis_tags')
 def store_automatic_analysis_tags(automatic_tags):
-    for tag in automatic_tags:
-        auto_tag = dm.AutomaticTag()
-        auto_tag.image_analysis = dm.ImageAnalysis.objects.get(pk=tag['analysis_id'])
-        auto_tag.image_id = auto_tag.image_analysis.image_id
-        auto_tag.centroid = tag['centroid']
-        auto_tag.orientation = tag['orientation']
-        auto_tag.save()
+    """
+    Stores the automatic tags in one transaction, with create_returning_ids, and returns
+    their IDs.
+    """
+    analysis_ids = [int(tag['analysis_id']) for tag in automatic_tags]
+    image_ids = dict(dm.ImageAnalysis.objects.filter(
+        pk__in=analysis_ids).values_list('id', 'image_id'))
+
+    auto_tags = list()
+    for analysis_id, tag in zip(analysis_ids, automatic_tags):
+        try:
+            image_id = image_ids[analysis_id]
+        except KeyError:
+            raise AnalysisImportError('No analysis with ID {} for automatic tag.'.format(
+                analysis_id))
+        auto_tags.append(dm.AutomaticTag(image_id=image_id,
+                                         image_analysis_id=analysis_id,
+                                         centroid=tag['centroid'],
+                                         orientation=tag['orientation']))
+
+    if not auto_tags:
+        return list()
+
+    with transaction.atomic():
+        return create_returning_ids(dm.AutomaticTag, auto_tags)
 
 
 @celery.shared_task(name='results.store_ellipse_search_tags')
 def store_ellipse_search_tags(ellipse_tags):
-    tag_ids = list()
-    for tag in ellipse_tags:
-        ellipse_tag = dm.EllipseSearchTag()
-        ellipse_tag.image_id = tag['image_id']
-        ellipse_tag.int_start = tag['start']
-        ellipse_tag.int_end = tag['end']
-        ellipse_tag.score = tag['score']
-        ellipse_tag.save()
-        tag_ids.append(ellipse_tag.id)
+    """
+    Stores the ellipse search tags in one transaction, with create_returning_ids, and returns
+    their IDs.
+    """
+    # the int_start and int_end setters save the tag, so set the strings directly
+    search_tags = [dm.EllipseSearchTag(image_id=tag['image_id'],
+                                       start=dm.point_string(tag['start']),
+                                       end=dm.point_string(tag['end']),
+                                       foreground_box=dm.point_string(
+                                           tag.get('foreground_box', ())))
+                   for tag in ellipse_tags]
 
-    return tag_ids
+    if not search_tags:
+        return list()
+
+    logger.debug('Storing {} ellipse search tags; pruning avoided {} template matches.'.format(
+        len(search_tags), sum(tag.get('matches_avoided', 0) for tag in ellipse_tags)))
+
+    with transaction.atomic():
+        return create_returning_ids(dm.EllipseSearchTag, search_tags)
 
 
 @celery.shared_task(name='results.update_cjr_ellipse_envelope')
 def update_cjr_ellipse_envelope(args):
-    tag_id, ellipse_size, color = args
+    tag_id, ellipse_size, color = args[:3]
 
     tag = dm.ManualTag.objects.get(pk=tag_id)
     cjr = tag.image.cjr
@@ -254,7 +479,9 @@ def update_multiple_envelopes(envelope_data):
 
     cjrs = [dm.ManualTag.objects.get(pk=envelope_datum[0]).image.cjr for envelope_datum in envelope_data]
 
-    for (tag_id, ellipse_size, new_color), cjr in zip(envelope_data, cjrs):
+    for envelope_datum, cjr in zip(envelope_data, cjrs):
+        (tag_id, ellipse_size, new_color) = envelope_datum[:3]
+
         env = cooked_envelopes.get(cjr.id, None)
         if env is None:
             env = cjr.search_envelope
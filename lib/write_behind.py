@@ -0,0 +1,187 @@
+"""
+A write-behind buffer for the rows that the results worker writes as messages arrive.
+
+Rows are queued by kind, and each kind has a flusher that writes a list of its rows.
+The whole buffer is flushed in one transaction once it holds max_rows rows or its oldest
+row is max_age seconds old, whichever comes first, and when the worker process shuts
+down.  Each worker process has its own buffer, so rows that are still queued when a
+process dies without shutting down are lost.
+
+If that transaction fails, each kind is written again in a transaction of its own, and
+the rows of any kind that still fails go back on the queue to be retried on the timer.
+A kind's rows are dropped, with an error in the log, once it has failed max_attempts
+flushes in a row, so one bad row can't hold the queue forever.  Failures are logged
+rather than raised, since whichever task happened to fill the buffer has nothing to do
+with them.
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+import collections
+
+import django.db
+import django.db.transaction as transaction
+
+from lib.fishface_logging import logger
+
+
+class WriteBehindBuffer(object):
+    """
+    flushers maps each kind of row to a function that writes a list of them.  Flushers
+    run inside the flush's transaction; one that returns a callable has it called after
+    the transaction commits.  max_attempts is how many flushes in a row a kind may fail
+    before its queued rows are dropped.
+
+    metrics() reports the current queue depth for each kind and the flush counts and
+    latencies so far.
+    """
+
+    def __init__(self, flushers, max_rows, max_age, max_attempts=5):
+        self._flushers = collections.OrderedDict(flushers)
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+
+        self._lock = threading.RLock()
+        self._pending = dict((kind, list()) for kind in self._flushers)
+        self._depth = 0
+        self._timer = None
+        self._failures = dict((kind, 0) for kind in self._flushers)
+
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failed_flushes = 0
+        self.rows_dropped = 0
+        self.last_flush_seconds = None
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.max_depth = 0
+
+    def add(self, kind, row):
+        """Queues a row, and flushes if that fills the buffer."""
+        with self._lock:
+            self._pending[kind].append(row)
+            self._depth += 1
+            self.max_depth = max(self.max_depth, self._depth)
+
+            # while a kind is failing, its rows wait for the timer rather than being
+            # retried on every row that arrives
+            if self._depth >= self.max_rows and not any(self._failures.itervalues()):
+                self.flush()
+            else:
+                self._start_timer()
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def _start_timer(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.max_age, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Writes every queued row in one transaction and returns how many were written."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._depth:
+                return 0
+
+            pending, depth = self._pending, self._depth
+            self._pending = dict((kind, list()) for kind in self._flushers)
+            self._depth = 0
+
+            started = time.time()
+            try:
+                with transaction.atomic():
+                    after_commit = [self._flushers[kind](pending[kind])
+                                    for kind in self._flushers if pending[kind]]
+                written = depth
+                for kind in self._failures:
+                    self._failures[kind] = 0
+            except Exception:
+                self.failed_flushes += 1
+                logger.exception('Write-behind flush of {} rows failed; writing each kind '
+                                 'on its own.'.format(depth))
+                after_commit, written = self._flush_each_kind(pending)
+
+            elapsed = time.time() - started
+            self.flushes += 1
+            self.rows_flushed += written
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.total_flush_seconds += elapsed
+
+            if self._depth:
+                self._start_timer()
+
+        logger.debug('Write-behind flushed {} rows in {:.3f} s.'.format(written, elapsed))
+
+        for callback in after_commit:
+            if callable(callback):
+                try:
+                    callback()
+                except Exception:
+                    # the rows are written; only what was to follow them is lost
+                    logger.exception('Write-behind post-commit callback failed.')
+
+        return written
+
+    def _flush_each_kind(self, pending):
+        """Writes each kind of row in its own transaction, and puts back or drops the
+        rows of the kinds that fail.  Returns the post-commit callbacks and the number
+        of rows written."""
+        after_commit = list()
+        written = 0
+        for kind in self._flushers:
+            rows = pending[kind]
+            if not rows:
+                continue
+
+            try:
+                with transaction.atomic():
+                    after_commit.append(self._flushers[kind](rows))
+            except Exception:
+                self._failures[kind] += 1
+                if self._failures[kind] >= self.max_attempts:
+                    logger.exception('Dropping {} {} rows after {} failed flushes.'.format(
+                        len(rows), kind, self._failures[kind]))
+                    self._failures[kind] = 0
+                    self.rows_dropped += len(rows)
+                else:
+                    logger.exception('Flushing {} {} rows failed; they stay queued.'.format(
+                        len(rows), kind))
+                    self._pending[kind][:0] = rows
+                    self._depth += len(rows)
+            else:
+                self._failures[kind] = 0
+                written += len(rows)
+
+        return after_commit, written
+
+    def _timed_flush(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread has its own database connection
+            django.db.connection.close()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                'depth': dict((kind, len(rows)) for kind, rows in self._pending.iteritems()),
+                'max_depth': self.max_depth,
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'rows_flushed': self.rows_flushed,
+                'rows_dropped': self.rows_dropped,
+                'last_flush_seconds': self.last_flush_seconds,
+                'max_flush_seconds': self.max_flush_seconds,
+                'mean_flush_seconds': (self.total_flush_seconds / self.flushes
+                                       if self.flushes else None),
+            }